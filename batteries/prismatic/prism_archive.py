@@ -0,0 +1,453 @@
+import os, sys, json, zlib, struct, hashlib, argparse
+import numpy as np
+
+from functools import lru_cache
+
+from prism_index import DATA_DIR, INDEX_FILE, OUTPUT_FILES, OUTPUTS, \
+    CALCULATION_PATTERN, PrismIndex, sites_magnetization
+
+ARCHIVE_FILE = "li2mno3_prism.parc"
+
+MAGIC = b"PRISMARC1\n"
+# Offset of the table of contents, followed by the MAGIC
+FOOTER = struct.Struct("<Q10s")
+
+COMPRESSION_LEVEL = 9
+
+# Values that are smaller than this when encoded are stored inline in their parent
+MIN_OBJECT_SIZE = 256
+# Numeric lists with fewer elements are left as JSON
+MIN_ARRAY_SIZE = 16
+# Largest number of decimals for which floats are stored as scaled integers
+MAX_DECIMALS = 12
+
+# Indentations tried to reproduce the original bytes of the JSON files
+INDENTS = (None, 4, 2)
+
+SKIPPED_FILES = (INDEX_FILE, ".DS_Store")
+
+# Keys of the dictionaries that replace values in the stored JSON. The keys of the
+# dictionaries in the files that are one of these, or start with "@@", are
+# escaped with an extra "@".
+RESERVED_KEYS = ("@ref", "@array", "@records")
+
+
+def _key(payload):
+    return hashlib.sha1(payload).hexdigest()[:20]
+
+
+def _escape(key):
+    return "@" + key if key in RESERVED_KEYS or key.startswith("@@") else key
+
+
+def _unescape(key):
+    return key[1:] if key.startswith("@@") else key
+
+
+def _numeric_array(value):
+    """
+    The rectangular list value as an array, or None in case it is ragged or its
+    elements are not all floats or all integers, i.e. if it cannot be restored
+    exactly.
+    """
+    try:
+        leaves = np.array(value, dtype=object)
+    except ValueError:
+        return None
+
+    types = {type(x) for x in leaves.flat}
+    if types == {float}:
+        return leaves.astype(np.float64)
+    if types == {int}:
+        try:
+            return leaves.astype(np.int64)
+        except OverflowError:
+            return None
+    return None
+
+
+def _decimals(array):
+    """
+    Smallest number of decimals with which all floats in the array are restored
+    exactly by dividing integers by a power of 10, along with those integers, or
+    None, None in case there is no such number up to MAX_DECIMALS.
+    """
+    if np.any(np.signbit(array) & (array == 0)):
+        return None, None
+    for decimals in range(MAX_DECIMALS + 1):
+        scaled = np.round(array * 10.0 ** decimals)
+        if np.abs(scaled).max() >= 2 ** 53:
+            break
+        if np.array_equal(scaled / 10.0 ** decimals, array):
+            return decimals, scaled.astype(np.int64)
+    return None, None
+
+
+def _narrow(array):
+    """
+    The integer array in the smallest integer type that holds its values.
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= array.min() and array.max() <= info.max:
+            return array.astype(dtype)
+    return array
+
+
+def _shuffle(array):
+    """
+    Bytes of the array grouped by their position in each element, i.e. all first
+    bytes, then all second bytes and so on. The exponents and high bytes of the
+    mantissas of similar floats are then adjacent, which compresses much better.
+    """
+    return np.ascontiguousarray(
+        array.view(np.uint8).reshape(-1, array.dtype.itemsize).T
+    ).tobytes()
+
+
+def _read_array(data, reference):
+    """
+    The array of an {"@array": key} reference from the stored bytes data.
+    """
+    stored = np.dtype(reference["stored"])
+    array = np.frombuffer(data, dtype=np.uint8).reshape(stored.itemsize, -1).T.copy() \
+        .view(stored).reshape(reference["shape"], order="F")
+    if "decimals" in reference:
+        return array / 10.0 ** reference["decimals"]
+    return array.astype(reference["dtype"])
+
+
+class ArchiveWriter:
+    """
+    Writer of a content-addressed archive of files, in which JSON files are split
+    into objects that are stored once, however often they occur.
+
+    Every list, dictionary and numeric array of a JSON file that is at least
+    MIN_OBJECT_SIZE bytes is stored as a separate compressed object, keyed by the
+    hash of its content and replaced by a {"@ref": key} in its parent. Identical
+    structures, INCAR parameters etc. of different calculations are hence stored
+    only once. Rectangular lists of numbers, such as the forces and stresses of the
+    ionic steps, are stored as binary arrays, and lists of dictionaries with the
+    same keys, such as the ionic steps or sites, as a column per key, so the
+    values of each key, e.g. the magnetic moments of all sites, form a single
+    array.
+
+    Other files are stored as a single compressed object.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC)
+        self.objects = {}
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _put(self, key, data):
+        if key not in self.objects:
+            data = zlib.compress(data, COMPRESSION_LEVEL)
+            self.objects[key] = (self.file.tell(), len(data))
+            self.file.write(data)
+        return key
+
+    def _put_array(self, array):
+        """
+        Store a numeric array, with floats that have few decimals, like the
+        eigenvalues, as scaled integers, and integers in the smallest type. The
+        values are stored in Fortran order, so e.g. the x, y and z components of
+        the forces are stored one after the other, and shuffled.
+        """
+        reference = {"@array": _key(array.dtype.str.encode() + str(array.shape).encode()
+                                    + array.tobytes()),
+                     "dtype": array.dtype.str, "shape": list(array.shape)}
+        if array.dtype.kind == "f":
+            decimals, scaled = _decimals(array)
+            if decimals is not None:
+                reference["decimals"] = decimals
+                array = scaled
+        if array.dtype.kind == "i":
+            array = _narrow(array)
+
+        reference["stored"] = array.dtype.str
+        self._put(reference["@array"], _shuffle(array.ravel(order="F")))
+        return reference
+
+    def _encode(self, value):
+        if isinstance(value, list):
+            array = _numeric_array(value) if value else None
+            if array is not None and array.size >= MIN_ARRAY_SIZE:
+                return self._put_array(array)
+
+            keys = list(value[0]) if value and isinstance(value[0], dict) else None
+            if keys and len(value) > 1 and all(
+                    isinstance(v, dict) and list(v) == keys for v in value):
+                value = {"@records": keys,
+                         "columns": [self._encode([v[k] for v in value]) for k in keys]}
+            else:
+                value = [self._encode(v) for v in value]
+        elif isinstance(value, dict):
+            value = {_escape(k): self._encode(v) for k, v in value.items()}
+        else:
+            return value
+
+        payload = json.dumps(value, separators=(",", ":")).encode()
+        if len(payload) < MIN_OBJECT_SIZE:
+            return value
+        return {"@ref": self._put(_key(payload), payload)}
+
+    def add(self, path, data):
+        """
+        Add a file with the bytes data under path. JSON files that are reproduced
+        exactly by json.dumps with one of the INDENTS are split into objects, other
+        files are stored as is.
+        """
+        path = path.replace(os.sep, "/")
+        if path.endswith(".json"):
+            try:
+                value = json.loads(data)
+            except ValueError:
+                value = None
+            for indent in INDENTS:
+                if value is not None and json.dumps(value, indent=indent).encode() == data:
+                    self.files[path] = {"json": self._encode(value), "indent": indent}
+                    return
+        self.files[path] = {"bytes": self._put(_key(data), data)}
+
+    def close(self):
+        if self.file.closed:
+            return
+        offset = self.file.tell()
+        self.file.write(zlib.compress(json.dumps(
+            {"files": self.files, "objects": self.objects}, separators=(",", ":")
+        ).encode(), COMPRESSION_LEVEL))
+        self.file.write(FOOTER.pack(offset, MAGIC))
+        self.file.close()
+
+
+class Archive:
+    """
+    Reader of an archive written by ArchiveWriter, with random access to the
+    files and the values in their JSON. Only the table of contents and the
+    objects that are needed are read, e.g. reading the final energy of a
+    calculation only reads the small object of the "output" of its data.json.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.bytes_read = 0
+
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        end = self.file.tell()
+        offset, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(filename + " is not an archive of calculation outputs.")
+
+        self.file.seek(offset)
+        contents = json.loads(zlib.decompress(self.file.read(end - offset)))
+        self.files = contents["files"]
+        self.objects = contents["objects"]
+
+        self._object = lru_cache(maxsize=1024)(self._read_object)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def _read_object(self, key):
+        offset, length = self.objects[key]
+        self.file.seek(offset)
+        self.bytes_read += length
+        return zlib.decompress(self.file.read(length))
+
+    def _resolve(self, value):
+        """
+        Value with the reference at its top level replaced by the object, without
+        resolving the references inside it.
+        """
+        if isinstance(value, dict):
+            if "@ref" in value:
+                return json.loads(self._object(value["@ref"]))
+            if "@array" in value:
+                return _read_array(self._object(value["@array"]), value).tolist()
+        return value
+
+    def _decode(self, value):
+        value = self._resolve(value)
+        if isinstance(value, list):
+            return [self._decode(v) for v in value]
+        if isinstance(value, dict):
+            if "@records" in value:
+                columns = [self._decode(c) for c in value["columns"]]
+                return [dict(zip(value["@records"], row)) for row in zip(*columns)]
+            return {_unescape(k): self._decode(v) for k, v in value.items()}
+        return value
+
+    def load(self, path):
+        """
+        The content of the JSON file at path.
+        """
+        return self._decode(self.files[path]["json"])
+
+    def read_bytes(self, path):
+        """
+        The original bytes of the file at path.
+        """
+        entry = self.files[path]
+        if "bytes" in entry:
+            return self._object(entry["bytes"])
+        return json.dumps(self.load(path), indent=entry["indent"]).encode()
+
+    def read_keys(self, path, paths):
+        """
+        Values of the key paths in the JSON file at path, like read_json_keys in
+        prism_index, but only reading the objects along the paths. Returns a
+        dictionary with the value of each path, or None for the paths that are not
+        in the file.
+        """
+        values = {}
+        for key_path in paths:
+            value = self._resolve(self.files[path]["json"])
+            for key in key_path:
+                if not isinstance(value, dict) or "@records" in value \
+                        or _escape(key) not in value:
+                    value = None
+                    break
+                value = self._resolve(value[_escape(key)])
+            values[tuple(key_path)] = self._decode(value)
+        return values
+
+    def extract(self, output_dir, paths=None):
+        """
+        Write the files at paths, by default all of them, to output_dir.
+        """
+        for path in paths or self.files:
+            filename = os.path.join(output_dir, *path.split("/"))
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "wb") as file:
+                file.write(self.read_bytes(path))
+
+
+class ArchivedPrismIndex(PrismIndex):
+    """
+    PrismIndex of the calculations in an Archive of the data directory, which only
+    reads the objects of the archive that hold the outputs. The index is not
+    stored, since reading it from the archive is fast.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.data_dir = archive.filename
+        self.index_file = None
+        self.update()
+
+    def _load(self):
+        return {}
+
+    def _find(self):
+        calculations = {}
+        for path in self.archive:
+            parts = path.split("/")
+            if len(parts) != 4 or not parts[0].endswith("_li") \
+                    or parts[3] not in OUTPUT_FILES:
+                continue
+            match = CALCULATION_PATTERN.match(parts[2])
+            if match is not None:
+                calculations["/".join(parts[:3])] = dict(
+                    match.groupdict(), model=parts[1],
+                    li_concentration=parts[0][:-len("_li")]
+                )
+        for directory in sorted(calculations):
+            yield directory, calculations[directory], []
+
+    def _read(self, directory):
+        data_file = directory + "/data.json"
+        values = self.archive.read_keys(data_file, OUTPUTS.values()) \
+            if data_file in self.archive else {}
+        outputs = {k: np.nan if values.get(path) is None else values[path]
+                   for k, path in OUTPUTS.items()}
+
+        cathode_file = directory + "/final_cathode.json"
+        outputs["magnetization"] = sites_magnetization(
+            self.archive.read_keys(cathode_file, [("sites",)])[("sites",)] or []
+        ) if cathode_file in self.archive else np.nan
+
+        return outputs
+
+
+def pack(data_dir=DATA_DIR, archive_file=ARCHIVE_FILE):
+    """
+    Store all files in data_dir, except the SKIPPED_FILES, in an archive with
+    their paths relative to data_dir.
+    """
+    with ArchiveWriter(archive_file) as writer:
+        for root, directories, filenames in os.walk(data_dir):
+            directories.sort()
+            for filename in sorted(filenames):
+                if filename in SKIPPED_FILES:
+                    continue
+                with open(os.path.join(root, filename), "rb") as file:
+                    writer.add(os.path.relpath(os.path.join(root, filename), data_dir),
+                               file.read())
+
+
+def verify(archive_file=ARCHIVE_FILE, data_dir=DATA_DIR):
+    """
+    Paths of the files in the archive that differ from those in data_dir, or that
+    are missing in data_dir or cannot be restored from the archive.
+    """
+    different = []
+    with Archive(archive_file) as archive:
+        for path in archive:
+            try:
+                with open(os.path.join(data_dir, *path.split("/")), "rb") as file:
+                    identical = file.read() == archive.read_bytes(path)
+            except Exception:
+                identical = False
+            if not identical:
+                different.append(path)
+    return different
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Pack the calculation outputs in a deduplicated archive, or unpack it."
+    )
+    parser.add_argument("command", choices=("pack", "unpack", "verify"))
+    parser.add_argument("archive", nargs="?", default=ARCHIVE_FILE)
+    parser.add_argument("data_dir", nargs="?", default=DATA_DIR)
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack(args.data_dir, args.archive)
+        print("Packed %s into %s (%.1f MB)." % (
+            args.data_dir, args.archive, os.path.getsize(args.archive) / 1e6))
+    elif args.command == "unpack":
+        with Archive(args.archive) as archive:
+            archive.extract(args.data_dir)
+    else:
+        different = verify(args.archive, args.data_dir)
+        for path in different:
+            print("Different: " + path)
+        if different:
+            sys.exit(1)
+        print("All files are identical.")
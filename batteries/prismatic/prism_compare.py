@@ -0,0 +1,174 @@
+import os, sys, json, csv, argparse
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from monty.io import zopen
+from pymatgen import Structure, Lattice
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+from prism_index import DATA_DIR, METADATA, find_calculations
+
+SYMPREC = 0.01
+COMPARISON_FILE = "comparison.csv"
+
+# Offsets of the periodic images considered for the site displacements
+IMAGES = np.array(list(product((-1, 0, 1), repeat=3)))
+
+COLUMNS = METADATA + (
+    "n_sites", "volume_change", "strain_a", "strain_b", "strain_c", "max_strain",
+    "rms_displacement", "max_displacement", "initial_spacegroup", "final_spacegroup",
+    "symmetry_changed"
+)
+
+
+def read_cathode(filename):
+    """
+    Lattice matrix, fractional coordinates and elements of the occupied sites of
+    a (pybat) Cathode in the json format. Sites without species are vacancies, which
+    are left out.
+    """
+    with zopen(filename, "rt") as file:
+        data = json.load(file)
+
+    sites = [s for s in data["sites"] if s["species"]]
+    return (np.array(data["lattice"]["matrix"]),
+            np.array([s["abc"] for s in sites], dtype=float).reshape(-1, 3),
+            [s["species"][0]["element"] for s in sites])
+
+
+def lattice_strain(initial_lattice, final_lattice):
+    """
+    Green-Lagrange strain tensor of the deformation of the initial lattice into
+    the final one, given as matrices with the lattice vectors as rows.
+    """
+    deformation = np.linalg.solve(initial_lattice, final_lattice).T
+    return (deformation.T @ deformation - np.eye(3)) / 2
+
+
+def site_displacements(initial_coords, final_coords, lattice):
+    """
+    Cartesian displacement of each site between two arrays of fractional
+    coordinates, taking the periodic image of the final site that is closest to
+    the initial one. All sites and IMAGES are handled at once, and the average
+    displacement of the sites, i.e. a rigid translation of the structure, is
+    removed.
+    """
+    difference = final_coords - initial_coords
+    difference -= np.round(difference)
+
+    vectors = (difference[:, None, :] + IMAGES[None, :, :]) @ lattice
+    closest = np.argmin(np.sum(vectors ** 2, axis=-1), axis=1)
+    displacements = vectors[np.arange(len(vectors)), closest]
+
+    return displacements - displacements.mean(axis=0)
+
+
+def spacegroup(lattice, coords, elements, symprec=SYMPREC):
+    structure = Structure(Lattice(lattice), elements, coords)
+    return SpacegroupAnalyzer(structure, symprec=symprec).get_space_group_symbol()
+
+
+def compare_calculation(directory):
+    """
+    Compare the initial_cathode.json and final_cathode.json of a relaxation: the
+    change in volume, the strain along the lattice vectors and the largest
+    principal strain, the RMS and largest site displacement (in Angstrom, with the
+    sites compared in the final lattice) and the space groups.
+    """
+    initial_lattice, initial_coords, initial_elements = read_cathode(
+        os.path.join(directory, "initial_cathode.json"))
+    final_lattice, final_coords, final_elements = read_cathode(
+        os.path.join(directory, "final_cathode.json"))
+
+    strain = lattice_strain(initial_lattice, final_lattice)
+    lengths = np.linalg.norm(initial_lattice, axis=1), np.linalg.norm(final_lattice, axis=1)
+
+    result = {
+        "n_sites": len(final_elements),
+        "volume_change": abs(np.linalg.det(final_lattice) / np.linalg.det(initial_lattice)) - 1,
+        "strain_a": lengths[1][0] / lengths[0][0] - 1,
+        "strain_b": lengths[1][1] / lengths[0][1] - 1,
+        "strain_c": lengths[1][2] / lengths[0][2] - 1,
+        "max_strain": float(np.max(np.abs(np.linalg.eigvalsh(strain))))
+    }
+
+    if initial_elements == final_elements:
+        distances = np.linalg.norm(
+            site_displacements(initial_coords, final_coords, final_lattice), axis=1
+        )
+        result["rms_displacement"] = float(np.sqrt(np.mean(distances ** 2)))
+        result["max_displacement"] = float(distances.max())
+    else:
+        # The sites of both structures do not correspond
+        result["rms_displacement"] = result["max_displacement"] = np.nan
+
+    result["initial_spacegroup"] = spacegroup(initial_lattice, initial_coords,
+                                              initial_elements)
+    result["final_spacegroup"] = spacegroup(final_lattice, final_coords, final_elements)
+    result["symmetry_changed"] = result["initial_spacegroup"] != result["final_spacegroup"]
+
+    return result
+
+
+def _compare(calculation):
+    try:
+        return dict(calculation, **compare_calculation(calculation["directory"]))
+    except (OSError, ValueError, KeyError, np.linalg.LinAlgError) as error:
+        return dict(calculation, error=repr(error))
+
+
+def compare_all(data_dir=DATA_DIR, workers=None):
+    """
+    Compare the initial and final structure of every relaxation in data_dir that
+    has both, using a pool of workers processes. Returns the comparisons as a list
+    of dictionaries with the METADATA and the results of compare_calculation, or
+    the error in case the comparison failed.
+    """
+    calculations = [
+        c for c in find_calculations(data_dir) if c["calc_type"] == "relax" and all(
+            os.path.isfile(os.path.join(c["directory"], f))
+            for f in ("initial_cathode.json", "final_cathode.json")
+        )
+    ]
+
+    if workers == 1 or len(calculations) < 2:
+        return [_compare(c) for c in calculations]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_compare, calculations, chunksize=4))
+
+
+def write_comparison(comparisons, filename):
+    """
+    Write the comparisons to a csv file with the COLUMNS, leaving out the ones
+    that failed.
+    """
+    with open(filename, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for c in comparisons:
+            if "error" in c:
+                continue
+            writer.writerow(["%.6g" % c[k] if isinstance(c[k], float) else c[k]
+                             for k in COLUMNS])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Compare the initial and final structures of all relaxations."
+    )
+    parser.add_argument("data_dir", nargs="?", default=DATA_DIR)
+    parser.add_argument("-o", "--output", default=COMPARISON_FILE)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    comparisons = compare_all(args.data_dir, workers=args.workers)
+    for c in comparisons:
+        if "error" in c:
+            print("Failed for " + c["directory"] + ": " + c["error"], file=sys.stderr)
+
+    write_comparison(comparisons, args.output)
+    print(args.output)
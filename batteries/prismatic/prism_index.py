@@ -0,0 +1,372 @@
+import os, re, json
+import numpy as np
+
+from monty.io import zopen
+
+DATA_DIR = "li2mno3_prism"
+INDEX_FILE = ".prism_index.npz"
+
+CALCULATION_PATTERN = re.compile(r"^(?P<functional>.+)_(?P<calc_type>relax|scf)$")
+
+# Files of a calculation, of which at least one has to be present
+OUTPUT_FILES = ("data.json", "final_cathode.json")
+
+# Key paths of the scalar outputs in the data.json of a calculation
+OUTPUTS = {
+    "energy": ("output", "final_energy"),
+    "energy_per_atom": ("output", "final_energy_per_atom"),
+    "volume": ("output", "crystal", "lattice", "volume")
+}
+
+METADATA = ("model", "li_concentration", "functional", "calc_type")
+COLUMNS = METADATA + tuple(OUTPUTS) + ("magnetization",)
+
+TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]:]|"')
+ESCAPE = re.compile(rb"\\.", re.DOTALL)
+WHITESPACE = re.compile(rb"\s*")
+VALUE_END = re.compile(rb"\s*[,}\]]")
+
+
+def _container_end(data, start, depth, in_string):
+    """
+    Look for the end of a JSON container in the bytes data from start, given the
+    depth of the brackets and whether a string is open at start. The brackets are
+    counted with NumPy, leaving out those in strings.
+
+    Returns the index after the container, or None in case it does not end in data,
+    along with the index up to which data was scanned and the depth and in_string
+    at that point.
+    """
+    stop = len(data)
+    trailing = 0
+    while stop - trailing > start and data[stop - 1 - trailing] == ord("\\"):
+        trailing += 1
+    # A backslash at the end escapes the first byte of the next chunk
+    stop -= trailing % 2
+    if stop == start:
+        return None, stop, depth, in_string
+
+    if data.find(b"\\", start, stop) == -1:
+        codes = np.frombuffer(data, dtype=np.uint8, count=stop - start, offset=start)
+    else:
+        codes = np.frombuffer(ESCAPE.sub(b"__", data[start:stop]), dtype=np.uint8)
+
+    inside = (np.cumsum(codes == ord('"'), dtype=np.int32) + in_string) % 2 == 1
+    delta = ((codes == ord("{")) | (codes == ord("["))).view(np.int8) \
+        - ((codes == ord("}")) | (codes == ord("]"))).view(np.int8)
+    delta[inside] = 0
+    levels = depth + np.cumsum(delta, dtype=np.int32)
+
+    closed = np.flatnonzero(levels == 0)
+    if len(closed):
+        return start + int(closed[0]) + 1, stop, 0, False
+    return None, stop, int(levels[-1]), bool(inside[-1])
+
+
+def read_json_keys(filename, paths, chunk_size=2 ** 16):
+    """
+    Values of the key paths of a JSON file, e.g. ("output", "final_energy") for
+    data["output"]["final_energy"], where the path only goes through objects.
+
+    The file is read in chunks of chunk_size bytes until all paths have been
+    found, and the remainder of the file is not read. Only the keys of the objects
+    along the paths are tokenized, and all other containers are skipped by counting
+    brackets, so none of the values other than those of the paths are decoded.
+
+    Returns a dictionary with the value of each path, or None for the paths that
+    are not in the file.
+    """
+    wanted = {tuple(p) for p in paths}
+    prefixes = {p[:i] for p in wanted for i in range(len(p))}
+    values = dict.fromkeys(wanted)
+
+    buffer = b""
+    position = 0
+    keys = []  # path of the open object, below the root object
+    depth, in_string = 0, False  # state of the container that is being skipped
+    started = False
+    last_string = None
+    pending_key = None
+
+    with zopen(filename, "rb") as file:
+        while wanted:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            # Drop what has been processed, which is never looked at again
+            buffer = buffer[position:] + chunk
+            position = 0
+
+            while wanted:
+                if depth:
+                    end, position, depth, in_string = _container_end(
+                        buffer, position, depth, in_string
+                    )
+                    if end is None:
+                        break
+                    position = end
+                    continue
+
+                match = TOKEN.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+
+                token = match.group()
+                if token == b'"':
+                    # A string that continues in the next chunk
+                    position = match.start()
+                    break
+                elif token in (b"{", b"["):
+                    if not started:
+                        started = True
+                        if token == b"[":
+                            depth, in_string = 1, False
+                    elif token == b"{" and tuple(keys) + (pending_key,) in prefixes:
+                        keys.append(pending_key)
+                    else:
+                        depth, in_string = 1, False
+                elif token in (b"}", b"]"):
+                    if keys:
+                        keys.pop()
+                elif token == b":":
+                    pending_key = json.loads(last_string)
+                    path = tuple(keys) + (pending_key,)
+                    if path in wanted:
+                        value, end = _decode_value(buffer, match.end())
+                        if end is None:
+                            # The value may be cut off by the end of the chunk
+                            position = match.start()
+                            break
+                        for other in [p for p in wanted if p[:len(path)] == path]:
+                            values[other] = _lookup(value, other[len(path):])
+                            wanted.discard(other)
+                        position = end
+                        continue
+                else:
+                    last_string = token
+
+                position = match.end()
+
+    return values
+
+
+def _decode_value(data, start):
+    """
+    JSON value in the bytes data at start and the index after it, or None, None in
+    case the value is not complete, i.e. not followed by a comma or bracket.
+    """
+    start = WHITESPACE.match(data, start).end()
+    text = data[start:].decode(errors="ignore")
+    try:
+        value, end = json.JSONDecoder().raw_decode(text)
+    except ValueError:
+        return None, None
+
+    end = start + len(text[:end].encode())
+    if VALUE_END.match(data, end) is None:
+        return None, None
+    return value, end
+
+
+def _lookup(value, path):
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def total_magnetization(cathode_file):
+    """
+    Sum of the magnetic moments of the sites of a Cathode, or NaN in case the
+    sites have no magmom.
+    """
+    with zopen(cathode_file, "rt") as file:
+        return sites_magnetization(json.load(file)["sites"])
+
+
+def sites_magnetization(sites):
+    """
+    Sum of the magnetic moments of the sites, as dictionaries, or NaN in case they
+    have no magmom.
+    """
+    magmoms = [s["properties"].get("magmom") for s in sites]
+    if not magmoms or None in magmoms:
+        return np.nan
+    return float(np.sum(magmoms))
+
+
+def find_calculations(data_dir=DATA_DIR):
+    """
+    Calculations in the <Li concentration>_li/<model>/<functional>_<relax|scf>
+    directories of data_dir that have any of the OUTPUT_FILES, as dictionaries with
+    the METADATA, the directory and the OUTPUT_FILES it has.
+    """
+    calculations = []
+    for conc_dir in sorted(os.listdir(data_dir)):
+        if not conc_dir.endswith("_li"):
+            continue
+        for model in sorted(os.listdir(os.path.join(data_dir, conc_dir))):
+            model_dir = os.path.join(data_dir, conc_dir, model)
+            if not os.path.isdir(model_dir):
+                continue
+            for calculation in sorted(os.listdir(model_dir)):
+                match = CALCULATION_PATTERN.match(calculation)
+                directory = os.path.join(model_dir, calculation)
+                if match is None:
+                    continue
+                files = [f for f in OUTPUT_FILES
+                         if os.path.isfile(os.path.join(directory, f))]
+                if files:
+                    calculations.append(dict(match.groupdict(), model=model,
+                                             li_concentration=conc_dir[:-len("_li")],
+                                             directory=directory, output_files=files))
+    return calculations
+
+
+def read_calculation(directory):
+    """
+    The scalar OUTPUTS of a calculation, along with the total magnetization of
+    the final structure. Outputs that are not available are NaN.
+    """
+    data_file = os.path.join(directory, "data.json")
+    values = read_json_keys(data_file, OUTPUTS.values()) \
+        if os.path.isfile(data_file) else {}
+    outputs = {k: np.nan if values.get(path) is None else values[path]
+               for k, path in OUTPUTS.items()}
+
+    cathode_file = os.path.join(directory, "final_cathode.json")
+    outputs["magnetization"] = total_magnetization(cathode_file) \
+        if os.path.isfile(cathode_file) else np.nan
+
+    return outputs
+
+
+class PrismIndex:
+    """
+    Index of the calculations of the prismatic models in data_dir, with their
+    METADATA and scalar outputs as columns.
+
+    The columns are stored in INDEX_FILE in data_dir, along with the size and
+    modification time of each of the OUTPUT_FILES of every calculation. On
+    construction, only the calculations that are new or have changed since are
+    read. Subclasses that read the calculations from elsewhere override _find and
+    _read, and set index_file to None in case the index should not be stored.
+    """
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self.index_file = os.path.join(data_dir, INDEX_FILE)
+        self.update()
+
+    def _load(self):
+        """
+        Fingerprint and record of each calculation in INDEX_FILE.
+        """
+        try:
+            with np.load(self.index_file) as index:
+                columns = {c: index[c].tolist() for c in COLUMNS}
+                return {d: (f, {c: columns[c][i] for c in COLUMNS}) for i, (d, f) in
+                        enumerate(zip(index["directory"].tolist(),
+                                      index["fingerprint"].tolist()))}
+        except (FileNotFoundError, KeyError, ValueError):
+            return {}
+
+    def _find(self):
+        """
+        Directory relative to data_dir, METADATA and fingerprint of each
+        calculation. The fingerprint holds the size and modification time of each
+        of the OUTPUT_FILES, i.e. every file read_calculation reads, with -1 for
+        those that are missing.
+        """
+        for calculation in find_calculations(self.data_dir):
+            directory = os.path.relpath(calculation.pop("directory"), self.data_dir)
+            output_files = calculation.pop("output_files")
+            fingerprint = []
+            for output_file in OUTPUT_FILES:
+                if output_file in output_files:
+                    stat = os.stat(os.path.join(self.data_dir, directory, output_file))
+                    fingerprint += [stat.st_size, stat.st_mtime_ns]
+                else:
+                    fingerprint += [-1, -1]
+            yield directory, calculation, fingerprint
+
+    def _read(self, directory):
+        return read_calculation(os.path.join(self.data_dir, directory))
+
+    def update(self):
+        """
+        Bring the index up to date with the calculations in data_dir, and write it
+        to INDEX_FILE in case anything has changed.
+        """
+        cached = self._load()
+        entries = {}
+
+        for directory, calculation, fingerprint in self._find():
+            if directory in cached and cached[directory][0] == fingerprint:
+                entries[directory] = cached[directory]
+            else:
+                entries[directory] = (fingerprint, dict(calculation, **self._read(directory)))
+
+        self.directories = np.array(list(entries), dtype=str)
+        self.columns = {c: np.array([r[c] for _, r in entries.values()],
+                                    dtype=str if c in METADATA else float)
+                        for c in COLUMNS}
+
+        if self.index_file is not None and {d: f for d, (f, _) in entries.items()} \
+                != {d: f for d, (f, _) in cached.items()}:
+            fingerprints = np.array([f for f, _ in entries.values()], dtype=np.int64)
+            np.savez(self.index_file, directory=self.directories,
+                     fingerprint=fingerprints.reshape(-1, 2 * len(OUTPUT_FILES)),
+                     **self.columns)
+
+    def __len__(self):
+        return len(self.directories)
+
+    def unique(self, column):
+        return np.unique(self.columns[column]).tolist()
+
+    def mask(self, **conditions):
+        """
+        Mask of the calculations for which each column in conditions has the given
+        value, or one of the values in case a list is given.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in conditions.items():
+            if isinstance(value, (list, tuple)):
+                mask &= np.isin(self.columns[column], value)
+            else:
+                mask &= self.columns[column] == value
+        return mask
+
+    def select(self, **conditions):
+        """
+        Calculations that match the conditions, as a list of dictionaries.
+        """
+        rows = np.flatnonzero(self.mask(**conditions))
+        return [dict({c: self.columns[c][i].item() for c in COLUMNS},
+                     directory=os.path.join(self.data_dir, self.directories[i]))
+                for i in rows]
+
+    def energy_table(self, li_concentration, calc_type="relax", value="energy_per_atom",
+                     relative=True):
+        """
+        Table of the value for the models (rows) and functionals (columns) of the
+        calculations at a Li concentration that have it, with NaN for the missing
+        combinations. With relative, the lowest value of each functional is
+        subtracted, so the models can be compared. Returns the table, the models
+        and the functionals.
+        """
+        mask = self.mask(li_concentration=li_concentration, calc_type=calc_type) \
+            & ~np.isnan(self.columns[value])
+        models, rows = np.unique(self.columns["model"][mask], return_inverse=True)
+        functionals, columns = np.unique(self.columns["functional"][mask],
+                                         return_inverse=True)
+
+        table = np.full((len(models), len(functionals)), np.nan)
+        table[rows, columns] = self.columns[value][mask]
+        if relative:
+            table -= np.nanmin(table, axis=0)
+
+        return table, models.tolist(), functionals.tolist()
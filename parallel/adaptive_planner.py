@@ -0,0 +1,203 @@
+import time
+import numpy as np
+
+from performance_model import PerformanceModel
+
+MIN_RECORDS = 12
+
+# FireWorks states of the runs that will not change anymore, where DELETED marks
+# runs that are no longer on the LaunchPad
+FINISHED_STATES = ("COMPLETED", "FIZZLED", "DEFUSED", "DELETED")
+# Seconds after which submitted tests that have not finished are given up
+TIMEOUT = 2 * 24 * 3600
+
+
+def divisors(n):
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+
+class ParallelizationPlanner:
+    """
+    Plans the parallelization tests of a system in batches, instead of submitting
+    the full KPAR range for every number of nodes at once.
+
+    Since each get_wf_parallel workflow tests all NCORE values for the KPAR values
+    in its kpar_range, a batch consists of (nodes, KPAR) pairs, which are submitted
+    with kpar_range=(KPAR, KPAR). The first batch spreads a few KPAR values over
+    the range for each number of nodes. After that, a PerformanceModel is fitted to
+    the timings measured so far, and the untested KPAR values for which the
+    optimistic (lower confidence bound) prediction over all NCORE values beats the
+    best measured timing by more than the tolerance are submitted, most promising
+    first. Once no such KPAR values remain for a number of nodes, its optimum is
+    considered found.
+
+    A submitted pair is pending until all of its runs have finished, which is
+    tracked with the FireWorks ids of its workflow, see record_submission and
+    update_states. Pairs whose submission failed, or that have not finished within
+    the timeout in seconds, are dropped.
+    """
+
+    def __init__(self, nodes_list, cores_per_node, nbands, n_kpoints, functional="pbe",
+                 kpar_range=None, initial_size=3, batch_size=2, tolerance=0.05, z=1.5,
+                 timeout=TIMEOUT):
+        self.nodes_list = list(nodes_list)
+        self.cores_per_node = cores_per_node
+        self.nbands = nbands
+        self.n_kpoints = n_kpoints
+        self.functional = functional
+        self.initial_size = initial_size
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.z = z
+        self.timeout = timeout
+
+        # More KPAR groups than k-points would leave groups without work
+        kpar_min, kpar_max = kpar_range or (1, n_kpoints)
+        self.candidates = {
+            nodes: [k for k in divisors(nodes * cores_per_node) if kpar_min <= k <= kpar_max]
+            for nodes in self.nodes_list
+        }
+        self.submitted = set()
+        self.submission_times = {}
+        self.fw_ids = {}
+        self.states = {}
+        self.dropped = set()
+
+    def initial_kpars(self, nodes):
+        """
+        KPAR values of the first batch for nodes, spread evenly on a log scale over
+        the candidate KPAR values.
+        """
+        candidates = self.candidates[nodes]
+        if len(candidates) <= self.initial_size:
+            return candidates
+
+        targets = np.geomspace(candidates[0], candidates[-1], self.initial_size)
+        indices = {int(np.argmin(np.abs(np.log(candidates) - np.log(t)))) for t in targets}
+
+        return [candidates[i] for i in sorted(indices)]
+
+    def lower_bounds(self, model, nodes, kpars):
+        """
+        Lower confidence bound of the predicted time per electronic step of the best
+        NCORE for each KPAR in kpars.
+        """
+        cores = nodes * self.cores_per_node
+        kpar, ncore = np.array(
+            [(k, c) for k in kpars for c in divisors(cores // k)]
+        ).T
+
+        time, std = model.predict(cores, kpar, ncore, self.nbands, self.n_kpoints,
+                                  self.functional)
+        bound = time * np.exp(-self.z * std)
+
+        return np.array([np.min(bound[kpar == k]) for k in kpars])
+
+    def _plan(self, table):
+
+        model = None
+        if len(table) >= MIN_RECORDS:
+            model = PerformanceModel().fit(table, functional=self.functional)
+
+        batch = []
+
+        for nodes in self.nodes_list:
+
+            node_table = table.select(nodes=nodes)
+            tested = set(node_table.kpar.tolist())
+
+            if not tested:
+                kpars = [k for k in self.initial_kpars(nodes)
+                         if (nodes, k) not in self.submitted]
+                batch.extend((nodes, k) for k in kpars)
+                continue
+
+            untested = [k for k in self.candidates[nodes]
+                        if k not in tested and (nodes, k) not in self.submitted]
+            if not untested:
+                continue
+
+            if model is None:
+                # Too few timings for a model: test the KPAR values closest to the
+                # best one so far.
+                best_kpar = node_table.kpar[np.argmin(node_table.timing)]
+                distance = np.abs(np.log(untested) - np.log(best_kpar))
+                batch.extend((nodes, untested[i])
+                             for i in np.argsort(distance)[:self.batch_size])
+                continue
+
+            bounds = self.lower_bounds(model, nodes, untested)
+            threshold = np.min(node_table.timing) * (1 - self.tolerance)
+            order = np.argsort(bounds)
+
+            batch.extend((nodes, untested[i]) for i in order[:self.batch_size]
+                         if bounds[i] < threshold)
+
+        return batch
+
+    def next_batch(self, table):
+        """
+        Next (nodes, KPAR) pairs to submit, given the TimingTable of the tests that
+        have finished so far. The returned pairs are marked as submitted, so they
+        are not planned again while they are running. An empty batch means that
+        either the optimum has been found for all numbers of nodes, or the
+        submitted runs have to finish first, see is_converged.
+        """
+        batch = self._plan(table)
+        self.submitted.update(batch)
+        self.submission_times.update({pair: time.time() for pair in batch})
+
+        return batch
+
+    def record_submission(self, pair, fw_ids):
+        """
+        Record the FireWorks ids of the runs of a submitted (nodes, KPAR) pair, or
+        drop the pair in case fw_ids is None, i.e. its submission failed.
+        """
+        if fw_ids is None:
+            self.dropped.add(pair)
+        else:
+            self.fw_ids[pair] = list(fw_ids)
+
+    def unfinished_runs(self):
+        """
+        FireWorks ids of the runs of the pending pairs that have not finished.
+        """
+        return [i for pair in self.pending() for i in self.fw_ids.get(pair, [])
+                if self.states.get(i) not in FINISHED_STATES]
+
+    def update_states(self, states):
+        """
+        Update the states of the unfinished runs from states, a dictionary with the
+        FireWorks state of each id. Runs that are missing from it are considered
+        deleted.
+        """
+        for fw_id in self.unfinished_runs():
+            self.states[fw_id] = states.get(fw_id, "DELETED")
+
+    def pending(self):
+        """
+        Submitted (nodes, KPAR) pairs of which not all runs have finished. Pairs
+        that have been submitted more than timeout seconds ago are dropped.
+        """
+        pending = []
+        now = time.time()
+        for pair in sorted(self.submitted - self.dropped):
+            if now - self.submission_times[pair] > self.timeout:
+                self.dropped.add(pair)
+            elif pair not in self.fw_ids or any(
+                    self.states.get(i) not in FINISHED_STATES for i in self.fw_ids[pair]):
+                pending.append(pair)
+        return pending
+
+    def is_converged(self, table):
+        """
+        Whether the optimum has been found within the tolerance for all numbers of
+        nodes, i.e. each of them has timings, all runs of the submitted tests have
+        finished or have been dropped, and no untested KPAR value is left that could still
+        improve on its best measured timing.
+        """
+        tested = set(table.nodes.tolist())
+
+        return all(n in tested for n in self.nodes_list) and not self.pending() \
+            and not self._plan(table)
@@ -0,0 +1,389 @@
+import os, time, tarfile, zipfile, threading
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pymatgen import Structure
+from vscworkflows.workflows.core import get_wf_parallel
+
+from system_cache import SYSTEM_CACHE
+from profiling import Timer, timed
+
+
+def structure_format(filename):
+    """
+    Format of a structure file for Structure.from_str, based on its extension.
+    Files without an extension, e.g. POSCAR, are read as VASP POSCAR files.
+    """
+    spl = os.path.basename(filename).split(".")
+    if len(spl) == 1:
+        return "poscar"
+    return spl[-1]
+
+
+def _archive_files(path):
+    """
+    (name, content) of the files in a directory or a zip or tar archive, sorted by
+    name.
+    """
+    if os.path.isdir(path):
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    with open(entry.path, "rb") as file:
+                        files.append((entry.name, file.read()))
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            files = [(os.path.basename(i.filename), archive.read(i))
+                     for i in archive.infolist() if not i.is_dir()]
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path) as archive:
+            files = [(os.path.basename(m.name), archive.extractfile(m).read())
+                     for m in archive.getmembers() if m.isfile()]
+    else:
+        raise ValueError(path + " is not a directory or a zip or tar archive.")
+
+    return sorted(f for f in files if not f[0].startswith("."))
+
+
+def read_structures(path):
+    """
+    Read all structures in a directory or a zip or tar archive. Returns a list of
+    (name, structure) tuples, with the name the file name without its extension.
+    Files that can not be read as a structure are skipped.
+    """
+    structures = []
+
+    for filename, content in _archive_files(path):
+        try:
+            structure = Structure.from_str(input_string=content.decode("utf-8"),
+                                           fmt=structure_format(filename))
+        except (UnicodeDecodeError, ValueError) as error:
+            print("Could not read a structure from " + filename + ": " + str(error))
+            continue
+        structures.append((filename.split(".")[0], structure))
+
+    return structures
+
+
+@timed()
+def system_settings(structure, kpt_density, cores_per_node, user_incar_settings,
+                    cache=SYSTEM_CACHE):
+    """
+    NBANDS and number of irreducible k-points of the static calculation of a
+    structure. NBANDS is rounded up to a multiple of the number of cores per node.
+    NELECT, the k-point mesh and its analysis are taken from the SystemCache.
+    """
+    static = cache.static_set(structure, user_incar_settings, kpt_density)
+
+    nions = len(structure)
+    nelect = static["nelect"]
+    ispin = static["ispin"]
+
+    if ispin == 1:
+        nbands = int(round(nelect / 2 + nions / 2))
+    elif ispin == 2:
+        nbands = int(nelect * 3 / 5 + nions)
+    else:
+        raise ValueError("ISPIN Value is not set to 1 or 2!")
+
+    nbands = (nbands // cores_per_node + 1) * cores_per_node
+    n_kpoints = cache.n_kpoints(structure, static["mesh"])
+
+    return {"nbands": nbands, "n_kpoints": n_kpoints}
+
+
+def _prepare_system(args):
+    name, structure, kpt_density, cores_per_node, user_incar_settings = args
+
+    system = {"name": name, "structure": structure, "error": None}
+    try:
+        system.update(system_settings(structure, kpt_density, cores_per_node,
+                                      user_incar_settings))
+    except Exception as error:
+        system["error"] = str(error)
+
+    return system, SYSTEM_CACHE.entries(structure)
+
+
+def prepare_systems(structures, kpt_density, cores_per_node, user_incar_settings,
+                    workers=None):
+    """
+    Compute the system_settings of a list of (name, structure) tuples concurrently
+    over a pool of workers processes, since the symmetry analysis of the k-point
+    mesh can take a while for larger structures. Setting workers to 1 prepares
+    the systems serially in the current process. The SYSTEM_CACHE entries of the
+    workers are merged into that of the current process and saved.
+
+    Returns a list of dictionaries with the name, structure, nbands and n_kpoints
+    of each system, in the order of structures. In case the settings could not be
+    determined, the "error" value contains the error message.
+    """
+    tasks = [(name, structure, kpt_density, cores_per_node, user_incar_settings)
+             for name, structure in structures]
+
+    if workers == 1 or len(tasks) < 2:
+        prepared = [_prepare_system(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            prepared = list(executor.map(_prepare_system, tasks))
+
+    systems = []
+    for system, entries in prepared:
+        SYSTEM_CACHE.update(entries)
+        systems.append(system)
+    SYSTEM_CACHE.save()
+
+    return systems
+
+
+def parallelization_dir(scratch_dir, functional, structure, nbands, kpt_density,
+                        name=None):
+    """
+    Directory in which the parallelization tests of a system are run. The name is
+    added to the composition to distinguish structures with the same composition.
+    """
+    system = str(structure.composition).replace(" ", "")
+    if name is not None:
+        system += "-" + name
+
+    return os.path.join(
+        scratch_dir, "parallel_" + functional[0], system,
+        str(nbands) + "bands_" + str(kpt_density) + "kpoints"
+    )
+
+
+def system_workflow(system, nodes, functional, kpt_density, scratch_dir,
+                    cores_per_node, user_incar_settings, handlers, name=None):
+    """
+    Parallelization workflow of a prepared system on a number of nodes, testing
+    the full KPAR range of the system.
+    """
+    return get_wf_parallel(
+        structure=system["structure"],
+        directory=parallelization_dir(scratch_dir, functional, system["structure"],
+                                      system["nbands"], kpt_density, name),
+        nodes=nodes,
+        nbands=system["nbands"],
+        functional=functional,
+        user_kpoints_settings={"reciprocal_density": kpt_density},
+        user_incar_settings=dict(user_incar_settings, NBANDS=system["nbands"]),
+        handlers=handlers,
+        cores_per_node=cores_per_node,
+        kpar_range=(1, system["n_kpoints"])
+    )
+
+
+def batch_tasks(systems, nodes_list):
+    """
+    Label, system, number of nodes and name of the parallelization workflows of
+    the prepared systems for every number of nodes in nodes_list. The name is only
+    set for systems that share their composition with another one. Systems for
+    which the preparation failed are skipped.
+    """
+    compositions = Counter(str(s["structure"].composition) for s in systems)
+    tasks = []
+
+    for system in systems:
+        if system["error"] is not None:
+            continue
+
+        name = system["name"] if compositions[str(system["structure"].composition)] > 1 \
+            else None
+
+        for nodes in nodes_list:
+            tasks.append((system["name"] + ", " + str(nodes) + " nodes", system,
+                          nodes, name))
+
+    return tasks
+
+
+def batch_workflows(systems, nodes_list, functional, kpt_density, scratch_dir,
+                    cores_per_node, user_incar_settings, handlers):
+    """
+    Parallelization workflows of the prepared systems for every number of nodes
+    in nodes_list, testing the full KPAR range of each system. Systems for which
+    the preparation failed are skipped.
+    """
+    return [system_workflow(system, nodes, functional, kpt_density, scratch_dir,
+                            cores_per_node, user_incar_settings, handlers, name)
+            for _, system, nodes, name in batch_tasks(systems, nodes_list)]
+
+
+def add_workflows(lpad, workflows):
+    """
+    Add a list of workflows to a LaunchPad, in a single bulk insert in case the
+    LaunchPad supports it.
+    """
+    with Timer("LaunchPad.bulk_add_wfs"):
+        if hasattr(lpad, "bulk_add_wfs"):
+            lpad.bulk_add_wfs(workflows)
+        else:
+            for workflow in workflows:
+                lpad.add_wf(workflow)
+
+
+class MemoryLaunchPad:
+    """
+    In-memory stand-in for a FireWorks LaunchPad, which stores the workflows that
+    are added instead of inserting them into a mongoDB database. It can be used
+    as the "launchpad" of a CLUSTER_DICT entry to test the submission without a
+    database connection.
+
+    The latency (in seconds) is added to every insert, to mimic the round trip to
+    a remote database.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.workflows = []
+        self.fw_id = 0
+        self._lock = threading.Lock()
+
+    def _add(self, wf):
+        with self._lock:
+            old_new = {}
+            for fw in getattr(wf, "fws", []):
+                self.fw_id += 1
+                old_new[fw.fw_id] = self.fw_id
+
+            self.workflows.append(wf)
+
+        return old_new
+
+    def add_wf(self, wf):
+        """
+        Store a workflow and assign new ids to its fireworks. Returns the mapping of
+        the old to the new ids, like LaunchPad.add_wf.
+        """
+        time.sleep(self.latency)
+        return self._add(wf)
+
+    def bulk_add_wfs(self, wfs):
+        time.sleep(self.latency)
+        for wf in wfs:
+            self._add(wf)
+
+    def reset(self, password=None, require_password=False):
+        with self._lock:
+            self.workflows = []
+            self.fw_id = 0
+
+
+def firework_states(lpad, fw_ids):
+    """
+    FireWorks state of each of the fw_ids that are on the LaunchPad.
+    """
+    return {d["fw_id"]: d["state"] for d in lpad.fireworks.find(
+        {"fw_id": {"$in": list(fw_ids)}}, {"fw_id": 1, "state": 1}
+    )}
+
+
+class WorkflowSubmitter:
+    """
+    Builds and submits workflows in the background, so the kernel stays
+    responsive during the round trips to the LaunchPad.
+
+    The workflows are built concurrently by a pool of workers threads. Each
+    workflow is added to the LaunchPad as soon as it is built, by a single insert
+    thread, so building and inserting overlap. After each workflow, callback is
+    called with its result, a dictionary with the label, the status ("submitted",
+    "failed" or "cancelled"), the build and insert time in seconds, the FireWorks
+    ids of the inserted workflow and the error message in case it failed.
+    """
+
+    def __init__(self, lpad, workers=4, callback=None):
+        self.lpad = lpad
+        self.callback = callback
+        self.results = []
+        self._builders = ThreadPoolExecutor(max_workers=workers)
+        self._inserter = ThreadPoolExecutor(max_workers=1)
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._finished = threading.Event()
+        self._finished.set()
+
+    def _report(self, result):
+        with self._lock:
+            self.results.append(result)
+            self._pending -= 1
+            if self._pending == 0:
+                self._finished.set()
+
+        if self.callback is not None:
+            self.callback(result)
+
+    def _build(self, label, build, args, kwargs):
+        if self._cancelled.is_set():
+            return None
+        start = time.perf_counter()
+        with Timer("workflow.build"):
+            workflow = build(*args, **kwargs)
+        return workflow, time.perf_counter() - start
+
+    def _insert(self, label, future):
+        result = {"label": label, "status": "cancelled", "build_time": None,
+                  "insert_time": None, "fw_ids": None, "error": None}
+
+        try:
+            built = future.result()
+            if built is not None and not self._cancelled.is_set():
+                workflow, result["build_time"] = built
+                start = time.perf_counter()
+                with Timer("LaunchPad.add_wf"):
+                    ids = self.lpad.add_wf(workflow)
+                result["fw_ids"] = sorted(ids.values())
+                result["insert_time"] = time.perf_counter() - start
+                result["status"] = "submitted"
+        except Exception as error:
+            result["status"] = "failed"
+            result["error"] = str(error)
+
+        self._report(result)
+
+    def _queue_insert(self, label, future):
+        try:
+            self._inserter.submit(self._insert, label, future)
+        except RuntimeError:
+            # The submitter has been shut down, the build is discarded.
+            self._report({"label": label, "status": "cancelled", "build_time": None,
+                          "insert_time": None, "fw_ids": None, "error": None})
+
+    def submit(self, label, build, *args, **kwargs):
+        """
+        Build a workflow by calling build(*args, **kwargs) in the background and add
+        it to the LaunchPad. Returns immediately.
+        """
+        with self._lock:
+            self._pending += 1
+            self._finished.clear()
+
+        future = self._builders.submit(self._build, label, build, args, kwargs)
+        future.add_done_callback(lambda f: self._queue_insert(label, f))
+
+    def cancel(self):
+        """
+        Cancel the workflows that have not been added to the LaunchPad yet. An
+        insert that is already in progress is finished.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until all submitted workflows have been handled. Returns whether they
+        have.
+        """
+        return self._finished.wait(timeout)
+
+    def shutdown(self):
+        self._builders.shutdown(wait=True)
+        self._inserter.shutdown(wait=True)
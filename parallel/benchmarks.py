@@ -0,0 +1,371 @@
+import os, io, sys, json, time, platform, argparse, tempfile, subprocess
+import numpy as np
+
+import matplotlib
+matplotlib.use("Agg")
+
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from monty.re import regrep
+from matplotlib.figure import Figure
+
+from outcar import parse_outcar
+from process_output import process_parallel, write_data
+from parallel_plots import load_table, interface, chessboard_plot, tetris_plot, \
+    optimal_settings
+from render_cache import RENDER_CACHE, render_figures
+
+CORES_PATTERN = r"\s+running\son\s+(\S+)\stotal\scores"
+NKP_PATTERN = r"k-points\s+NKPTS\s=\s+([0-9]+)\s+.*"
+NBANDS_PATTERN = r".*NBANDS=\s+([0-9]+)"
+LOOP_PATTERN = r"\s+LOOP:\s+cpu\stime.+:\sreal\stime(.+)"
+
+SIZES = (1000, 10000, 100000)
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "benchmark_history.jsonl")
+# A benchmark that is this much, and at least REGRESSION_SECONDS, slower than the
+# median of its previous runs is reported as a regression
+REGRESSION_FACTOR = 1.5
+REGRESSION_SECONDS = 0.05
+
+POSCAR = """Si2
+1.0
+   0.0 2.715 2.715
+   2.715 0.0 2.715
+   2.715 2.715 0.0
+Si
+2
+direct
+   0.00 0.00 0.00
+   0.25 0.25 0.25
+"""
+
+
+def write_outcar(filename, total_cores=56, n_kpoints=60, nbands=420,
+                 n_steps=40, filler_lines=2000, seed=0, loop_timings=None):
+    """
+    Write a synthetic OUTCAR that contains the lines parsed for the
+    parallelization tests, padded with filler_lines of output per electronic step
+    to mimic the size of a real OUTCAR. The real time of the electronic steps is
+    random, unless the loop_timings are given.
+    """
+    rng = np.random.default_rng(seed)
+    if loop_timings is None:
+        loop_timings = 5 + rng.random(n_steps)
+    filler = "".join(
+        " %4i %12.6f %12.6f %12.6f\n" % (i, *rng.random(3)) for i in range(filler_lines)
+    )
+    with open(filename, "w") as file:
+        file.write(" vasp.5.4.4.18Apr17-6-g9f103f2a35 (build Sep 18 2018 16:57:57) complex\n")
+        file.write(" running on   %i total cores\n" % total_cores)
+        file.write(filler)
+        file.write(" Dimension of arrays:\n")
+        file.write("   k-points           NKPTS =     %i   k-points in BZ     NKDIM =     %i"
+                   "   number of bands    NBANDS=    %i\n" % (n_kpoints, n_kpoints, nbands))
+        for real_time in loop_timings:
+            file.write(filler)
+            file.write("      LOOP:  cpu time %9.4f: real time %9.4f\n"
+                       % (real_time - 0.01, real_time))
+
+
+def regrep_outcar(outcar_file):
+    """
+    The regrep based parsing of process_parallel, i.e. one pass over the OUTCAR per
+    field.
+    """
+    n_kpoints = int(regrep(outcar_file, {"nkp": NKP_PATTERN})["nkp"][0][0][0])
+    nbands = int(regrep(outcar_file, {"nbands": NBANDS_PATTERN})["nbands"][0][0][0])
+    loop_timing = regrep(filename=outcar_file, patterns={"loop": LOOP_PATTERN})["loop"]
+    total_cores = int(regrep(
+        filename=outcar_file, patterns={"cores": CORES_PATTERN})["cores"][0][0][0])
+
+    return {"total_cores": total_cores, "n_kpoints": n_kpoints, "nbands": nbands,
+            "loop_timings": np.array([float(e[0][0]) for e in loop_timing])}
+
+
+def time_function(function, *args, repeat=3, **kwargs):
+    """
+    Best wall time of repeat calls of function, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_outcar(outcar_file, repeat=3):
+    """
+    Compare the single pass parse_outcar with the regrep path of process_parallel
+    for one OUTCAR. Returns a dictionary with the best time of both methods.
+    """
+    reference = regrep_outcar(outcar_file)
+    result = parse_outcar(outcar_file)
+
+    for key in ("total_cores", "n_kpoints", "nbands"):
+        assert result[key] == reference[key], key
+    assert np.allclose(result["loop_timings"], reference["loop_timings"])
+
+    return {"file": outcar_file,
+            "size (MB)": os.path.getsize(outcar_file) / 2 ** 20,
+            "regrep (s)": time_function(regrep_outcar, outcar_file, repeat=repeat),
+            "parse_outcar (s)": time_function(parse_outcar, outcar_file, repeat=repeat)}
+
+
+def print_results(results):
+
+    keys = list(results[0].keys())
+    print("\t".join(keys))
+    for r in results:
+        print("\t".join("%.3f" % v if isinstance(v, float) else str(v)
+                        for v in r.values()))
+
+
+def _divisors(n):
+    return [d for d in range(1, n + 1) if n % d == 0]
+
+
+def synthetic_data(n_records, n_kpoints=60, nbands=420, cores_per_node=28,
+                   max_nodes=128, n_steps=10, work=2000.0, serial_fraction=0.001,
+                   optimal_ncore=4, noise=0.05, seed=0):
+    """
+    Data dictionary of a synthetic parallelization test with n_records records,
+    with the "nbands", "n_kpoints" and "timing_list" keys of the data files.
+
+    The records are drawn from all valid combinations of up to max_nodes nodes,
+    KPAR and NCORE, and repeated in case there are fewer combinations than
+    n_records. The time per electronic step follows Amdahl's law for the work
+    (in core-seconds) and serial_fraction, slowed down by the idle cores of k-point
+    and band groups that do not divide the k-points and bands evenly, by NCORE
+    away from optimal_ncore and by the communication within a k-point group.
+    Each record has n_steps electronic steps with log-normal noise, of which 1%
+    are outliers.
+    """
+    rng = np.random.default_rng(seed)
+
+    nodes, kpar, ncore = np.meshgrid(np.arange(1, max_nodes + 1),
+                                     np.arange(1, n_kpoints + 1),
+                                     _divisors(cores_per_node), indexing="ij")
+    nodes, kpar, ncore = nodes.ravel(), kpar.ravel(), ncore.ravel()
+    cores = nodes * cores_per_node
+    valid = cores % (kpar * ncore) == 0
+
+    grid = np.flatnonzero(valid)
+    grid = np.sort(rng.choice(grid, n_records, replace=len(grid) < n_records))
+    nodes, kpar, ncore, cores = nodes[grid], kpar[grid], ncore[grid], cores[grid]
+    npar = cores // (kpar * ncore)
+
+    kpoint_groups = np.ceil(n_kpoints / kpar) * kpar / n_kpoints
+    band_groups = np.ceil(nbands / npar) * npar / nbands
+    timing = work * (serial_fraction + (1 - serial_fraction) * kpoint_groups
+                     * band_groups / cores) \
+        * (1 + 0.05 * (np.log2(ncore) - np.log2(optimal_ncore)) ** 2) \
+        * (1 + 0.02 * np.log2(cores / kpar))
+
+    steps = timing[:, None] * rng.lognormal(0, noise, (n_records, n_steps))
+    outliers = rng.random(steps.shape) < 0.01
+    steps[outliers] *= 3
+
+    timing_list = [
+        {"nodes": int(n), "kpar": int(k), "ncore": int(c), "npar": int(p),
+         "timing": float(np.mean(s)), "steps": s.tolist()}
+        for n, k, c, p, s in zip(nodes, kpar, ncore, npar, np.round(steps, 4))
+    ]
+
+    return {"structure": None, "nbands": nbands, "n_kpoints": n_kpoints,
+            "timing_list": timing_list}
+
+
+def write_outcar_tree(data_dir, data, cores_per_node=28, nelmdl=5, filler_lines=200):
+    """
+    Write the calculations of the timing_list of a data dictionary as a
+    parallelization test directory, i.e. <N>nodes/<K>kpar/<P>npar directories
+    with an INCAR, POSCAR and OUTCAR, that process_parallel turns back into the
+    timing_list. Returns the number of calculations.
+    """
+    runs = {(t["nodes"], t["kpar"], t["npar"]): t for t in data["timing_list"]}
+
+    for i, ((nodes, kpar, npar), record) in enumerate(sorted(runs.items())):
+        run_dir = os.path.join(data_dir, str(nodes) + "nodes", str(kpar) + "kpar",
+                               str(npar) + "npar")
+        os.makedirs(run_dir, exist_ok=True)
+
+        with open(os.path.join(run_dir, "INCAR"), "w") as file:
+            file.write("NELMDL = -" + str(nelmdl) + "\n")
+        with open(os.path.join(run_dir, "POSCAR"), "w") as file:
+            file.write(POSCAR)
+
+        steps = record.get("steps", [record["timing"]])
+        write_outcar(os.path.join(run_dir, "OUTCAR"),
+                     total_cores=nodes * cores_per_node, n_kpoints=data["n_kpoints"],
+                     nbands=data["nbands"], filler_lines=filler_lines, seed=i,
+                     loop_timings=[steps[0]] * nelmdl + list(steps))
+
+    return len(runs)
+
+
+def _load_interface(data_file):
+    """
+    Build the analysis interface of a data file, which renders the initial plot of
+    every tab, starting from an empty RENDER_CACHE.
+    """
+    RENDER_CACHE.clear()
+    with redirect_stdout(io.StringIO()):
+        interface(SimpleNamespace(selected=data_file))
+
+
+def bench_suite(sizes=SIZES, n_runs=64, repeat=3, workers=None):
+    """
+    Time the analysis pipeline on synthetic data, headlessly: process_parallel on
+    an OUTCAR tree of n_runs calculations, with and without the RunCache, and for
+    datasets of each of the sizes, loading the data file and the interface and
+    rendering the chessboard, tetris and optimal settings plots.
+
+    Returns a list of dictionaries with the benchmark, size and best time of
+    repeat runs.
+    """
+    results = []
+
+    def record(benchmark, size, function, *args, **kwargs):
+        results.append({"benchmark": benchmark, "size": size,
+                        "time (s)": time_function(function, *args, repeat=repeat,
+                                                  **kwargs)})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tree_dir = os.path.join(tmp_dir, "tree")
+        n_runs = write_outcar_tree(tree_dir, synthetic_data(n_runs, max_nodes=8))
+        output_file = os.path.join(tmp_dir, "tree.json")
+
+        with redirect_stdout(io.StringIO()):
+            record("process_parallel", n_runs, process_parallel, tree_dir, output_file,
+                   workers=workers, use_cache=False)
+            process_parallel(tree_dir, output_file, workers=workers)
+            record("process_parallel (cached)", n_runs, process_parallel, tree_dir,
+                   output_file, workers=workers)
+
+        for size in sizes:
+            data_file = os.path.join(tmp_dir, "synthetic_%i.json" % size)
+            write_data(synthetic_data(size), data_file)
+
+            table, _ = load_table(data_file)
+            nodes = table.unique("nodes")
+            busiest = int(nodes[np.argmax(np.bincount(np.searchsorted(nodes, table.nodes)))])
+            figure = Figure()
+
+            record("load_table", size, load_table, data_file)
+            record("interface", size, _load_interface, data_file)
+            record("chessboard_plot", size, render_figures, chessboard_plot, {
+                "table": table, "nodes": busiest, "x_axis": "NCORE", "figure": figure
+            })
+            record("tetris_plot", size, render_figures, tetris_plot, {
+                "table": table, "nodes_choices": nodes[:3].tolist(),
+                "kpar_choices": table.unique("kpar")[:3].tolist(),
+                "ncore_choices": table.unique("ncore")[:3].tolist(), "is_hybrid": False
+            })
+            record("optimal_settings", size, render_figures, optimal_settings,
+                   {"table": table})
+
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(history_file=HISTORY_FILE):
+    """
+    Runs of the benchmark suite stored in the history_file, oldest first.
+    """
+    try:
+        with open(history_file, "r") as file:
+            return [json.loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def record_run(results, history_file=HISTORY_FILE):
+    """
+    Append the results of a run of the benchmark suite to the history_file, one
+    json line per run, along with the date, commit, host and library versions.
+    """
+    run = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _commit(),
+           "host": platform.node(), "python": platform.python_version(),
+           "numpy": np.__version__, "matplotlib": matplotlib.__version__,
+           "results": results}
+    with open(history_file, "a") as file:
+        file.write(json.dumps(run) + "\n")
+    return run
+
+
+def find_regressions(results, history, factor=REGRESSION_FACTOR, window=5):
+    """
+    Benchmarks of the results that are more than factor (and REGRESSION_SECONDS)
+    slower than the median of their last window runs on the same host in the
+    history. Returns a list of (benchmark, size, time, median) tuples.
+    """
+    previous = {}
+    for run in history:
+        if run.get("host") != platform.node():
+            continue
+        for r in run["results"]:
+            previous.setdefault((r["benchmark"], r["size"]), []).append(r["time (s)"])
+
+    regressions = []
+    for r in results:
+        timings = previous.get((r["benchmark"], r["size"]), [])[-window:]
+        if timings and r["time (s)"] > max(factor * np.median(timings),
+                                           np.median(timings) + REGRESSION_SECONDS):
+            regressions.append((r["benchmark"], r["size"], r["time (s)"],
+                                float(np.median(timings))))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the OUTCAR parsing, or the full analysis pipeline on "
+                    "synthetic data with --suite."
+    )
+    parser.add_argument("outcars", nargs="*",
+                        help="OUTCAR files, by default a synthetic one")
+    parser.add_argument("--suite", action="store_true")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--runs", type=int, default=64,
+                        help="number of calculations of the OUTCAR tree")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--history", default=HISTORY_FILE)
+    parser.add_argument("--no-record", action="store_true",
+                        help="do not add the results to the history")
+    args = parser.parse_args()
+
+    if not args.suite:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outcar_files = args.outcars
+            if not outcar_files:
+                outcar_files = [os.path.join(tmp_dir, "OUTCAR")]
+                write_outcar(outcar_files[0])
+
+            print_results([bench_outcar(f, repeat=args.repeat) for f in outcar_files])
+        sys.exit()
+
+    results = bench_suite(args.sizes, n_runs=args.runs, repeat=args.repeat,
+                          workers=args.workers)
+    print_results(results)
+
+    regressions = find_regressions(results, read_history(args.history))
+    if not args.no_record:
+        record_run(results, args.history)
+
+    for benchmark, size, timing, median in regressions:
+        print("Regression: %s (%i) took %.3f s, against a median of %.3f s."
+              % (benchmark, size, timing, median))
+    if regressions:
+        sys.exit(1)
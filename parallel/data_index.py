@@ -0,0 +1,201 @@
+import os, re, json
+import numpy as np
+
+from timing_table import TimingTable
+from timing_store import TimingDataset, EXTENSION
+
+INDEX_FILE = ".index.npz"
+
+FILENAME_PATTERN = re.compile(
+    r"^(?P<cluster>[^_]+)_(?P<functional>[^_]+)_(?P<algo>[^_]+)_(?P<composition>[^_]+)"
+    r"_B(?P<nbands>[0-9]+)_K(?P<n_kpoints>[0-9]+)$"
+)
+
+METADATA = ("cluster", "functional", "algo", "composition", "nbands", "n_kpoints")
+
+COLUMNS = ("nodes", "kpar", "npar", "ncore", "timing", "dataset")
+
+
+def parse_data_filename(filename):
+    """
+    Metadata encoded in the name of a data file, e.g. for
+    leibniz_pbe_Normal_U12O32_B420_K60.json the cluster, functional, ALGO,
+    composition, NBANDS and NKPTS. Returns None for files that do not follow this
+    naming scheme.
+    """
+    match = FILENAME_PATTERN.match(os.path.splitext(os.path.basename(filename))[0])
+    if match is None:
+        return None
+
+    metadata = match.groupdict()
+    metadata["nbands"] = int(metadata["nbands"])
+    metadata["n_kpoints"] = int(metadata["n_kpoints"])
+
+    return metadata
+
+
+def _read_columns(filename):
+    """
+    Timing columns of a data file in the json or binary format.
+    """
+    if filename.endswith(EXTENSION):
+        table = TimingDataset(filename).table
+    else:
+        with open(filename, "r") as file:
+            table = TimingTable.from_timing_list(json.loads(file.read())["timing_list"])
+
+    return {c: np.array(table.column(c)) for c in ("nodes", "kpar", "npar", "ncore", "timing")}
+
+
+class IndexedTable(TimingTable):
+    """
+    TimingTable that combines the records of several datasets. The dataset column
+    refers to the entry in datasets with the metadata of the data file the record
+    comes from, and the metadata can be used as columns as well, e.g. in
+    select(functional="hse06", nbands=lambda b: b > 400).
+    """
+
+    def __init__(self, nodes, kpar, npar, ncore, timing, dataset, datasets):
+        super().__init__(nodes, kpar, npar, ncore, timing)
+        self.dataset = np.asarray(dataset, dtype=np.int64)
+        self.datasets = datasets
+        self._metadata = {}
+
+    def column(self, name):
+        if name in METADATA or name == "file":
+            if name not in self._metadata:
+                values = np.array([d[name] for d in self.datasets])
+                self._metadata[name] = values[self.dataset]
+            return self._metadata[name]
+        return super().column(name)
+
+    def take(self, mask):
+        return IndexedTable(self.nodes[mask], self.kpar[mask], self.npar[mask],
+                            self.ncore[mask], self.timing[mask], self.dataset[mask],
+                            self.datasets)
+
+    def to_records(self):
+        """
+        List of dictionaries with the metadata and settings of each record.
+        """
+        records = []
+        for timing, d in zip(self.to_timing_list(), self.dataset):
+            record = {k: self.datasets[d][k] for k in METADATA}
+            record.update(timing)
+            records.append(record)
+        return records
+
+
+class DataIndex:
+    """
+    Index over all data files in data_dir that follow the
+    <cluster>_<functional>_<ALGO>_<composition>_B<NBANDS>_K<NKPTS> naming scheme,
+    in the json or binary format.
+
+    The records of all files are stored as one set of columns in INDEX_FILE in
+    data_dir, along with the size and modification time of each file. On
+    construction, only the files that are new or have changed since are read.
+    """
+
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+        self.index_file = os.path.join(data_dir, INDEX_FILE)
+        self._table = None
+        self.update()
+
+    def _load(self):
+        try:
+            with np.load(self.index_file) as index:
+                columns = {c: index[c] for c in COLUMNS}
+                datasets = json.loads(str(index["datasets"]))
+        except (FileNotFoundError, KeyError, ValueError):
+            return {c: np.empty(0) for c in COLUMNS}, []
+        return columns, datasets
+
+    def _data_files(self):
+        """
+        Data files in data_dir, preferring the binary format in case a dataset is
+        available in both.
+        """
+        files = {}
+        with os.scandir(self.data_dir) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                stem, extension = os.path.splitext(entry.name)
+                if extension not in (".json", EXTENSION) or not entry.is_file():
+                    continue
+                if parse_data_filename(entry.name) is None:
+                    continue
+                if stem not in files or extension == EXTENSION:
+                    files[stem] = entry
+        return list(files.values())
+
+    def update(self):
+        """
+        Bring the index up to date with the files in data_dir, and write it to
+        INDEX_FILE in case anything has changed.
+        """
+        old_columns, old_datasets = self._load()
+        cached = {d["file"]: d for d in old_datasets}
+
+        columns = {c: [] for c in COLUMNS}
+        datasets = []
+        changed = False
+        start = 0
+
+        for entry in self._data_files():
+            stat = entry.stat()
+            fingerprint = [stat.st_size, stat.st_mtime_ns]
+            old = cached.get(entry.name)
+
+            if old is not None and old["fingerprint"] == fingerprint:
+                file_columns = {c: old_columns[c][old["start"]:old["stop"]]
+                                for c in COLUMNS if c != "dataset"}
+            else:
+                file_columns = _read_columns(entry.path)
+                changed = True
+
+            n_records = len(file_columns["timing"])
+            dataset = dict(parse_data_filename(entry.name), file=entry.name,
+                           fingerprint=fingerprint, start=start, stop=start + n_records)
+            file_columns["dataset"] = np.full(n_records, len(datasets))
+
+            for c in COLUMNS:
+                columns[c].append(file_columns[c])
+            datasets.append(dataset)
+            start += n_records
+
+        changed = changed or len(datasets) != len(old_datasets)
+
+        self.datasets = datasets
+        self.columns = {c: np.concatenate(columns[c]) if columns[c] else np.empty(0)
+                        for c in COLUMNS}
+        self._table = None
+
+        if changed:
+            np.savez(self.index_file, datasets=np.array(json.dumps(datasets)),
+                     **self.columns)
+
+    @property
+    def table(self):
+        """
+        IndexedTable with the records of all datasets.
+        """
+        if self._table is None:
+            self._table = IndexedTable(
+                *[self.columns[c] for c in COLUMNS], datasets=self.datasets
+            )
+        return self._table
+
+    def query(self, **conditions):
+        """
+        Records that match all conditions, which can refer to the settings, the
+        timing or the metadata of the datasets. See TimingTable.mask.
+        """
+        return self.table.select(**conditions)
+
+    def best(self, **conditions):
+        """
+        Fastest record of each dataset among the records that match the conditions,
+        e.g. best(nodes=4) for the best settings of every system on 4 nodes.
+        """
+        return self.query(**conditions).best(by="dataset")
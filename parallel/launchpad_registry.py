@@ -0,0 +1,70 @@
+import time, threading
+
+from fireworks import LaunchPad
+from pymongo.errors import PyMongoError
+
+
+def ping(lpad):
+    """
+    Make a round trip to the database of a LaunchPad, which forces the connection
+    to be set up. LaunchPads without a database, e.g. a MemoryLaunchPad, are left
+    alone.
+    """
+    db = getattr(lpad, "db", None)
+    if db is not None:
+        db.command("ping")
+
+
+class LaunchPadRegistry:
+    """
+    Lazily connected LaunchPads of the clusters in a CLUSTER_DICT. The "launchpad"
+    of each cluster can be the dictionary for LaunchPad.from_dict, in which case
+    the LaunchPad is only created and connected the first time it is requested,
+    or a LaunchPad (or stand-in) that is used as is.
+
+    Each LaunchPad is kept once connected, so all submissions to a cluster reuse
+    the connection pool of its MongoClient. The time it took to connect is stored
+    in latency.
+    """
+
+    def __init__(self, cluster_dict, factory=LaunchPad.from_dict):
+        self.configs = {c: d["launchpad"] for c, d in cluster_dict.items()}
+        self.factory = factory
+        self.latency = {}
+        self._launchpads = {}
+        self._locks = {c: threading.Lock() for c in self.configs}
+
+    def __contains__(self, cluster):
+        return cluster in self._launchpads
+
+    def get(self, cluster):
+        """
+        LaunchPad of cluster, which is connected in case this is the first request.
+        Raises a ConnectionError in case the connection fails, so it is retried on
+        the next request.
+        """
+        with self._locks[cluster]:
+            if cluster not in self._launchpads:
+                config = self.configs[cluster]
+                start = time.perf_counter()
+                try:
+                    lpad = self.factory(config) if isinstance(config, dict) else config
+                    ping(lpad)
+                except PyMongoError as error:
+                    raise ConnectionError("Failed to connect to the LaunchPad of "
+                                          + cluster + ": " + str(error))
+                self.latency[cluster] = time.perf_counter() - start
+                self._launchpads[cluster] = lpad
+
+        return self._launchpads[cluster]
+
+    def close(self):
+        """
+        Close the connections of all LaunchPads that have been connected.
+        """
+        for lpad in self._launchpads.values():
+            connection = getattr(lpad, "connection", None)
+            if connection is not None:
+                connection.close()
+        self._launchpads.clear()
+        self.latency.clear()
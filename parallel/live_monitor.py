@@ -0,0 +1,178 @@
+import os, time, threading
+import numpy as np
+
+from matplotlib.figure import Figure
+from IPython import get_ipython
+from ipywidgets import Dropdown, Button, HTML, Image, VBox, HBox
+
+from outcar import OutcarTail, read_nelmdl, timing_record
+from process_output import find_runs
+from render_cache import render_figures
+from timing_table import TimingTable
+from parallel_plots import chessboard_plot
+
+
+class TestMonitor:
+    """
+    Follows the calculations of a parallelization test while they are running,
+    i.e. the <N>nodes/<K>kpar/<P>npar directories below the parallelization_dir
+    of submit_workflows. Every poll looks for new run directories and only reads
+    the lines that have been appended to each OUTCAR since the previous poll.
+    """
+
+    def __init__(self, parallelization_dir):
+        self.parallelization_dir = parallelization_dir
+        self.tails = {}
+        self.nelmdl = {}
+
+    def poll(self):
+        """
+        Update all runs. Returns the total number of new electronic steps.
+        """
+        new_steps = 0
+
+        try:
+            runs = find_runs(self.parallelization_dir)
+        except FileNotFoundError:
+            # The directory is only created once the first test starts
+            return new_steps
+
+        for run in runs:
+            nodes, kpar, npar, run_dir = run
+
+            if run not in self.nelmdl:
+                try:
+                    self.nelmdl[run] = read_nelmdl(os.path.join(run_dir, "INCAR"))
+                except FileNotFoundError:
+                    continue
+                self.tails[run] = OutcarTail(os.path.join(run_dir, "OUTCAR"))
+
+            new_steps += self.tails[run].update()
+
+        return new_steps
+
+    def steps(self):
+        """
+        Number of electronic steps completed by each run, excluding the NELMDL
+        non-selfconsistent steps.
+        """
+        return {run[:3]: max(len(tail.loop_timings) - self.nelmdl[run], 0)
+                for run, tail in self.tails.items()}
+
+    def table(self):
+        """
+        TimingTable with the average time per electronic step of every run that has
+        completed more than NELMDL steps so far, the same way process_parallel
+        averages the finished runs.
+        """
+        timing_list = []
+        n_kpoints = nbands = None
+
+        for run, tail in self.tails.items():
+            data = tail.data
+            if data["total_cores"] is None:
+                continue
+            record = timing_record(data, *run[:3], self.nelmdl[run])
+            if record is not None:
+                timing_list.append(record)
+                n_kpoints, nbands = data["n_kpoints"], data["nbands"]
+
+        return TimingTable.from_timing_list(timing_list, n_kpoints=n_kpoints,
+                                            nbands=nbands)
+
+
+def slow_runs(table, factor=2.0):
+    """
+    Settings whose current time per electronic step is more than factor times the
+    best one for the same number of nodes, which are candidates to be stopped.
+    """
+    slow = []
+    for nodes in table.unique("nodes"):
+        node_table = table.select(nodes=nodes)
+        best = np.min(node_table.timing)
+        for record in node_table.select(timing=lambda t: t > factor * best).to_timing_list():
+            slow.append(record)
+    return slow
+
+
+def on_main_thread(function):
+    """
+    Schedule a call of function on the event loop of the kernel, i.e. on the main
+    thread, where the widgets and pyplot are used. Outside of a kernel, function
+    is called directly.
+    """
+    kernel = getattr(get_ipython(), "kernel", None)
+    if kernel is None:
+        function()
+    else:
+        kernel.io_loop.add_callback(function)
+
+
+def monitor_interface(parallelization_dir, interval=30, x_axis="NCORE"):
+    """
+    Live chessboard of a running parallelization test, updated every interval
+    seconds until the Stop button is pressed. The OUTCARs are polled in a
+    background thread, but the chessboard is drawn on the main thread, as
+    matplotlib is not thread-safe. The status
+    line shows the number of finished steps and the settings that are more than
+    twice as slow as the best one so far.
+    """
+    monitor = TestMonitor(parallelization_dir)
+    stop = threading.Event()
+    lock = threading.RLock()
+
+    nodes_widget = Dropdown(description="Nodes:", options=[])
+    stop_button = Button(description="Stop")
+    status = HTML()
+    image = Image(format="png")
+    figure = Figure()
+
+    def redraw(change=None):
+        with lock:
+            _redraw()
+
+    def _redraw():
+        table = monitor.table()
+        steps = monitor.steps()
+
+        text = "<pre>" + time.strftime("%H:%M:%S") + " - " + str(len(steps)) \
+               + " runs, " + str(sum(steps.values())) + " electronic steps"
+        for record in slow_runs(table):
+            text += "\nSlow: " + str(record["nodes"]) + " nodes, KPAR = " \
+                    + str(record["kpar"]) + ", NPAR = " + str(record["npar"]) \
+                    + " (%.1f s)" % record["timing"]
+        status.value = text + "</pre>"
+
+        nodes_options = [int(n) for n in table.unique("nodes")]
+        if nodes_options != list(nodes_widget.options):
+            nodes_widget.options = nodes_options
+        if len(table) == 0:
+            return
+        if nodes_widget.value is None:
+            # Selecting the nodes redraws the chessboard through the observer.
+            nodes_widget.value = nodes_options[0]
+            return
+
+        render = render_figures(chessboard_plot, {
+            "table": table, "nodes": nodes_widget.value, "x_axis": x_axis,
+            "figure": figure
+        })
+        if render["images"]:
+            image.value = render["images"][0]
+
+    def follow():
+        while not stop.is_set():
+            with lock:
+                new_steps = monitor.poll()
+            if new_steps:
+                on_main_thread(redraw)
+            stop.wait(interval)
+
+    nodes_widget.observe(redraw, "value")
+    stop_button.on_click(lambda b: stop.set())
+
+    monitor.poll()
+    redraw()
+    threading.Thread(target=follow, daemon=True).start()
+
+    return VBox([HBox([nodes_widget, stop_button]), status, image])
@@ -1,27 +1,37 @@
-import os
-import numpy as np
+import threading
 
 from vscworkflows.workflows.core import get_wf_parallel
-from vscworkflows.setup.sets import BulkStaticSet
 from fireworks import LaunchPad
 from pymatgen import Structure
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 
-from ipywidgets import interactive, fixed, Select, IntSlider, IntRangeSlider, Button, Output, FileUpload, BoundedIntText, Text, VBox, HBox, Layout
+from ipywidgets import interactive, fixed, Select, IntSlider, IntRangeSlider, Button, Output, FileUpload, BoundedIntText, Text, HBox, Checkbox
+
+from adaptive_planner import ParallelizationPlanner
+from launchpad_registry import LaunchPadRegistry
+from live_monitor import monitor_interface
+from batch_submission import read_structures, prepare_systems, system_settings, \
+    parallelization_dir, batch_tasks, system_workflow, firework_states, WorkflowSubmitter
+from process_output import find_runs, parse_runs
+from system_cache import SYSTEM_CACHE
+from parallel_plots import profile_interface
+from profiling import Timer
+from timing_table import TimingTable
 
     
-def selection_interface(structure, fworker, kpt_density, functional, 
-                        nodes_list, nbands, max_kpt_range):
+def selection_interface(structure, fworker, kpt_density, n_kpoints, functional, 
+                        nodes_list, nbands, max_kpt_range, adaptive):
     
     selection_dict = {}
     selection_dict["structure"] = structure
     selection_dict["scratch_dir"] = CLUSTER_DICT[fworker]["scratch_dir"]
     selection_dict["cores_per_node"] = CLUSTER_DICT[fworker]["cores_per_node"]
-    selection_dict["lpad"] = CLUSTER_DICT[fworker]["launchpad"]
+    selection_dict["fworker"] = fworker
     selection_dict["functional"] = (functional, {})
     selection_dict["kpt_density"] = kpt_density
     selection_dict["nbands"] = nbands
     selection_dict["max_kpt_range"] = max_kpt_range
+    selection_dict["n_kpoints"] = n_kpoints
+    selection_dict["adaptive"] = adaptive
     try:
         selection_dict["nodes_list"] = [int(i) for i in nodes_list.strip(', ').split(',')]
     except ValueError:
@@ -41,7 +51,8 @@ def file_interface(fu, fworker, kpt_density):
         else:
             file_fmt = spl[-1]
             
-        structure = Structure.from_str(input_string=file_str, fmt=file_fmt)
+        with Timer("Structure.from_str"):
+            structure = Structure.from_str(input_string=file_str, fmt=file_fmt)
 
     except UnicodeDecodeError:
         print("Issue with geometry input file.")
@@ -53,31 +64,14 @@ def file_interface(fu, fworker, kpt_density):
         print("Incorrect format for input file.")
         return
     
-    static = BulkStaticSet(
-        structure, user_incar_settings=user_incar_settings,
-        user_kpoints_settings={"reciprocal_density": kpt_density}
-    )
-    
-    nions = len(structure)
-    nelect = static.nelect
-    ispin = int(static.incar.get("ISPIN", 1))
-
-    if ispin == 1:
-        nbands = int(round(nelect / 2 + nions / 2))
-    elif ispin == 2:
-        nbands = int(nelect * 3 / 5 + nions)
-    else:
-        raise ValueError("ISPIN Value is not set to 1 or 2!")
-    
     cores_per_node = CLUSTER_DICT[fworker]["cores_per_node"]
-    nbands = (nbands // cores_per_node + 1) * cores_per_node
-    
-    kpoints = static.kpoints
-    spg = SpacegroupAnalyzer(structure, symprec=1e-5)
-    max_kpts = len(spg.get_ir_reciprocal_mesh(kpoints.kpts))
+    settings = system_settings(structure, kpt_density, cores_per_node, user_incar_settings)
+    SYSTEM_CACHE.save()
+    nbands, max_kpts = settings["nbands"], settings["n_kpoints"]
 
     selection = interactive(selection_interface, structure=fixed(structure),
                             fworker=fixed(fworker), kpt_density=fixed(kpt_density),
+                            n_kpoints=fixed(max_kpts),
                             functional=Select(
                                 options=['pbe', 'hse06'],
                                 value='pbe',
@@ -102,6 +96,10 @@ def file_interface(fu, fworker, kpt_density):
                                 max=max_kpts + cores_per_node // 2,
                                 step=1,
                                 description='Max KPAR range:',
+                            ),
+                            adaptive=Checkbox(
+                                value=False,
+                                description='Adaptive planner'
                             ))
     
     display(HBox(selection.children[:2]))
@@ -111,8 +109,96 @@ def file_interface(fu, fworker, kpt_density):
     return selection
 
 
+def parallel_workflow(selection, nodes, kpar_range):
+    
+    structure = selection.result["structure"]
+    incar_settings = dict(user_incar_settings, NBANDS=selection.result["nbands"])
+    user_kpoints_settings = {"reciprocal_density": selection.result["kpt_density"]}
+    
+    return get_wf_parallel(
+        structure=structure,
+        directory=selection.result["parallelization_dir"],
+        nodes=nodes,
+        nbands=selection.result["nbands"],
+        functional=selection.result["functional"],
+        user_kpoints_settings=user_kpoints_settings,
+        user_incar_settings=incar_settings,
+        handlers=handlers,
+        cores_per_node=selection.result["cores_per_node"],
+        kpar_range=kpar_range
+    )
+
+
+def report_submission(result):
+    
+    # Let the planner track the runs of the (nodes, KPAR) pairs it planned
+    pair = planned_pairs.pop(result["label"], None)
+    if pair is not None and planner is not None:
+        planner.record_submission(
+            pair, result["fw_ids"] if result["status"] == "submitted" else None
+        )
+    
+    if result["status"] == "submitted":
+        output.append_stdout(
+            "Submitted " + result["label"] + " (built in %.2f s, inserted in %.2f s)\n"
+            % (result["build_time"], result["insert_time"])
+        )
+    elif result["status"] == "failed":
+        output.append_stdout("Failed to submit " + result["label"] + ": "
+                             + result["error"] + "\n")
+    else:
+        output.append_stdout("Cancelled " + result["label"] + "\n")
+    
+    
+def get_launchpad(fworker):
+    
+    connected = fworker in LAUNCHPADS
+    lpad = LAUNCHPADS.get(fworker)
+    if not connected:
+        print("Connected to the " + fworker + " LaunchPad in %.2f s."
+              % LAUNCHPADS.latency[fworker])
+    
+    return lpad
+
+
+def start_submitter(fworker):
+    
+    global submitter
+    
+    lpad = get_launchpad(fworker)
+    
+    # Reuse the submitter of the LaunchPad, unless it has been cancelled
+    if submitter is None or submitter.lpad is not lpad or submitter.cancelled:
+        if submitter is not None:
+            # Stop the threads of the previous submitter once it is done
+            threading.Thread(target=submitter.shutdown, daemon=True).start()
+        submitter = WorkflowSubmitter(lpad, callback=report_submission)
+    display(HBox([cancel_button, monitor_button]))
+    
+    return submitter
+
+
+def cancel_submission(b):
+    
+    if submitter is not None:
+        submitter.cancel()
+
+
+def submit_batch(selection, batch):
+    
+    batch_submitter = start_submitter(selection.result["fworker"])
+    
+    for nodes, kpar in batch:
+        label = str(nodes) + " nodes, KPAR = " + str(kpar)
+        planned_pairs[label] = (nodes, kpar)
+        batch_submitter.submit(label, parallel_workflow, selection, nodes, 
+                               kpar_range=(kpar, kpar))
+
+
 def submit_workflows(b):
     
+    global planner
+    
     with output:
         
         output.clear_output()
@@ -122,35 +208,147 @@ def submit_workflows(b):
         try:
             structure = selection.result["structure"]
 
-            parallelization_dir = os.path.join(
-                selection.result["scratch_dir"], "parallel_" + selection.result["functional"][0],
-                str(structure.composition).replace(" ", ""),  str(selection.result["nbands"])
-                + "bands_" + str(selection.result["kpt_density"]) + "kpoints"
+            selection.result["parallelization_dir"] = parallelization_dir(
+                selection.result["scratch_dir"], selection.result["functional"],
+                structure, selection.result["nbands"], selection.result["kpt_density"]
             )
-            user_incar_settings.update({"NBANDS": selection.result["nbands"]})
-            user_kpoints_settings = {"reciprocal_density": selection.result["kpt_density"]}
             
-            for nodes in selection.result["nodes_list"]:
-                selection.result["lpad"].add_wf(
-                    get_wf_parallel(
-                        structure=structure,
-                        directory=parallelization_dir,
-                        nodes=nodes,
-                        nbands=selection.result["nbands"],
-                        functional=selection.result["functional"],
-                        user_kpoints_settings=user_kpoints_settings,
-                        user_incar_settings=user_incar_settings,
-                        handlers=handlers,
-                        cores_per_node=selection.result["cores_per_node"],
-                        kpar_range=selection.result["max_kpt_range"]
-                    )
+            if selection.result["adaptive"]:
+                planner = ParallelizationPlanner(
+                    nodes_list=selection.result["nodes_list"],
+                    cores_per_node=selection.result["cores_per_node"],
+                    nbands=selection.result["nbands"],
+                    n_kpoints=selection.result["n_kpoints"],
+                    functional=selection.result["functional"][0],
+                    kpar_range=selection.result["max_kpt_range"]
                 )
+                submit_batch(selection, planner.next_batch(TimingTable.from_timing_list([])))
+                display(next_button)
+                return
+            
+            nodes_submitter = start_submitter(selection.result["fworker"])
+            
+            for nodes in selection.result["nodes_list"]:
+                nodes_submitter.submit(str(nodes) + " nodes", parallel_workflow, selection,
+                                       nodes, kpar_range=selection.result["max_kpt_range"])
         except TypeError as t:
             print(t)
             print("Incorrect node list input!")
+        except ConnectionError as error:
+            print(error)
+
+
+def submit_next_batch(b):
+    
+    with output:
+        
+        output.clear_output()
+        selection = file.result
+        
+        try:
+            results = parse_runs(find_runs(selection.result["parallelization_dir"]))
+        except FileNotFoundError:
+            print("Waiting for the submitted tests to start.")
+            display(next_button)
+            return
+        table = TimingTable.from_timing_list(
+            [r["timing"] for r in results if r["timing"] is not None],
+            n_kpoints=selection.result["n_kpoints"], nbands=selection.result["nbands"]
+        )
+        
+        try:
+            lpad = get_launchpad(selection.result["fworker"])
+            planner.update_states(firework_states(lpad, planner.unfinished_runs()))
+        except ConnectionError as error:
+            print(error)
+            return
+        
+        if planner.is_converged(table):
+            print("Optimal settings found for all nodes within the tolerance.")
+            return
+        
+        batch = planner.next_batch(table)
+        if not batch:
+            print("Waiting for the submitted tests to finish.")
+        submit_batch(selection, batch)
+        display(next_button)
+
+
+def monitor_tests(b):
+    
+    with monitor_output:
+        
+        monitor_output.clear_output()
+        try:
+            parallelization_dir = file.result.result["parallelization_dir"]
+        except (AttributeError, KeyError):
+            print("Submit the workflows of a structure first.")
+            return
+        
+        display(monitor_interface(parallelization_dir))
+
+
+def show_profile(b):
+    
+    with profile_output:
+        
+        profile_output.clear_output()
+        display(profile_interface())
+
+
+def submit_structure_batch(b):
+    
+    with output:
+        
+        output.clear_output()
+        fworker = file.kwargs["fworker"]
+        kpt_density = file.kwargs["kpt_density"]
+        cores_per_node = CLUSTER_DICT[fworker]["cores_per_node"]
+        
+        try:
+            nodes_list = [int(i) for i in batch_nodes.value.strip(', ').split(',')]
+            structures = read_structures(batch_path.value)
+            batch_submitter = start_submitter(fworker)
+        except (ValueError, ConnectionError) as error:
+            print(error)
+            return
+        
+        print("Preparing " + str(len(structures)) + " structures...")
+        
+        # Prepare the systems in the background, the workflows are then built and
+        # added to the LaunchPad by the submitter
+        threading.Thread(
+            target=submit_systems, daemon=True,
+            args=(batch_submitter, structures, nodes_list, batch_functional.value,
+                  kpt_density, CLUSTER_DICT[fworker]["scratch_dir"], cores_per_node)
+        ).start()
+
+
+def submit_systems(batch_submitter, structures, nodes_list, functional, kpt_density,
+                   scratch_dir, cores_per_node):
+    
+    try:
+        systems = prepare_systems(structures, kpt_density, cores_per_node,
+                                  user_incar_settings)
+    except Exception as error:
+        output.append_stdout("Failed to prepare the structures: " + str(error) + "\n")
+        return
+    
+    for system in systems:
+        if system["error"] is not None:
+            output.append_stdout("Skipping " + system["name"] + ": "
+                                 + system["error"] + "\n")
+    
+    for label, system, nodes, name in batch_tasks(systems, nodes_list):
+        batch_submitter.submit(label, system_workflow, system, nodes, (functional, {}),
+                               kpt_density, scratch_dir, cores_per_node,
+                               user_incar_settings, handlers, name)
+
 
 style = {'description_width': 'initial'}
 
+LAUNCHPADS = LaunchPadRegistry(CLUSTER_DICT)
+
 file = interactive(file_interface, fu=FileUpload(), 
                    fworker=Select(options=CLUSTER_DICT.keys(),
                                   value='leibniz',
@@ -165,8 +363,34 @@ file = interactive(file_interface, fu=FileUpload(),
 
 button = Button(description="Submit Workflow")
 button.on_click(submit_workflows)
+next_button = Button(description="Submit Next Batch")
+next_button.on_click(submit_next_batch)
+planner = None
+planned_pairs = {}
+cancel_button = Button(description="Cancel Submission")
+cancel_button.on_click(cancel_submission)
+submitter = None
+monitor_button = Button(description="Monitor Tests")
+monitor_button.on_click(monitor_tests)
+monitor_output = Output()
+profile_button = Button(description="Profile")
+profile_button.on_click(show_profile)
+profile_output = Output()
+
+batch_path = Text(placeholder='Directory or archive', description='Batch:')
+batch_functional = Select(options=['pbe', 'hse06'], value='pbe', rows=2,
+                          description='Functional:')
+batch_nodes = Text(value="1, 2, 4", placeholder='Nodes (comma separated)',
+                   description='Node List:')
+batch_button = Button(description="Submit Batch")
+batch_button.on_click(submit_structure_batch)
+
 output = Output()
 
 display(HBox(file.children[:3]))
 display(file.children[-1])
-display(output)
\ No newline at end of file
+display(HBox([batch_path, batch_functional, batch_nodes, batch_button]))
+display(output)
+display(monitor_output)
+display(profile_button)
+display(profile_output)
\ No newline at end of file
@@ -0,0 +1,163 @@
+import os, re
+import numpy as np
+
+from monty.io import zopen
+from pymatgen.io.vasp.inputs import Incar
+
+CORES_PATTERN = re.compile(rb"running\s+on\s+(\S+)\s+total\s+cores")
+NKPTS_PATTERN = re.compile(rb"k-points\s+NKPTS\s=\s+([0-9]+)")
+NBANDS_PATTERN = re.compile(rb"NBANDS=\s+([0-9]+)")
+LOOP_PATTERN = re.compile(rb"^[ \t]+LOOP:[ \t]+cpu time[^\n]*:[ \t]*real time[ \t]*(\S+)",
+                          re.MULTILINE)
+
+HEADER_PATTERNS = {
+    "total_cores": CORES_PATTERN,
+    "n_kpoints": NKPTS_PATTERN,
+    "nbands": NBANDS_PATTERN
+}
+
+CHUNK_SIZE = 2 ** 22
+
+
+def scan_block(block, outcar_data, missing, loop_timings):
+    """
+    Search a block of complete OUTCAR lines for the header fields that are still
+    missing, which are removed from missing once found, and append the LOOP
+    timings in the block to loop_timings.
+    """
+    for key, pattern in list(missing.items()):
+        match = pattern.search(block)
+        if match:
+            outcar_data[key] = int(match.group(1))
+            missing.pop(key)
+
+    loop_timings.extend(LOOP_PATTERN.findall(block))
+
+
+def parse_outcar(outcar_file, loops=True, chunk_size=CHUNK_SIZE):
+    """
+    Extract the fields needed for the parallelization tests from an OUTCAR in a
+    single buffered pass.
+
+    The file is read in chunks of chunk_size bytes, cut at the last newline so no
+    line is ever split between two chunks. The header fields (total number of
+    cores, NKPTS and NBANDS) are only searched for until they are all found. If
+    loops is False, reading stops at that point, else the real time of every
+    electronic step (LOOP) is collected until the end of the file.
+
+    Returns a dictionary with the keys "total_cores", "n_kpoints", "nbands" and
+    "loop_timings", the latter as a numpy array. Header fields that are not found
+    are None.
+    """
+    outcar_data = {key: None for key in HEADER_PATTERNS.keys()}
+    missing = dict(HEADER_PATTERNS)
+    loop_timings = []
+
+    with zopen(outcar_file, "rb") as file:
+
+        remainder = b""
+
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                block = remainder
+            else:
+                block = remainder + chunk
+                cut = block.rfind(b"\n") + 1
+                block, remainder = block[:cut], block[cut:]
+
+            if loops:
+                scan_block(block, outcar_data, missing, loop_timings)
+            else:
+                scan_block(block, outcar_data, missing, [])
+                if not missing:
+                    break
+
+            if not chunk:
+                break
+
+    outcar_data["loop_timings"] = np.array(loop_timings, dtype=float)
+
+    return outcar_data
+
+
+def read_nelmdl(incar_file):
+    """
+    Number of non-selfconsistent steps at the start of the calculation, which are
+    discarded when averaging the time per electronic step.
+    """
+    return abs(Incar.from_file(incar_file).get("NELMDL", 5))
+
+
+def timing_record(outcar_data, nodes, kpar, npar, nelmdl):
+    """
+    Reduce the parsed OUTCAR data to an entry of the timing_list, i.e. a
+    dictionary with the nodes, kpar, ncore, npar, the average timing and the
+    timings of the electronic steps it is based on. Returns None in case the
+    calculation has not completed more than nelmdl electronic steps.
+    """
+    loop_timings = outcar_data["loop_timings"]
+
+    if len(loop_timings) <= nelmdl:
+        return None
+
+    ncore = outcar_data["total_cores"] // kpar // npar
+
+    return {"nodes": nodes, "kpar": kpar, "ncore": ncore, "npar": npar,
+            "timing": float(np.mean(loop_timings[nelmdl:])),
+            "steps": loop_timings[nelmdl:].astype(np.float32).tolist()}
+
+
+class OutcarTail:
+    """
+    Incremental parser for the OUTCAR of a running calculation. Each update only
+    reads the bytes that have been appended since the previous one, and keeps an
+    incomplete last line until it is finished. In case the file shrinks, e.g.
+    because the calculation was restarted, it is parsed again from the start.
+    """
+
+    def __init__(self, outcar_file):
+        self.outcar_file = outcar_file
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.remainder = b""
+        self.outcar_data = {key: None for key in HEADER_PATTERNS.keys()}
+        self.missing = dict(HEADER_PATTERNS)
+        self.loop_timings = []
+
+    def update(self):
+        """
+        Parse the newly appended lines. Returns the number of new electronic steps.
+        """
+        try:
+            size = os.path.getsize(self.outcar_file)
+        except FileNotFoundError:
+            return 0
+
+        if size < self.offset:
+            self.reset()
+        if size == self.offset:
+            return 0
+
+        with open(self.outcar_file, "rb") as file:
+            file.seek(self.offset)
+            chunk = file.read(size - self.offset)
+        self.offset += len(chunk)
+
+        block = self.remainder + chunk
+        cut = block.rfind(b"\n") + 1
+        block, self.remainder = block[:cut], block[cut:]
+
+        n_steps = len(self.loop_timings)
+        scan_block(block, self.outcar_data, self.missing, self.loop_timings)
+
+        return len(self.loop_timings) - n_steps
+
+    @property
+    def data(self):
+        """
+        The parsed OUTCAR data so far, in the format returned by parse_outcar.
+        """
+        return dict(self.outcar_data, loop_timings=np.array(self.loop_timings, dtype=float))
@@ -1,43 +1,77 @@
-import os, json
+import json, hashlib
 import numpy as np
+from functools import lru_cache
 from matplotlib import colors, cm
 from matplotlib.patches import Rectangle
+from matplotlib.collections import PathCollection
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath
+from matplotlib.transforms import Affine2D
 import matplotlib.pyplot as plt
 
-from monty.json import MontyDecoder
-from ipywidgets import interact, interactive, interactive_output, fixed, FloatSlider, Tab, \
-    Select, SelectMultiple, HBox, VBox, Output, Text, Button, Layout, Checkbox
-from ipyfilechooser import FileChooser
-
-from vscworkflows.firetasks.core import VaspParallelizationTask
-
-OPT_BAND_PARALLEL_PBE = 7
-OPT_BAND_PARALLEL_HSE = 8
+from ipywidgets import interactive_output, fixed, FloatSlider, Tab, Select, \
+    SelectMultiple, HBox, VBox, Output, Text, Button, Layout, Checkbox, BoundedIntText, \
+    BoundedFloatText
+from IPython.display import clear_output
+
+from timing_table import TimingTable
+from render_cache import cached_output, render_figures, show_render
+from profiling import PROFILER, PROFILE_FILE, Timer, timed
+from timing_store import TimingDataset, EXTENSION
+from data_index import parse_data_filename
+from performance_model import PerformanceModel, predict_grid
+from timing_stats import STATISTICS, robust_table, bootstrap_ci, indistinguishable
+from recommendations import recommendation_table, recommendation_ranks
+from scaling import node_seconds, pareto_frontier, scaling_data, max_efficient_nodes, \
+    AmdahlFit, GustafsonFit, recommend_nodes
+
+# Grids with more cell labels than this are labeled with a single collection
+BATCHED_LABELS = 200
+
+@timed()
+def load_table(filename):
+    """
+    Load the TimingTable of a data file, either in the json or binary format, along
+    with a hash that identifies the data. The structure is not decoded.
+    """
+    if filename.endswith(EXTENSION):
+        dataset = TimingDataset(filename)
+        return dataset.table, dataset.fingerprint
+
+    with open(filename, "r") as file:
+        content = file.read()
+
+    with Timer("load_table.json_decode"):
+        data = json.loads(content)
+
+    if not isinstance(data["timing_list"], list):
+        raise TypeError("timing_list is not a List. Please check your input file.")
+
+    with Timer("load_table.from_data"):
+        table = TimingTable.from_data(data)
+
+    return table, hashlib.sha1(content.encode()).hexdigest()
 
 def interface(f):
     
     try:
-        with open(f.selected, "r") as file:
-            data = json.loads(file.read(), cls=MontyDecoder)
+        table, data_hash = load_table(f.selected)
     except FileNotFoundError:
         return "Please select an existing file."
+    except TypeError as error:
+        return str(error)
     
-    print("NKPTS = " + str(data["n_kpoints"]) + "\tNBANDS = " + str(data["nbands"]))
-    timing_list = data["timing_list"]
-    
-    try:
-        assert isinstance(timing_list, list)
-    except AssertionError:
-        return "timing_list is not a List. Please check your input file."
-
-    nodes_list = list(set([t["nodes"] for t in timing_list]))
-    nodes_list.sort()
+    print("NKPTS = " + str(table.n_kpoints) + "\tNBANDS = " + str(table.nbands))
 
-    kpar_list = list(set([t["kpar"] for t in timing_list]))
-    kpar_list.sort()
+    functional = (parse_data_filename(f.selected) or {}).get("functional")
+    with Timer("PerformanceModel.fit"):
+        model = PerformanceModel().fit(table, functional=functional)
 
-    ncore_list = list(set([t["ncore"] for t in timing_list]))
-    ncore_list.sort()
+    nodes_list = table.unique("nodes").tolist()
+    kpar_list = table.unique("kpar").tolist()
+    ncore_list = table.unique("ncore").tolist()
     
     select_layout = Layout(width='70px')
 
@@ -61,49 +95,91 @@ def interface(f):
                                   layout=select_layout)
     is_hybrid = Checkbox(value=False,
                       description="Hybrid?")
+    predict = Checkbox(value=False,
+                       description="Predict?")
+    efficiency = FloatSlider(value=0.75, min=0.05, max=1, step=0.05,
+                             layout=Layout(width='200px'))
+    n_steps = BoundedIntText(value=1000, min=1, max=10 ** 7, 
+                             layout=Layout(width='100px'))
+    budget = BoundedFloatText(value=0, min=0, max=10 ** 9, 
+                              layout=Layout(width='100px'))
+    deadline = BoundedFloatText(value=0, min=0, max=10 ** 6, 
+                                layout=Layout(width='100px'))
+    statistic = Select(options=list(STATISTICS.keys()), index=0,
+                       layout=Layout(width='110px'))
+    show_ci = Checkbox(value=False,
+                       description="CI?")
 
     widget_mappings = {
         "Timestep": {
             "descriptions": ["X-axis", ],
             "input": (versus, ),
-            "output": interactive_output(
-                time_plot, {"timing_list": fixed(timing_list),
-                            "versus": versus}
+            "output": cached_output(
+                time_plot, {"table": fixed(table),
+                            "versus": versus},
+                key=(data_hash, "Timestep")
             )
         },
         "Chessboard": {
-            "descriptions": ["Nodes", "X-axis", "Hybrid"],
-            "input": (nodes, x_axis_select, is_hybrid),
-            "output": interactive_output(
-                chessboard_plot, {"data": fixed(data),
+            "descriptions": ["Nodes", "X-axis", "Statistic", "Hybrid", "Predict", "CI"],
+            "input": (nodes, x_axis_select, statistic, is_hybrid, predict, show_ci),
+            "output": cached_output(
+                chessboard_plot, {"table": fixed(table),
                                   "nodes": nodes, 
                                   "x_axis": x_axis_select,
-                                  "is_hybrid": is_hybrid}
+                                  "is_hybrid": is_hybrid,
+                                  "model": fixed(model),
+                                  "predict": predict,
+                                  "statistic": statistic,
+                                  "show_ci": show_ci,
+                                  "figure": fixed(Figure())},
+                key=(data_hash, "Chessboard")
             )
         },
         "Tetris": {
-            "descriptions": ["Nodes", "KPAR", "NCORE", "Hybrid"],
-            "input": [nodes_select, kpar_select, ncore_select, is_hybrid],
-            "output": interactive_output(
-                tetris_plot, {"data": fixed(data),
+            "descriptions": ["Nodes", "KPAR", "NCORE", "Statistic", "Hybrid", "CI"],
+            "input": [nodes_select, kpar_select, ncore_select, statistic, is_hybrid,
+                      show_ci],
+            "output": cached_output(
+                tetris_plot, {"table": fixed(table),
                               "nodes_choices": nodes_select,
                               "kpar_choices": kpar_select,
                               "ncore_choices": ncore_select,
-                              "is_hybrid": is_hybrid}
+                              "is_hybrid": is_hybrid,
+                              "statistic": statistic,
+                              "show_ci": show_ci,
+                              "figure": fixed(Figure())},
+                key=(data_hash, "Tetris")
             )
         },
         "Optimal": {
-            "descriptions": [],
-            "input": (),
-            "output": interactive_output(
-                optimal_settings, {"timing_list": fixed(timing_list)}
+            "descriptions": ["Statistic", "Hybrid", "CI"],
+            "input": (statistic, is_hybrid, show_ci),
+            "output": cached_output(
+                optimal_settings, {"table": fixed(table),
+                                   "statistic": statistic,
+                                   "is_hybrid": is_hybrid,
+                                   "show_ci": show_ci},
+                key=(data_hash, "Optimal")
+            )
+        },
+        "Cost": {
+            "descriptions": ["Eff.", "Steps", "Budget", "Deadline"],
+            "input": (efficiency, n_steps, budget, deadline),
+            "output": cached_output(
+                cost_plot, {"table": fixed(table),
+                            "efficiency": efficiency,
+                            "n_steps": n_steps,
+                            "budget": budget,
+                            "deadline": deadline},
+                key=(data_hash, "Cost")
             )
         },
 #         "NPAR line plot": {
 #             "descriptions": ["Nodes", ],
 #             "input": (nodes, ),
 #             "output": interactive_output(
-#                 npar_line_plot, {"timing_list": fixed(timing_list),
+#                 npar_line_plot, {"table": fixed(table),
 #                                 "nodes": nodes}
 #             )
 #         },
@@ -111,7 +187,7 @@ def interface(f):
 #             "descriptions": ["Nodes", ],
 #             "input": (nodes, ),
 #             "output": interactive_output(
-#                 ncore_line_plot, {"timing_list": fixed(timing_list),
+#                 ncore_line_plot, {"table": fixed(table),
 #                                   "nodes": nodes}
 #             )
 #         }
@@ -119,27 +195,26 @@ def interface(f):
 
     tab = Tab()
     tab.children = [VBox((HBox([VBox((Button(description=desc, layout=select_layout), inp)) 
-                                if desc != "Hybrid" else inp for (desc, inp) in zip(w["descriptions"], w["input"])]), w["output"])) 
+                                if desc not in ("Hybrid", "Predict", "CI") else inp for (desc, inp) in zip(w["descriptions"], w["input"])]), w["output"])) 
                     for w in widget_mappings.values()]
 
-    for i, title in enumerate(widget_mappings.keys()):
+    tab.children += (profile_interface(), )
+
+    for i, title in enumerate(list(widget_mappings.keys()) + ["Profile"]):
         tab.set_title(i, title)
     
     return tab
 
-def time_plot(timing_list, versus):
+def time_plot(table, versus):
     
     if versus == "NODES":
-        time_vs_nodes(timing_list)
+        time_vs_nodes(table)
     elif versus == "KPAR":
-        time_vs_kpar(timing_list)
+        time_vs_kpar(table)
 
-def time_vs_nodes(timing_list):
+def time_vs_nodes(table):
     
-    kpar_list = list(set(
-        [t["kpar"] for t in timing_list]
-    ))
-    kpar_list.sort()
+    kpar_list = table.unique("kpar")
     
     plt.rcdefaults()
     cmap = cm.viridis._resample(len(kpar_list))
@@ -148,9 +223,9 @@ def time_vs_nodes(timing_list):
     fig, ax = plt.subplots()
 
     plt.scatter(
-        x=[t["nodes"] for t in timing_list], 
-        y=[t["timing"] for t in timing_list],
-        c=[cmap.colors[kpar_list.index(t["kpar"])] for t in timing_list]
+        x=table.nodes, 
+        y=table.timing,
+        c=cmap.colors[np.searchsorted(kpar_list, table.kpar)]
     )
 
     plt.yscale("log")
@@ -164,69 +239,171 @@ def time_vs_nodes(timing_list):
     
     return plt
 
-def time_vs_kpar(timing_list):
+def time_vs_kpar(table):
     
     plt.rcdefaults()
     plt.rc("font", size=14)
     
-    node_list = list(set(
-        [t["nodes"] for t in timing_list]
-    ))
-    node_list.sort()
+    node_list = table.unique("nodes")
 
     for node in node_list:
 
-        node_timings = [timing for timing in timing_list if timing["nodes"] == node]
-        kpars = [t["kpar"] for t in node_timings]
-        timings = [t["timing"] for t in node_timings]
-
-        plt.plot(kpars, timings, "o")
+        node_table = table.select(nodes=node)
+        plt.plot(node_table.kpar, node_table.timing, "o")
 
     plt.xlabel("KPAR")
-    if np.max(kpars) > 100:
+    if np.max(table.kpar) > 100:
         plt.xscale("log")
     plt.yscale("log")
     plt.ylabel("Average time / electronic step (s)")
 
     plt.legend(node_list, bbox_to_anchor=(1, 1.025), loc="upper left", title="# nodes")
 
-def chessboard_plot(data, nodes, x_axis="NPAR", is_hybrid=False):
-    
-    timing_list = data["timing_list"]
-    
+@lru_cache(maxsize=256)
+def _glyph(character, size, style):
+    """
+    Outline of a character in points and its advance, i.e. the width that
+    "0<character>0" takes more than "00".
+    """
+    prop = FontProperties(size=size, style=style)
+    path = TextPath((0, 0), character, size=size, prop=prop)
+    with_character = TextPath((0, 0), "0" + character + "0", size=size, prop=prop)
+    without = TextPath((0, 0), "00", size=size, prop=prop)
+
+    return path, with_character.get_extents().width - without.get_extents().width
+
+@lru_cache(maxsize=4096)
+def _label_path(label, size, style):
+    """
+    Outline of a (multi-line) label in points, centered on the origin. The label is
+    put together from the cached outlines of its characters, without kerning.
+    """
+    lines = label.split("\n")
+    vertices, codes = [], []
+
+    for k, line in enumerate(lines):
+        glyphs = [_glyph(c, size, style) for c in line]
+        advances = np.cumsum([0] + [advance for _, advance in glyphs])
+        line_vertices = [path.vertices + [x, 0] for (path, _), x in zip(glyphs, advances)
+                         if len(path.vertices)]
+        if not line_vertices:
+            continue
+
+        line_vertices = np.concatenate(line_vertices)
+        shift = [-(line_vertices[:, 0].min() + line_vertices[:, 0].max()) / 2,
+                 1.2 * size * ((len(lines) - 1) / 2 - k) - 0.35 * size]
+        vertices.append(line_vertices + shift)
+        codes += [path.codes for path, _ in glyphs if len(path.vertices)]
+
+    if not vertices:
+        return Path(np.empty((0, 2)))
+    return Path(np.concatenate(vertices), np.concatenate(codes))
+
+def cell_labels(ax, rows, columns, labels, color="k", fontsize=None, style="normal",
+                batched=None):
+    """
+    Put the labels at the centers of the (rows, columns) cells of a heatmap. By
+    default, grids with more than BATCHED_LABELS labels are drawn as a single
+    PathCollection of the text outlines instead of one Text artist per cell, which
+    is much faster to create and draw.
+    """
+    if batched is None:
+        batched = len(labels) > BATCHED_LABELS
+
+    if not batched:
+        for i, j, label in zip(rows, columns, labels):
+            ax.text(j, i, label, ha="center", va="center", color=color,
+                    fontsize=fontsize, style=style)
+        return None
+
+    size = fontsize or plt.rcParams["font.size"]
+    collection = PathCollection(
+        [_label_path(str(label), size, style) for label in labels],
+        offsets=np.column_stack([columns, rows]), offset_transform=ax.transData,
+        transform=Affine2D().scale(1 / 72) + ax.figure.dpi_scale_trans,
+        facecolors=color, edgecolors="none"
+    )
+    ax.add_collection(collection, autolim=False)
+
+    return collection
+
+def _subplots(nrows=1, ncols=1, figsize=None, figure=None):
+    """
+    plt.subplots, or in case a figure is passed, the same layout in that figure
+    after clearing it, so a plot can be redrawn without creating a new figure.
+    """
+    if figure is None:
+        return plt.subplots(nrows, ncols, figsize=figsize)
+
+    figure.clear()
+    figure.set_size_inches(figsize)
+    return figure, figure.subplots(nrows, ncols)
+
+def _discard(fig, figure=None):
+    """
+    Close a figure of _subplots, or only clear it in case it is reused.
+    """
+    if figure is None:
+        plt.close(fig)
+    else:
+        fig.clear()
+
+def chessboard_plot(table, nodes, x_axis="NPAR", is_hybrid=False, model=None,
+                    predict=False, statistic="mean", show_ci=False, figure=None):
+
     plt.rcdefaults()
     plt.rc("font", size=14)
     x_axis = x_axis.lower()
     
-    node_timings = [t for t in timing_list if t["nodes"] == nodes]
-
-    node_kpar_list = list(set([t["kpar"] for t in node_timings]))
-    node_kpar_list.sort()
-    node_x_list = list(set([t[x_axis] for t in node_timings]))
-    node_x_list.sort()
-
-    timestep = np.zeros([len(node_kpar_list), len(node_x_list)])
+    node_table = robust_table(table.select(nodes=nodes), statistic)
 
-    for timing in node_timings:
-        timestep[node_kpar_list.index(timing["kpar"])][node_x_list.index(timing[x_axis])] = timing["timing"]
+    timestep, node_kpar_list, node_x_list = node_table.pivot(x=x_axis, y="kpar")
+    node_kpar_list = node_kpar_list.tolist()
+    node_x_list = node_x_list.tolist()
 
-    node_times = np.array([t["timing"] for t in node_timings])
+    node_times = node_table.timing
     
     norm = colors.Normalize(
         vmin=np.min(node_times),
         vmax=min(np.max(node_times), np.mean(node_times) * 2.0)
     )
-    
-    timestep[timestep == 0.0] = None
-
-    fig, ax = plt.subplots(figsize=(len(node_x_list), len(node_kpar_list)))
-    ax.imshow(timestep, cmap=cm.RdYlGn_r, origin="lower", norm=norm)
 
-    for i in range(len(node_kpar_list)):
-        for j in range(len(node_x_list)):
-            if not np.isnan(timestep[i, j]):
-                text = ax.text(j, i, round(timestep[i, j], 1),
-                               ha="center", va="center", color="k")
+    if predict and model is not None:
+        prediction = predict_grid(model, table, nodes, x=x_axis)[0]
+        prediction[~np.isnan(timestep)] = np.nan
+    else:
+        prediction = np.full(timestep.shape, np.nan)
+
+    fig, ax = _subplots(figsize=(len(node_x_list), len(node_kpar_list)), figure=figure)
+    ax.imshow(np.where(np.isnan(timestep), prediction, timestep), 
+              cmap=cm.RdYlGn_r, origin="lower", norm=norm)
+
+    if show_ci:
+        lower, upper = bootstrap_ci(node_table, statistic)
+        lower_grid = node_table.pivot(x=x_axis, y="kpar", value=lower)[0]
+        upper_grid = node_table.pivot(x=x_axis, y="kpar", value=upper)[0]
+        tied = node_table.pivot(
+            x=x_axis, y="kpar", value=indistinguishable(node_table, lower, upper)
+        )[0]
+
+        for i, j in zip(*np.nonzero(tied == 1)):
+            ax.add_patch(Rectangle(xy=(j - 0.45, i - 0.45), width=0.9, height=0.9,
+                                   linewidth=2, linestyle="--", edgecolor="k",
+                                   facecolor="none"))
+
+    rows, columns = np.nonzero(~np.isnan(timestep))
+    labels = [str(round(t, 1)) for t in timestep[rows, columns]]
+    if show_ci:
+        half_widths = (upper_grid - lower_grid)[rows, columns] / 2
+        labels = [l + "\n\u00b1" + str(round(w, 1)) for l, w in zip(labels, half_widths)]
+        cell_labels(ax, rows, columns, labels, fontsize=10)
+    else:
+        cell_labels(ax, rows, columns, labels)
+
+    rows, columns = np.nonzero(~np.isnan(prediction))
+    cell_labels(ax, rows, columns,
+                ["~" + str(round(p, 1)) for p in prediction[rows, columns]],
+                color="dimgrey", style="italic")
 
     ax.set_xticks(range(len(node_x_list)))
     ax.set_xticklabels([str(n) for n in node_x_list])
@@ -235,15 +412,12 @@ def chessboard_plot(data, nodes, x_axis="NPAR", is_hybrid=False):
     ax.set_yticklabels([str(k) for k in node_kpar_list])
     ax.set_ylabel("KPAR")
     
-    opt_band_parallel = OPT_BAND_PARALLEL_HSE if is_hybrid else OPT_BAND_PARALLEL_PBE
-    n_cores = node_timings[0]["kpar"] * node_timings[0]["npar"] * node_timings[0]["ncore"]
+    n_cores = int(node_table.cores[0])
     cores_per_node = n_cores // nodes
     
-    kpar, ncore = VaspParallelizationTask._optimize_parallelization(
-        nkpts=data["n_kpoints"], nbands=data["nbands"], number_of_cores=n_cores, 
-        cores_per_node=cores_per_node, opt_band_parallel=opt_band_parallel,
-        is_hybrid=is_hybrid
-    )
+    kpar, ncore = [int(v) for v in recommendation_table(
+        table.n_kpoints, table.nbands, n_cores, cores_per_node, is_hybrid
+    )]
     optimal_x = ncore if x_axis == "ncore" else n_cores // kpar // ncore
     
     try:
@@ -259,12 +433,25 @@ def chessboard_plot(data, nodes, x_axis="NPAR", is_hybrid=False):
               + " ; " + x_axis.upper() + " = " + str(optimal_x) 
               + ") not in test.")
 
-    plt.title(str(nodes) + " NODES")
+    if predict and model is not None:
+        print("Values in grey italics are predicted by the PerformanceModel.")
+    if show_ci:
+        print_ci_note(table, statistic)
+
+    ax.set_title(str(nodes) + " NODES")
     
-def tetris_plot(data, nodes_choices, kpar_choices, 
-                ncore_choices, is_hybrid):
+def print_ci_note(table, statistic):
     
-    timing_list = data["timing_list"]
+    if table.has_steps:
+        print("Uncertainties are the half widths of the 95% bootstrap confidence intervals "
+              + "of the " + statistic + ". Dashed squares cannot be told apart from the "
+              + "fastest setting.")
+    else:
+        print("The data file has no timings of the individual electronic steps, "
+              + "so no confidence intervals can be determined.")
+
+def tetris_plot(table, nodes_choices, kpar_choices, 
+                ncore_choices, is_hybrid, statistic="mean", show_ci=False, figure=None):
     
     fontsize = 18
     plt.rcParams["axes.linewidth"] = 2
@@ -273,47 +460,66 @@ def tetris_plot(data, nodes_choices, kpar_choices,
     plt.rc('xtick', labelsize=fontsize)
     plt.rc('ytick', labelsize=fontsize)
 
-    fig, ax = plt.subplots(1, len(nodes_choices), 
-                           figsize=(len(nodes_choices) * len(ncore_choices), len(kpar_choices)))
-    plt.subplots_adjust(wspace=0, bottom=0.0)
+    fig, ax = _subplots(1, len(nodes_choices), figure=figure,
+                        figsize=(len(nodes_choices) * len(ncore_choices), len(kpar_choices)))
+    fig.subplots_adjust(wspace=0, bottom=0.0)
     
     print("The red square indicates the optimal setting determined by VaspParallelizationTask.")
+    if show_ci:
+        print_ci_note(table, statistic)
+
+    node_tables = [
+        robust_table(table.select(nodes=n, kpar=kpar_choices, ncore=ncore_choices),
+                     statistic) for n in nodes_choices
+    ]
+    timesteps = np.array([
+        n_table.pivot(x="ncore", y="kpar", x_values=ncore_choices,
+                      y_values=kpar_choices)[0] for n_table in node_tables
+    ]).reshape(len(nodes_choices), len(kpar_choices), len(ncore_choices))
+
+    # The color scale of each panel, computed for all panels at once
+    empty = np.all(np.isnan(timesteps), axis=(1, 2))
+    if empty.any():
+        print()
+        print("Chosen combination of Nodes/KPAR/NCORE results in empty plot for " 
+              + str(nodes_choices[int(np.argmax(empty))]) + " nodes.")
+        _discard(fig, figure)
+        return None
+
+    vmin = np.nanmin(timesteps, axis=(1, 2))
+    vmax = np.minimum(np.nanmax(timesteps, axis=(1, 2)),
+                      np.nanmean(timesteps, axis=(1, 2)) * 2.0)
+
+    cores = np.array([n_table.cores[0] for n_table in node_tables])
+    kpars, ncores = recommendation_table(table.n_kpoints, table.nbands, cores,
+                                         cores // np.asarray(nodes_choices), is_hybrid)
+
+    for i, (n, n_table, timestep) in enumerate(zip(nodes_choices, node_tables, timesteps)):
+
+        norm = colors.Normalize(vmin=vmin[i], vmax=vmax[i])
 
-    for i, n in enumerate(nodes_choices):
-
-        n_timings = [t for t in timing_list if t["nodes"] == n 
-                     and t["kpar"] in kpar_choices and t["ncore"] in ncore_choices]
-
-        timestep = np.zeros([len(kpar_choices), len(ncore_choices)])
-
-        for t in n_timings:
-            timestep[kpar_choices.index(t["kpar"])][ncore_choices.index(t["ncore"])] = t["timing"]
-        
-        try:
-            norm = colors.Normalize(vmin=np.min([t["timing"] for t in n_timings]),
-                                    vmax=min(np.max([t["timing"] for t in n_timings]),
-                                             np.mean([t["timing"] for t in n_timings]) * 2.0))
-        except ValueError:
-            print()
-            print("Chosen combination of Nodes/KPAR/NCORE results in empty plot for " + str(n) + " nodes.")
-            plt.close()
-            return None
-
-        timestep[timestep == 0.0] = np.nan
         try:
             im = ax[i].imshow(timestep, cmap=cm.RdYlGn_r, origin="lower", norm=norm)
         except TypeError:
             print()
             print("Please select at least 2 node choices. For analyzing the optimal " +
                   "parallelization for a single # of nodes, use the chessboard plot.")
-            plt.close()
+            _discard(fig, figure)
             return None
 
-        for x in range(len(kpar_choices)):
-            for y in range(len(ncore_choices)):
-                if not np.isnan(timestep[x, y]):
-                    t = ax[i].text(y, x, round(timestep[x, y], 1),
-                               ha="center", va="center", color="k")
+        rows, columns = np.nonzero(~np.isnan(timestep))
+        cell_labels(ax[i], rows, columns,
+                    [str(round(t, 1)) for t in timestep[rows, columns]])
+
+        if show_ci:
+            tied = n_table.pivot(
+                x="ncore", y="kpar", x_values=ncore_choices, y_values=kpar_choices,
+                value=indistinguishable(n_table, *bootstrap_ci(n_table, statistic))
+            )[0]
+            for x, y in zip(*np.nonzero(tied == 1)):
+                ax[i].add_patch(Rectangle(xy=(y - 0.45, x - 0.45), width=0.9, height=0.9,
+                                          linewidth=2, linestyle="--", edgecolor="k",
+                                          facecolor="none"))
 
         ax[i].set_title(str(n) + " NODES", fontsize=20)
         ax[i].set_xticks(range(len(ncore_choices)))
@@ -323,15 +529,7 @@ def tetris_plot(data, nodes_choices, kpar_choices,
             #ax[i].tick_params(left="off", right="off")
             ax[i].yaxis.set_major_locator(plt.NullLocator())
         
-        opt_band_parallel = OPT_BAND_PARALLEL_HSE if is_hybrid else OPT_BAND_PARALLEL_PBE
-        n_cores = n_timings[0]["kpar"] * n_timings[0]["npar"] * n_timings[0]["ncore"]
-        cores_per_node = n_cores // n
-        
-        kpar, ncore = VaspParallelizationTask._optimize_parallelization(
-            nkpts=data["n_kpoints"], nbands=data["nbands"], number_of_cores=n_cores, 
-            cores_per_node=cores_per_node, opt_band_parallel=opt_band_parallel,
-            is_hybrid=is_hybrid
-        )
+        kpar, ncore = int(kpars[i]), int(ncores[i])
 
         if kpar in kpar_choices and ncore in ncore_choices:
             ax[i].add_patch(Rectangle(
@@ -345,87 +543,220 @@ def tetris_plot(data, nodes_choices, kpar_choices,
     ax[0].set_yticklabels([str(k) for k in kpar_choices])
     ax[0].set_ylabel("KPAR")
     
-def optimal_settings(timing_list):
+def optimal_settings(table, statistic="mean", show_ci=False, is_hybrid=False):
     
-    nodes_list = list(set(
-        [t["nodes"] for t in timing_list]
-    ))
-    nodes_list.sort()
-    
-    best_setting_list = []
-
-    for nodes in nodes_list:
-
-        best_time = 1e10
+    table = robust_table(table, statistic)
+    best_settings = table.best("nodes")
 
-        for t in [timing for timing in timing_list if timing["nodes"] == nodes]:
-            if t["timing"] < best_time:
-                best_setting = t
-                best_time = t["timing"]
-        best_setting_list.append(best_setting)
+    print("Rank of the recommended setting among the tested settings:")
+    for n, k, c, rank, n_settings in zip(*recommendation_ranks(table, is_hybrid)):
+        print("%3i nodes: KPAR = %i, NCORE = %i, " % (n, k, c) + (
+            "%i of %i" % (rank, n_settings) if rank else "not tested"))
+    print()
         
-    speedup = []
-    efficiency = []
-
-    for d in best_setting_list:
-        speedup.append(
-            best_setting_list[0]["timing"] / d["timing"]
-        )
-        efficiency.append(
-            best_setting_list[0]["timing"] / d["timing"] / d["nodes"]
-        )
+    speedup = best_settings.timing[0] / best_settings.timing
+    efficiency = best_settings.timing[0] / best_settings.timing / best_settings.nodes
     
     fig, ax1 = plt.subplots()
     ax2 = ax1.twinx() 
 
+    if show_ci:
+        lower, upper = bootstrap_ci(best_settings, statistic)
+        ax1.fill_between(best_settings.nodes, lower, upper, color="b", alpha=0.2)
+        print_ci_note(table, statistic)
+
+        lower, upper = bootstrap_ci(table, statistic)
+        tied = table.take(indistinguishable(table, lower, upper))
+        for n in best_settings.nodes:
+            n_tied = tied.select(nodes=n)
+            print(str(n) + " nodes: " + ", ".join(
+                "KPAR = " + str(k) + " NCORE = " + str(c) + " (" + str(round(t, 1)) + ")"
+                for k, c, t in zip(n_tied.kpar, n_tied.ncore, n_tied.timing)
+            ))
+
     ax1.plot(
-        [t["nodes"] for t in best_setting_list],
-        [t["timing"] for t in best_setting_list],
+        best_settings.nodes,
+        best_settings.timing,
         "o-", color="b"
     )
     ax2.plot(
-        [t["nodes"] for t in best_setting_list],
+        best_settings.nodes,
         efficiency,
         "o-", color="r"
     )
     ax2.plot(
-        [t["nodes"] for t in best_setting_list],
-        [1]*len(best_setting_list),
+        best_settings.nodes,
+        [1]*len(best_settings),
         "-", color="k"
     )
     ax1.set_xlabel("# nodes")
     ax1.set_ylabel("Average time / electronic step", color="b")
-    reference = str(best_setting_list[0]["nodes"]) + " node"
-    if best_setting_list[0]["nodes"] > 1:
+    reference = str(best_settings.nodes[0]) + " node"
+    if best_settings.nodes[0] > 1:
         reference += "s"
     ax2.set_ylabel("Efficiency vs " + reference , color="r")
     
+def cost_plot(table, efficiency=0.75, n_steps=1000, budget=0, deadline=0):
+    
+    plt.rcdefaults()
+    plt.rc("font", size=12)
+    
+    frontier = pareto_frontier(table)
+    cost = node_seconds(table)
+    nodes, timing, speedup, parallel_efficiency = scaling_data(table)
+    
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(13, 5))
+    
+    points = ax1.scatter(table.timing, cost, c=table.nodes, 
+                         cmap=cm.viridis, s=20, alpha=0.6)
+    order = np.argsort(table.timing[frontier])
+    ax1.plot(table.timing[frontier][order], cost[frontier][order], "o-", color="r",
+             label="Pareto frontier")
+    ax1.set_xscale("log")
+    ax1.set_yscale("log")
+    ax1.set_xlabel("Time / electronic step (s)")
+    ax1.set_ylabel("Node-seconds / electronic step")
+    ax1.legend()
+    fig.colorbar(points, ax=ax1, label="# nodes")
+    
+    print("Pareto frontier of wall time against node-hours (" + str(n_steps) 
+          + " electronic steps):")
+    for i in np.flatnonzero(frontier)[np.argsort(table.timing[frontier])]:
+        print("  %3i nodes, KPAR = %3i, NCORE = %3i: %8.2f h, %9.1f node-hours" % (
+            table.nodes[i], table.kpar[i], table.ncore[i], 
+            table.timing[i] * n_steps / 3600, cost[i] * n_steps / 3600
+        ))
+    
+    ax2.plot(nodes, speedup, "o", color="k", label="Measured")
+    ax2.plot(nodes, nodes / nodes[0], "--", color="grey", label="Ideal")
+    
+    efficient = max_efficient_nodes(table, efficiency)
+    print()
+    if efficient is None:
+        print("No number of nodes reaches a parallel efficiency of " 
+              + str(round(efficiency * 100)) + "%.")
+    else:
+        print("Largest number of nodes with a parallel efficiency of at least " 
+              + str(round(efficiency * 100)) + "%: " + str(efficient))
+    
+    if len(nodes) < 2:
+        print("At least two numbers of nodes are needed to fit the scaling.")
+        ax2.set_xlabel("# nodes")
+        ax2.set_ylabel("Speedup vs " + str(int(nodes[0])) + " nodes")
+        return
+    
+    fit_nodes = np.linspace(nodes[0], 2 * nodes[-1], 100)
+    fits = [AmdahlFit(nodes, timing), GustafsonFit(nodes, timing)]
+    
+    for fit, color in zip(fits, ("b", "r")):
+        ax2.plot(fit_nodes, fit.speedup(fit_nodes), "-", color=color, 
+                 label=fit.name + " (s = %.3f)" % fit.serial_fraction)
+    
+    ax2.set_xlabel("# nodes")
+    ax2.set_ylabel("Speedup vs " + str(int(nodes[0])) + " nodes")
+    ax2.legend()
+    
+    if budget or deadline:
+        print()
+        print("Recommended number of nodes for a budget of " + str(budget or "any") 
+              + " node-hours and a deadline of " + str(deadline or "any") + " hours:")
+        for fit in fits:
+            recommendation = recommend_nodes(fit, n_steps, budget=budget, deadline=deadline)
+            if recommendation is None:
+                print(fit.name + ": no number of nodes fits the budget and deadline.")
+            else:
+                print(fit.name + ": %i nodes, %.2f h, %.1f node-hours" % recommendation)
+    
+
+def profile_plot(profiler=PROFILER, max_timers=8):
+    """
+    Total time of the timers of the profiler, and the histograms of the times of
+    the max_timers timers with the largest total.
+    """
+    summary = profiler.summary()
+    timers = list(summary["timers"].items())
 
-def npar_line_plot(timing_list, nodes):
+    plt.rcdefaults()
+    plt.rc("font", size=12)
+
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(13, max(3, 0.3 * len(timers) + 1)))
+
+    ax1.barh(np.arange(len(timers)), [t["total"] for _, t in timers], color="C0")
+    ax1.set_yticks(np.arange(len(timers)))
+    ax1.set_yticklabels([name for name, _ in timers])
+    ax1.invert_yaxis()
+    ax1.set_xlabel("Total time (s)")
+
+    edges = np.array(summary["bin_edges"])
+    for name, t in timers[:max_timers]:
+        ax2.step(edges, t["histogram"] + [0], where="post", label=name)
+    ax2.set_xscale("log")
+    ax2.set_xlabel("Time per call (s)")
+    ax2.set_ylabel("# calls")
+    ax2.legend(fontsize=8)
+
+
+def profile_interface(profiler=PROFILER):
+    """
+    Widget that shows the timers and counters of the profiler, with controls to
+    enable or reset it and to export the profile to a json file.
+    """
+    enabled = Checkbox(value=profiler.enabled, description="Enabled")
+    refresh = Button(description="Refresh")
+    reset = Button(description="Reset")
+    export = Button(description="Export")
+    filename = Text(value=PROFILE_FILE, layout=Layout(width="200px"))
+    out = Output()
+
+    def show(b=None):
+        with out:
+            clear_output(wait=True)
+            if not profiler.timers and not profiler.counters:
+                print("Nothing has been profiled." if profiler.enabled else
+                      "Profiling is disabled.")
+                return
+            print(profiler.table())
+            if profiler.timers:
+                show_render(render_figures(profile_plot, {"profiler": profiler}))
+
+    def toggle(change):
+        profiler.enabled = change["new"]
+        show()
+
+    def clear(b):
+        profiler.reset()
+        show()
+
+    def write(b):
+        with out:
+            print("Exported the profile to " + profiler.to_json(filename.value))
+
+    enabled.observe(toggle, "value")
+    refresh.on_click(show)
+    reset.on_click(clear)
+    export.on_click(write)
+    show()
+
+    return VBox((HBox((enabled, refresh, reset, export, filename)), out))
+
+
+def npar_line_plot(table, nodes):
     
     import matplotlib.pyplot as plt
     
-    nodes_timings = [timing for timing in timing_list if timing["nodes"] == nodes]
-    nodes_timings = sorted(nodes_timings, key=lambda x: x["kpar"])
-
-    npars = set()
-    for n in [t["npar"] for t in nodes_timings]:
-        npars.add(n)
-    npars = list(npars)
-    npars.sort()
-    npars = npars[:9]
+    nodes_table = table.select(nodes=nodes)
+    npars = nodes_table.unique("npar")[:9]
 
     cmap = cm.plasma._resample(len(npars))
 
-    for n in npars:
-        kpars = [t["kpar"] for t in nodes_timings if t["npar"] == n]
-        timings = [t["timing"] for t in nodes_timings if t["npar"] == n]
+    for i, n in enumerate(npars):
+        npar_table = nodes_table.select(npar=n)
+        order = np.argsort(npar_table.kpar, kind="stable")
 
-
-        plt.plot(kpars, timings, "o-", color=cmap.colors[npars.index(n)])
+        plt.plot(npar_table.kpar[order], npar_table.timing[order], "o-", color=cmap.colors[i])
 
     # Set axis scales
-    if np.max([t["kpar"] for t in nodes_timings]) > 100:
+    if np.max(nodes_table.kpar) > 100:
         plt.xscale("log")
     plt.xlabel("KPAR")
     plt.yscale("log")
@@ -433,34 +764,25 @@ def npar_line_plot(timing_list, nodes):
     plt.legend(npars, bbox_to_anchor=(1, 1.025), loc="upper left", title="NPAR")
     
 
-def ncore_line_plot(timing_list, nodes):
+def ncore_line_plot(table, nodes):
     
     import matplotlib.pyplot as plt
     
-    nodes_timings = [timing for timing in timing_list if timing["nodes"] == nodes]
-    nodes_timings = sorted(nodes_timings, key=lambda x: x["kpar"])
-
-    npars = set()
-    for n in [t["ncore"] for t in nodes_timings]:
-        npars.add(n)
-    npars = list(npars)
-    npars.sort()
-    npars = npars[:9]
+    nodes_table = table.select(nodes=nodes)
+    ncores = nodes_table.unique("ncore")[:9]
 
-    cmap = cm.plasma._resample(len(npars))
+    cmap = cm.plasma._resample(len(ncores))
 
-    for n in npars:
-        kpars = [t["kpar"] for t in nodes_timings if t["ncore"] == n]
-        timings = [t["timing"] for t in nodes_timings if t["ncore"] == n]
+    for i, n in enumerate(ncores):
+        ncore_table = nodes_table.select(ncore=n)
+        order = np.argsort(ncore_table.kpar, kind="stable")
 
-
-        plt.plot(kpars, timings, "o-", color=cmap.colors[npars.index(n)])
+        plt.plot(ncore_table.kpar[order], ncore_table.timing[order], "o-", color=cmap.colors[i])
 
     # Set axis scales
-    if np.max([t["kpar"] for t in nodes_timings]) > 100:
+    if np.max(nodes_table.kpar) > 100:
         plt.xscale("log")
     plt.xlabel("KPAR")
     plt.yscale("log")
     plt.ylabel("Average time / electronic step")
-    plt.legend(npars, bbox_to_anchor=(1, 1.025), loc="upper left", title="NCORE")
-
+    plt.legend(ncores, bbox_to_anchor=(1, 1.025), loc="upper left", title="NCORE")
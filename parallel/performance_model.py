@@ -0,0 +1,163 @@
+import numpy as np
+
+from data_index import IndexedTable
+
+HYBRID_FUNCTIONALS = ("hse06", "hse03", "hse", "pbe0", "b3lyp", "hf")
+
+FEATURES = (
+    "log cores", "log KPAR", "log NCORE", "log NCORE^2",
+    "log k-points per KPAR group", "log bands per NPAR group", "log k-point imbalance",
+    "log NBANDS", "log NKPTS", "hybrid", "hybrid x log NBANDS"
+)
+
+
+def is_hybrid(functional):
+    return np.isin(np.char.lower(np.asarray(functional, dtype=str)), HYBRID_FUNCTIONALS)
+
+
+def design_matrix(cores, kpar, ncore, nbands, n_kpoints, hybrid):
+    """
+    Feature matrix for arrays (or scalars) of settings and system properties, with
+    one row per setting and the FEATURES as columns. The features describe the
+    work per group of cores, e.g. the number of k-points each KPAR group has to
+    treat and the number of bands per NPAR group, as well as the idle fraction due
+    to KPAR not dividing the number of k-points.
+    """
+    cores, kpar, ncore, nbands, n_kpoints, hybrid = np.broadcast_arrays(
+        *[np.asarray(a, dtype=float) for a in (cores, kpar, ncore, nbands, n_kpoints, hybrid)]
+    )
+    npar = cores / kpar / ncore
+    kpoints_per_group = np.ceil(n_kpoints / kpar)
+    bands_per_group = np.ceil(nbands / npar)
+    log_ncore = np.log(ncore)
+
+    return np.column_stack([
+        np.log(cores), np.log(kpar), log_ncore, log_ncore ** 2,
+        np.log(kpoints_per_group), np.log(bands_per_group),
+        np.log(kpoints_per_group * kpar / n_kpoints),
+        np.log(nbands), np.log(n_kpoints), hybrid, hybrid * np.log(nbands)
+    ])
+
+
+def table_features(table, functional=None):
+    """
+    Feature matrix of the records of a TimingTable. For an IndexedTable, NBANDS,
+    NKPTS and the functional are taken from the metadata of each record, else from
+    the table and the functional argument.
+    """
+    if isinstance(table, IndexedTable):
+        nbands, n_kpoints = table.column("nbands"), table.column("n_kpoints")
+        hybrid = is_hybrid(table.column("functional"))
+    else:
+        nbands, n_kpoints = table.nbands, table.n_kpoints
+        hybrid = is_hybrid(functional or "pbe")
+
+    return design_matrix(table.cores, table.kpar, table.ncore, nbands, n_kpoints, hybrid)
+
+
+class PerformanceModel:
+    """
+    Linear least-squares model of the logarithm of the time per electronic step as
+    a function of the FEATURES. The features are standardized on the training
+    data, and those that are constant there (e.g. NBANDS when training on a single
+    system) are left out. A small ridge term keeps the fit stable for strongly
+    correlated features.
+
+    The uncertainty of a prediction combines the residual variance of the fit with
+    the uncertainty of the coefficients, and is expressed as the standard deviation
+    of the log of the time per electronic step.
+    """
+
+    def __init__(self, ridge=1e-3):
+        self.ridge = ridge
+        self.coefficients = None
+
+    def _standardize(self, features):
+        z = (features[:, self._keep] - self._mean) / self._scale
+        return np.column_stack([np.ones(len(features)), z])
+
+    def fit(self, table, functional=None):
+        """
+        Fit the model to the records of a TimingTable, see table_features.
+        """
+        features = table_features(table, functional)
+        target = np.log(table.timing)
+
+        scale = features.std(axis=0)
+        self._keep = scale > 1e-12
+        self._mean = features[:, self._keep].mean(axis=0)
+        self._scale = scale[self._keep]
+
+        x = self._standardize(features)
+        regularization = self.ridge * np.eye(x.shape[1])
+        regularization[0, 0] = 0
+
+        inverse = np.linalg.inv(x.T @ x + regularization)
+        self.coefficients = inverse @ x.T @ target
+
+        residuals = target - x @ self.coefficients
+        dof = max(len(target) - x.shape[1], 1)
+        self.residual_variance = residuals @ residuals / dof
+        self.covariance = self.residual_variance * inverse
+
+        return self
+
+    def predict_features(self, features):
+        """
+        Predicted time per electronic step (in seconds) and the standard deviation
+        of its logarithm, for each row of a feature matrix.
+        """
+        if self.coefficients is None:
+            raise ValueError("The model has not been fitted yet.")
+
+        x = self._standardize(features)
+        log_time = x @ self.coefficients
+        variance = self.residual_variance + np.einsum("ij,jk,ik->i", x, self.covariance, x)
+
+        return np.exp(log_time), np.sqrt(variance)
+
+    def predict(self, cores, kpar, ncore, nbands, n_kpoints, functional="pbe"):
+        """
+        Predicted time per electronic step and log standard deviation for arrays of
+        settings, see design_matrix.
+        """
+        return self.predict_features(
+            design_matrix(cores, kpar, ncore, nbands, n_kpoints, is_hybrid(functional))
+        )
+
+    def interval(self, cores, kpar, ncore, nbands, n_kpoints, functional="pbe", z=1.96):
+        """
+        Lower and upper bound of the confidence interval of the predicted time per
+        electronic step, by default the 95% interval.
+        """
+        time, std = self.predict(cores, kpar, ncore, nbands, n_kpoints, functional)
+        return time * np.exp(-z * std), time * np.exp(z * std)
+
+
+def predict_grid(model, table, nodes, x="ncore", functional=None):
+    """
+    Predicted timings on the KPAR x NCORE (or NPAR) grid of a chessboard plot for
+    nodes, i.e. for all combinations of the KPAR and x values that were tested for
+    that number of nodes. Combinations that do not divide the number of cores are
+    NaN. Returns the grid of predictions, the grid of log standard deviations, the
+    KPAR values and the x values.
+    """
+    if isinstance(table, IndexedTable):
+        raise TypeError("predict_grid requires the table of a single dataset.")
+
+    node_table = table.select(nodes=nodes)
+    cores = int(node_table.cores[0])
+    kpar_values, x_values = np.unique(node_table.kpar), np.unique(node_table.column(x))
+
+    kpar, other = np.meshgrid(kpar_values, x_values, indexing="ij")
+    valid = cores % (kpar * other) == 0
+    ncore = other if x == "ncore" else cores // (kpar * other)
+
+    prediction = np.full(kpar.shape, np.nan)
+    std = np.full(kpar.shape, np.nan)
+
+    time, log_std = model.predict(cores, kpar[valid], ncore[valid], table.nbands,
+                                  table.n_kpoints, functional or "pbe")
+    prediction[valid], std[valid] = time, log_std
+
+    return prediction, std, kpar_values, x_values
@@ -0,0 +1,265 @@
+import os, json
+
+from concurrent.futures import ProcessPoolExecutor
+from monty.json import MontyEncoder
+from pymatgen import Structure
+
+from outcar import parse_outcar, read_nelmdl, timing_record
+from run_cache import CACHE_FILE, RunCache, outcar_fingerprint
+
+
+def _subdirs(directory, suffix=""):
+    """
+    Names of the subdirectories of directory that end with suffix.
+    """
+    with os.scandir(directory) as entries:
+        return [e.name for e in entries if e.is_dir() and e.name.endswith(suffix)]
+
+
+def find_runs(data_dir):
+    """
+    Find the calculations in a parallelization test directory, i.e. the
+    <N>nodes/<K>kpar/<P>npar directories. Returns a sorted list of
+    (nodes, kpar, npar, run_dir) tuples.
+    """
+    runs = []
+
+    for nodes_dir in _subdirs(data_dir, "nodes"):
+        nodes = int(nodes_dir.strip("nodes"))
+
+        for kpar_dir in _subdirs(os.path.join(data_dir, nodes_dir), "kpar"):
+            kpar = int(kpar_dir.strip("kpar"))
+
+            for npar_dir in _subdirs(os.path.join(data_dir, nodes_dir, kpar_dir), "npar"):
+                npar = int(npar_dir.strip("npar"))
+                runs.append(
+                    (nodes, kpar, npar, os.path.join(data_dir, nodes_dir, kpar_dir, npar_dir))
+                )
+
+    return sorted(runs)
+
+
+def find_test_dirs(root_dir, clusters=None):
+    """
+    Find the parallelization test directories in the <cluster>/<setting>/<system>
+    layout below root_dir, optionally only for the clusters in the list clusters.
+    Returns a sorted list of (cluster, setting, data_dir) tuples.
+    """
+    test_dirs = []
+
+    for cluster in _subdirs(root_dir):
+        if clusters is not None and cluster not in clusters:
+            continue
+        for setting in _subdirs(os.path.join(root_dir, cluster)):
+            for system in _subdirs(os.path.join(root_dir, cluster, setting)):
+                test_dirs.append(
+                    (cluster, setting, os.path.join(root_dir, cluster, setting, system))
+                )
+
+    return sorted(test_dirs)
+
+
+def parse_run(run):
+    """
+    Parse the INCAR and OUTCAR of a single calculation. Returns a dictionary with
+    the run tuple, the OUTCAR header fields, the number of electronic steps and the
+    timing_list entry (None in case there are not enough electronic steps), as well
+    as the fingerprint of the OUTCAR and INCAR used by the RunCache. In case the
+    OUTCAR is missing, the "outcar" value is None.
+    """
+    nodes, kpar, npar, run_dir = run
+    result = {"run": run, "outcar": None, "n_steps": 0, "timing": None,
+              "fingerprint": outcar_fingerprint(run_dir)}
+
+    nelmdl = read_nelmdl(os.path.join(run_dir, "INCAR"))
+
+    try:
+        outcar_data = parse_outcar(os.path.join(run_dir, "OUTCAR"))
+    except FileNotFoundError:
+        return result
+
+    result["timing"] = timing_record(outcar_data, nodes, kpar, npar, nelmdl)
+    result["n_steps"] = len(outcar_data.pop("loop_timings"))
+    result["outcar"] = outcar_data
+
+    return result
+
+
+def parse_runs(runs, workers=None, cache=None):
+    """
+    Parse a list of runs concurrently over a pool of workers processes. By
+    default, the number of workers is the number of CPUs. Setting workers to 1
+    parses the runs serially in the current process.
+
+    If a RunCache is provided, only the runs that are not in the cache or whose
+    OUTCAR has changed are parsed, and the cache is updated with their results.
+    """
+    if cache is None:
+        cached, stale = {}, runs
+    else:
+        cached, stale = cache.split(runs)
+
+    if workers == 1 or len(stale) < 2:
+        parsed = [parse_run(run) for run in stale]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(parse_run, stale, chunksize=8))
+
+    if cache is not None and parsed:
+        for result in parsed:
+            cache.put(result)
+        cache.save()
+
+    cached.update({result["run"]: result for result in parsed})
+
+    return [cached[run] for run in runs]
+
+
+def collect_data(results, verbose=False):
+    """
+    Merge the parsed runs of one parallelization test into the data dictionary
+    that is written to the data files, with the "structure", "nbands", "n_kpoints"
+    and "timing_list" keys. The structure is read from the POSCAR of the first
+    calculation that has an OUTCAR.
+    """
+    timing_list = []
+
+    n_kpoints = 0
+    nbands = 0
+    structure = None
+
+    for result in results:
+
+        nodes, kpar, npar, run_dir = result["run"]
+
+        if result["outcar"] is None:
+            print("No OUTCAR file found for : " + str(nodes) + "nodes"
+                  + " " + str(kpar) + "kpar" + " " + str(npar) + "npar")
+            continue
+
+        if n_kpoints == 0:
+            n_kpoints = result["outcar"]["n_kpoints"]
+            nbands = result["outcar"]["nbands"]
+            structure = Structure.from_file(os.path.join(run_dir, "POSCAR"))
+
+        if result["timing"] is not None:
+            timing_list.append(result["timing"])
+        elif verbose:
+            print(str(nodes) + " " + str(npar) + " "
+                  + str(kpar) + " only has "
+                  + str(result["n_steps"]) + " timesteps.")
+
+    return {
+        "structure": structure.as_dict(),
+        "nbands": nbands,
+        "n_kpoints": n_kpoints,
+        "timing_list": timing_list
+    }
+
+
+def default_output_file(data_dir, data, output_dir="data"):
+    """
+    File name used for the data of a test directory in the
+    .../<cluster>/<setting>/<system> layout, e.g.
+    leibniz_pbe_Normal_U12O32_B420_K60.json.
+    """
+    cluster, setting = os.path.normpath(data_dir).split(os.sep)[-3:-1]
+    structure = Structure.from_dict(data["structure"])
+
+    output_file = cluster
+    output_file += "_" + setting
+    output_file += "_" + str(structure.composition).replace(" ", "")
+    output_file += "_B" + str(data["nbands"])
+    output_file += "_K" + str(data["n_kpoints"])
+    output_file += ".json"
+
+    return os.path.join(output_dir, output_file)
+
+
+def write_data(data, output_file):
+
+    with open(output_file, "w") as file:
+        file.write(json.dumps(data, cls=MontyEncoder))
+
+
+def process_parallel(data_dir, output_file=None, verbose=False, workers=None,
+                     use_cache=True):
+    """
+    Parse all the calculations of a parallelization test directory and write the
+    resulting data to output_file. Unless use_cache is False, the parsed
+    calculations are cached in data_dir, so rerunning only parses the new or
+    changed OUTCAR's.
+    """
+    cache = RunCache(os.path.join(data_dir, CACHE_FILE)) if use_cache else None
+
+    data = collect_data(parse_runs(find_runs(data_dir), workers=workers, cache=cache),
+                        verbose=verbose)
+
+    if output_file is None:
+        output_file = default_output_file(data_dir, data)
+
+    write_data(data, output_file)
+
+    return data
+
+
+def process_tree(root_dir, clusters=None, output_dir="data", verbose=False,
+                 workers=None, use_cache=True):
+    """
+    Process all parallelization test directories in the
+    <cluster>/<setting>/<system> layout below root_dir. The calculations of all
+    tests are parsed in a single pool of workers, after which each test is written
+    to its own file in output_dir. Unless use_cache is False, the parsed
+    calculations are cached in root_dir. Returns a dictionary that maps each test
+    directory to its data.
+    """
+    cache = RunCache(os.path.join(root_dir, CACHE_FILE)) if use_cache else None
+
+    test_runs = {data_dir: find_runs(data_dir)
+                 for _, _, data_dir in find_test_dirs(root_dir, clusters)}
+
+    results = parse_runs([r for runs in test_runs.values() for r in runs],
+                         workers=workers, cache=cache)
+
+    processed = {}
+    start = 0
+
+    for data_dir, runs in test_runs.items():
+        if not runs:
+            continue
+        data = collect_data(results[start:start + len(runs)], verbose=verbose)
+        start += len(runs)
+
+        output_file = default_output_file(data_dir, data, output_dir)
+        write_data(data, output_file)
+        processed[data_dir] = data
+
+    return processed
+
+
+def check_timing(data_dir, timing, cache=None):
+    """
+    Sanity check of an entry of the timing_list of the test in data_dir. Returns
+    whether the average timing and the total number of cores agree with the
+    calculation. In case a RunCache is provided and the OUTCAR has not changed,
+    the cached result is used instead of parsing the OUTCAR again.
+    """
+    run = (timing["nodes"], timing["kpar"], timing["npar"], os.path.join(
+        data_dir, str(timing["nodes"]) + "nodes",
+        str(timing["kpar"]) + "kpar",
+        str(timing["npar"]) + "npar"
+    ))
+
+    result = cache.get(run) if cache is not None else None
+    if result is None:
+        result = parse_run(run)
+
+    if result["outcar"] is None:
+        raise FileNotFoundError("No OUTCAR file found in " + run[3])
+
+    time_check = result["timing"] is not None \
+        and abs(result["timing"]["timing"] - timing["timing"]) < 1e-4
+    cores_check = result["outcar"]["total_cores"] \
+        == timing["ncore"] * timing["npar"] * timing["kpar"]
+
+    return time_check, cores_check
@@ -0,0 +1,156 @@
+import os, json, math, time, threading
+from functools import wraps
+
+# Setting this environment variable to anything but "" or "0" enables profiling
+PROFILE_ENV = "PARALLEL_PROFILE"
+PROFILE_FILE = "profile.json"
+
+# The timing histograms have BINS_PER_DECADE log-spaced bins from MIN_SECONDS up,
+# and times outside of the bins are counted in the first or last one
+MIN_SECONDS = 1e-6
+BINS_PER_DECADE = 4
+N_BINS = 9 * BINS_PER_DECADE
+
+
+def bin_edges():
+    return [MIN_SECONDS * 10 ** (i / BINS_PER_DECADE) for i in range(N_BINS + 1)]
+
+
+class Profiler:
+    """
+    Named timers and counters of a session. For every timer the number of calls,
+    the total, minimum and maximum time and a histogram of the times are
+    aggregated, so the memory use does not grow with the number of calls. The
+    timers can be recorded from several threads.
+
+    Nothing is recorded unless the profiler is enabled.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def record(self, name, seconds):
+        index = 0 if seconds <= MIN_SECONDS else min(
+            int(math.log10(seconds / MIN_SECONDS) * BINS_PER_DECADE), N_BINS - 1
+        )
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = {"calls": 0, "total": 0.0, "min": seconds,
+                                             "max": seconds, "histogram": [0] * N_BINS}
+            timer["calls"] += 1
+            timer["total"] += seconds
+            timer["min"] = min(timer["min"], seconds)
+            timer["max"] = max(timer["max"], seconds)
+            timer["histogram"][index] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """
+        The timers, sorted by their total time, and counters, along with the bin
+        edges of the histograms.
+        """
+        with self._lock:
+            timers = {name: dict(t, mean=t["total"] / t["calls"],
+                                 histogram=list(t["histogram"]))
+                      for name, t in sorted(self.timers.items(),
+                                            key=lambda item: -item[1]["total"])}
+            return {"started": self.started, "duration": time.time() - self.started,
+                    "bin_edges": bin_edges(), "timers": timers,
+                    "counters": dict(sorted(self.counters.items()))}
+
+    def table(self):
+        """
+        Text table of the timers and counters.
+        """
+        summary = self.summary()
+        lines = ["%-40s %8s %10s %10s %10s" % ("timer", "calls", "total (s)", "mean (ms)",
+                                               "max (ms)")]
+        for name, t in summary["timers"].items():
+            lines.append("%-40s %8i %10.3f %10.3f %10.3f" % (
+                name, t["calls"], t["total"], t["mean"] * 1e3, t["max"] * 1e3))
+        for name, n in summary["counters"].items():
+            lines.append("%-40s %8i" % (name, n))
+        return "\n".join(lines)
+
+    def to_json(self, filename=PROFILE_FILE):
+        """
+        Write the summary to a json file.
+        """
+        with open(filename, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+        return filename
+
+
+PROFILER = Profiler(enabled=os.environ.get(PROFILE_ENV, "") not in ("", "0"))
+
+
+def enable():
+    PROFILER.enabled = True
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+class Timer:
+    """
+    Context manager that records the time spent in its block under name in the
+    PROFILER, in case it is enabled.
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter() if PROFILER.enabled else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            PROFILER.record(self.name, time.perf_counter() - self.start)
+
+
+def timed(name=None):
+    """
+    Decorator that records the time of every call of a function in the PROFILER
+    under name, by default the qualified name of the function. When profiling is
+    disabled, the only overhead is checking whether it is enabled.
+    """
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                PROFILER.record(label, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    """
+    Add n to the counter name of the PROFILER, in case it is enabled.
+    """
+    if PROFILER.enabled:
+        PROFILER.count(name, n)
@@ -0,0 +1,133 @@
+import os, sys, glob, json
+import numpy as np
+from functools import lru_cache
+
+from vscworkflows.firetasks.core import VaspParallelizationTask
+
+from timing_table import TimingTable
+from profiling import Timer, timed
+from data_index import parse_data_filename
+from performance_model import is_hybrid as is_hybrid_functional
+
+OPT_BAND_PARALLEL_PBE = 7
+OPT_BAND_PARALLEL_HSE = 8
+
+
+@lru_cache(maxsize=1024)
+def optimal_parallelization(nkpts, nbands, number_of_cores, cores_per_node, is_hybrid):
+    """
+    Memoized KPAR and NCORE recommended by VaspParallelizationTask, which is
+    needed for every node panel on every redraw of the chessboard and tetris plots.
+    """
+    opt_band_parallel = OPT_BAND_PARALLEL_HSE if is_hybrid else OPT_BAND_PARALLEL_PBE
+
+    with Timer("_optimize_parallelization"):
+        return VaspParallelizationTask._optimize_parallelization(
+            nkpts=nkpts, nbands=nbands, number_of_cores=number_of_cores,
+            cores_per_node=cores_per_node, opt_band_parallel=opt_band_parallel,
+            is_hybrid=is_hybrid
+        )
+
+
+@timed()
+def recommendation_table(n_kpoints, nbands, number_of_cores, cores_per_node,
+                         is_hybrid=False):
+    """
+    KPAR and NCORE recommended by VaspParallelizationTask for arrays (or scalars)
+    of numbers of k-points, bands, cores and cores per node, which are broadcast
+    against each other. Returns two integer arrays of the broadcast shape.
+
+    The heuristic itself only has a scalar implementation, so it is evaluated once
+    for every distinct combination of the inputs and the results are scattered
+    back to the full grid.
+    """
+    arrays = np.broadcast_arrays(
+        *[np.asarray(a, dtype=int) for a in (n_kpoints, nbands, number_of_cores,
+                                              cores_per_node)]
+    )
+    combinations, inverse = np.unique(np.column_stack([a.ravel() for a in arrays]),
+                                      axis=0, return_inverse=True)
+
+    settings = np.array([
+        optimal_parallelization(*[int(v) for v in c], is_hybrid=bool(is_hybrid))
+        for c in combinations
+    ], dtype=int).reshape(-1, 2)[inverse.ravel()]
+
+    return settings[:, 0].reshape(arrays[0].shape), settings[:, 1].reshape(arrays[0].shape)
+
+
+def recommendation_ranks(table, is_hybrid=False):
+    """
+    Rank of the recommended setting among the tested settings of each number of
+    nodes, with 1 the fastest one. Returns the numbers of nodes, the recommended
+    KPAR and NCORE, the ranks and the number of tested settings. The rank is 0 in
+    case the recommended setting was not tested.
+    """
+    nodes, first, n_settings = np.unique(table.nodes, return_index=True,
+                                         return_counts=True)
+    cores = table.cores[first]
+    kpar, ncore = recommendation_table(table.n_kpoints, table.nbands, cores,
+                                       cores // nodes, is_hybrid)
+
+    # Rank of every record within its number of nodes
+    order = np.lexsort((table.timing, table.nodes))
+    start = np.searchsorted(table.nodes[order], table.nodes[order])
+    record_ranks = np.empty(len(table), dtype=int)
+    record_ranks[order] = np.arange(len(table)) - start + 1
+
+    group = np.searchsorted(nodes, table.nodes)
+    recommended = (table.kpar == kpar[group]) & (table.ncore == ncore[group])
+
+    ranks = np.full(len(nodes), len(table) + 1)
+    np.minimum.at(ranks, group[recommended], record_ranks[recommended])
+    ranks[ranks > len(table)] = 0
+
+    return nodes, kpar, ncore, ranks, n_settings
+
+
+def validate_recommendations(tables):
+    """
+    Compare recommendation_table with direct calls of the scalar
+    VaspParallelizationTask heuristic for every number of nodes of the tables, a
+    dictionary of (table, is_hybrid) tuples. Returns the mismatches as (name,
+    nodes, vectorized, scalar) tuples.
+    """
+    mismatches = []
+
+    for name, (table, is_hybrid) in tables.items():
+        nodes, first = np.unique(table.nodes, return_index=True)
+        cores = table.cores[first]
+        kpar, ncore = recommendation_table(table.n_kpoints, table.nbands, cores,
+                                           cores // nodes, is_hybrid)
+
+        for n, c, vectorized in zip(nodes, cores, zip(kpar, ncore)):
+            scalar = VaspParallelizationTask._optimize_parallelization(
+                nkpts=table.n_kpoints, nbands=table.nbands, number_of_cores=int(c),
+                cores_per_node=int(c // n), is_hybrid=is_hybrid,
+                opt_band_parallel=OPT_BAND_PARALLEL_HSE if is_hybrid
+                else OPT_BAND_PARALLEL_PBE
+            )
+            if tuple(int(v) for v in vectorized) != tuple(scalar):
+                mismatches.append((name, int(n), tuple(int(v) for v in vectorized),
+                                   tuple(scalar)))
+
+    return mismatches
+
+
+if __name__ == "__main__":
+
+    files = sys.argv[1:] or glob.glob(os.path.join(os.path.dirname(__file__), "data", "*.json"))
+
+    tables = {}
+    for f in sorted(files):
+        with open(f, "r") as file:
+            table = TimingTable.from_data(json.load(file))
+        functional = (parse_data_filename(f) or {}).get("functional", "pbe")
+        tables[os.path.basename(f)] = (table, bool(is_hybrid_functional(functional)))
+
+    mismatches = validate_recommendations(tables)
+    for mismatch in mismatches:
+        print("Mismatch for %s, %i nodes: %s != %s" % mismatch)
+    print("Checked %i data files, %i mismatches." % (len(tables), len(mismatches)))
+    if mismatches:
+        sys.exit(1)
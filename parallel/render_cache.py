@@ -0,0 +1,150 @@
+import io
+from collections import OrderedDict
+from contextlib import redirect_stdout
+
+import matplotlib.pyplot as plt
+from IPython.display import display, clear_output, Image, SVG
+from ipywidgets import Output, fixed
+
+from profiling import Timer, count
+
+
+class RenderCache:
+    """
+    Least recently used cache of rendered plots, bounded by the total number of
+    bytes of the stored images and text. Once the budget is exceeded, the least
+    recently used renders are evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _size(render):
+        return len(render["text"]) + sum(len(image) for image in render["images"])
+
+    def get(self, key):
+        """
+        Render stored under key, or None in case it is not in the cache.
+        """
+        try:
+            render = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return render
+
+    def put(self, key, render):
+        """
+        Store a render under key. Renders that are larger than the budget of the
+        cache are not stored.
+        """
+        size = self._size(render)
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.n_bytes -= self._size(self._entries.pop(key))
+
+        self._entries[key] = render
+        self.n_bytes += size
+
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.n_bytes -= self._size(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self.n_bytes = 0
+
+
+RENDER_CACHE = RenderCache()
+
+
+def render_figures(f, kwargs, fmt="png"):
+    """
+    Call the plotting function f with kwargs and capture its output, i.e. the text
+    it prints and the figures it creates, rendered to fmt ("png" or "svg"). The
+    new figures are closed afterwards. A figure passed to f as kwargs["figure"],
+    which f draws into instead of creating a new one, is rendered as well (unless
+    it is left empty) but kept open, so it can be reused for the next render.
+    """
+    existing = set(plt.get_fignums())
+    text = io.StringIO()
+
+    name = getattr(f, "__name__", "plot")
+    with redirect_stdout(text), Timer("plot." + name):
+        f(**kwargs)
+
+    reused = kwargs.get("figure")
+    figures = [reused] if reused is not None and reused.axes else []
+    figures += [plt.figure(n) for n in plt.get_fignums() if n not in existing]
+
+    images = []
+    for figure in figures:
+        image = io.BytesIO()
+        with Timer("draw." + name):
+            figure.savefig(image, format=fmt, bbox_inches="tight")
+        if figure is not reused:
+            plt.close(figure)
+        images.append(image.getvalue())
+
+    return {"text": text.getvalue(), "images": images, "format": fmt}
+
+
+def show_render(render):
+
+    print(render["text"], end="")
+    for image in render["images"]:
+        if render["format"] == "svg":
+            display(SVG(data=image))
+        else:
+            display(Image(data=image, format=render["format"]))
+
+
+def cached_output(f, controls, key, cache=RENDER_CACHE, fmt="png"):
+    """
+    Version of ipywidgets.interactive_output that memoizes the rendered plots.
+
+    The cache key combines key, e.g. the hash of the data file and the name of the
+    plot, with the values of the (non-fixed) widgets in controls. Returning to a
+    previous combination of widget values shows the stored images instead of
+    redrawing them.
+    """
+    out = Output()
+
+    def observer(change):
+        kwargs = {k: v.value for k, v in controls.items()}
+        render_key = (key, tuple(sorted(
+            (k, v.value) for k, v in controls.items() if not isinstance(v, fixed)
+        )))
+
+        with out:
+            clear_output(wait=True)
+
+            render = cache.get(render_key)
+            count("render_cache.hits" if render is not None else "render_cache.misses")
+            if render is None:
+                render = render_figures(f, kwargs, fmt=fmt)
+                cache.put(render_key, render)
+
+            show_render(render)
+
+    for w in controls.values():
+        w.observe(observer, "value")
+    observer(None)
+
+    return out
@@ -0,0 +1,190 @@
+import os, sys, html, glob, argparse
+
+import matplotlib
+matplotlib.use("Agg")
+
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+
+from parallel_plots import load_table, time_plot, chessboard_plot, tetris_plot, \
+    optimal_settings, cost_plot
+from render_cache import render_figures
+from data_index import parse_data_filename
+from performance_model import is_hybrid
+from scaling import scaling_data, max_efficient_nodes
+
+REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "report")
+
+
+def dataset_plots(table, functional=None):
+    """
+    The plots of the report of a dataset, as (name, function, kwargs) tuples. The
+    chessboards are all drawn into the same reused figure.
+    """
+    hybrid = bool(is_hybrid(functional or "pbe"))
+    nodes = table.unique("nodes").tolist()
+    figure = Figure()
+
+    plots = [("time_vs_nodes", time_plot, {"table": table, "versus": "NODES"}),
+             ("time_vs_kpar", time_plot, {"table": table, "versus": "KPAR"})]
+
+    for n in nodes:
+        plots.append(("chessboard_" + str(n) + "nodes", chessboard_plot,
+                      {"table": table, "nodes": n, "x_axis": "NCORE", "is_hybrid": hybrid,
+                       "figure": figure}))
+
+    if len(nodes) > 1:
+        plots.append(("tetris", tetris_plot, {
+            "table": table, "nodes_choices": nodes,
+            "kpar_choices": table.unique("kpar").tolist(),
+            "ncore_choices": table.unique("ncore").tolist(), "is_hybrid": hybrid
+        }))
+
+    plots += [("optimal", optimal_settings, {"table": table, "is_hybrid": hybrid}),
+              ("cost", cost_plot, {"table": table})]
+
+    return plots
+
+
+def dataset_summary(filename, table):
+    """
+    Summary of a dataset for the overview table of the report: the metadata, the
+    tested numbers of nodes, the fastest setting overall and the largest number
+    of nodes with a parallel efficiency of at least 75%.
+    """
+    best = table.best("nodes")
+    fastest = int(best.timing.argmin())
+    nodes, _, speedup, _ = scaling_data(table)
+
+    return dict(
+        parse_data_filename(filename) or {},
+        file=os.path.basename(filename),
+        n_records=len(table),
+        nodes=table.unique("nodes").tolist(),
+        best={"nodes": int(best.nodes[fastest]), "kpar": int(best.kpar[fastest]),
+              "ncore": int(best.ncore[fastest]), "timing": float(best.timing[fastest])},
+        max_speedup=float(speedup.max()),
+        efficient_nodes=max_efficient_nodes(table, 0.75)
+    )
+
+
+def _page(title, body):
+    return ("<!DOCTYPE html>\n<html>\n<head><meta charset=\"utf-8\"><title>"
+            + html.escape(title) + "</title></head>\n<body>\n<h1>" + html.escape(title)
+            + "</h1>\n" + body + "</body>\n</html>\n")
+
+
+def render_dataset(filename, output_dir=REPORT_DIR, fmt="png"):
+    """
+    Render all plots of a data file to output_dir/<data file>/, along with an
+    index.html that shows them with the text they print. Plots that fail are
+    reported on the page instead. Returns the summary of the dataset, with the
+    errors of the failed plots under "errors".
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    dataset_dir = os.path.join(output_dir, stem)
+    os.makedirs(dataset_dir, exist_ok=True)
+
+    table, _ = load_table(filename)
+    functional = (parse_data_filename(filename) or {}).get("functional")
+
+    summary = dataset_summary(filename, table)
+    summary["page"] = stem + "/index.html"
+    summary["errors"] = {}
+
+    body = "<p>NKPTS = " + str(table.n_kpoints) + ", NBANDS = " + str(table.nbands) + "</p>\n"
+
+    for name, function, kwargs in dataset_plots(table, functional):
+        body += "<h2>" + html.escape(name) + "</h2>\n"
+        try:
+            render = render_figures(function, kwargs, fmt=fmt)
+        except Exception as error:
+            summary["errors"][name] = repr(error)
+            body += "<p>Failed: " + html.escape(repr(error)) + "</p>\n"
+            continue
+
+        if render["text"]:
+            body += "<pre>" + html.escape(render["text"]) + "</pre>\n"
+        for i, image in enumerate(render["images"]):
+            image_file = name + ("_" + str(i) if i else "") + "." + fmt
+            with open(os.path.join(dataset_dir, image_file), "wb") as file:
+                file.write(image)
+            body += "<img src=\"" + image_file + "\">\n"
+
+    with open(os.path.join(dataset_dir, "index.html"), "w") as file:
+        file.write(_page(stem, body))
+
+    return summary
+
+
+def _render_dataset(args):
+    return render_dataset(*args)
+
+
+def write_index(summaries, output_dir=REPORT_DIR):
+    """
+    Write the overview page of the report, with one row per dataset.
+    """
+    columns = ("cluster", "functional", "algo", "composition", "nbands", "n_kpoints")
+
+    rows = ""
+    for s in summaries:
+        best = s["best"]
+        rows += "<tr><td><a href=\"" + s["page"] + "\">" + html.escape(s["file"]) + "</a></td>"
+        rows += "".join("<td>" + html.escape(str(s.get(c, ""))) + "</td>" for c in columns)
+        rows += "<td>" + ", ".join(str(n) for n in s["nodes"]) + "</td>"
+        rows += "<td>%i nodes, KPAR = %i, NCORE = %i (%.1f s)</td>" % (
+            best["nodes"], best["kpar"], best["ncore"], best["timing"])
+        rows += "<td>%.1f</td><td>%s</td><td>%s</td></tr>\n" % (
+            s["max_speedup"], s["efficient_nodes"],
+            html.escape(", ".join(s["errors"])) or "")
+
+    header = "".join("<th>" + c + "</th>" for c in (
+        ("file",) + columns + ("nodes", "fastest setting", "max speedup",
+                               "nodes with 75% efficiency", "failed plots")
+    ))
+    body = "<table border=\"1\">\n<tr>" + header + "</tr>\n" + rows + "</table>\n"
+
+    index_file = os.path.join(output_dir, "index.html")
+    with open(index_file, "w") as file:
+        file.write(_page("Parallelization report", body))
+
+    return index_file
+
+
+def generate_report(filenames, output_dir=REPORT_DIR, workers=None, fmt="png"):
+    """
+    Render the report of every data file in filenames to output_dir, using a
+    pool of workers processes with one dataset per task. Setting workers to 1
+    renders the datasets serially in the current process. Returns the file name
+    of the overview page.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(f, output_dir, fmt) for f in sorted(filenames)]
+
+    if workers == 1 or len(tasks) < 2:
+        summaries = [_render_dataset(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(_render_dataset, tasks))
+
+    return write_index(summaries, output_dir)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Render the parallelization analysis of data files to an html report."
+    )
+    parser.add_argument("files", nargs="*",
+                        help="data files, by default all json files in data/")
+    parser.add_argument("-o", "--output-dir", default=REPORT_DIR)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    parser.add_argument("--format", choices=("png", "svg"), default="png")
+    args = parser.parse_args()
+
+    files = args.files or glob.glob(os.path.join(os.path.dirname(__file__), "data", "*.json"))
+    if not files:
+        sys.exit("No data files found.")
+
+    print(generate_report(files, args.output_dir, workers=args.workers, fmt=args.format))
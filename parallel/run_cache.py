@@ -0,0 +1,101 @@
+import os, json
+
+CACHE_FILE = ".parallel_cache.json"
+CACHE_VERSION = 3
+
+
+def outcar_fingerprint(run_dir):
+    """
+    Size and modification time (in ns) of the OUTCAR in run_dir, followed by
+    those of the INCAR, since the timings depend on its NELMDL. Returns None in
+    case there is no OUTCAR.
+    """
+    try:
+        stat = os.stat(os.path.join(run_dir, "OUTCAR"))
+    except FileNotFoundError:
+        return None
+    try:
+        incar_stat = os.stat(os.path.join(run_dir, "INCAR"))
+        incar = [incar_stat.st_size, incar_stat.st_mtime_ns]
+    except FileNotFoundError:
+        incar = [None, None]
+    return [stat.st_size, stat.st_mtime_ns] + incar
+
+
+class RunCache:
+    """
+    On-disk cache of the parsed calculations of parallelization tests, stored as a
+    json file. Each entry is keyed on the run directory relative to the directory
+    of the cache file, and is only reused as long as the size and modification
+    time of its OUTCAR and INCAR are unchanged. Cache files written by a different
+    CACHE_VERSION, i.e. with results in another format, are discarded.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.root_dir = os.path.dirname(os.path.abspath(cache_file))
+
+        try:
+            with open(cache_file, "r") as file:
+                content = json.loads(file.read())
+        except FileNotFoundError:
+            content = {}
+
+        if content.get("version") == CACHE_VERSION:
+            self.entries = content["entries"]
+        else:
+            self.entries = {}
+
+    def _key(self, run_dir):
+        return os.path.relpath(os.path.abspath(run_dir), self.root_dir)
+
+    def get(self, run):
+        """
+        Cached result of parse_run for run, or None in case the run has not been
+        cached or its OUTCAR has changed since.
+        """
+        entry = self.entries.get(self._key(run[3]))
+
+        if entry is None or entry["fingerprint"] != outcar_fingerprint(run[3]):
+            return None
+
+        return dict(entry, run=run)
+
+    def put(self, result):
+        """
+        Add a result of parse_run to the cache. Results without an OUTCAR are not
+        cached, so the run is parsed again once it is found.
+        """
+        if result["fingerprint"] is None:
+            return
+
+        self.entries[self._key(result["run"][3])] = {
+            k: v for k, v in result.items() if k != "run"
+        }
+
+    def split(self, runs):
+        """
+        Split runs in a dictionary of cached results and a list of runs that need
+        to be parsed.
+        """
+        cached = {}
+        stale = []
+
+        for run in runs:
+            result = self.get(run)
+            if result is None:
+                stale.append(run)
+            else:
+                cached[run] = result
+
+        return cached, stale
+
+    def save(self):
+        """
+        Write the cache to disk. The file is replaced atomically, so an
+        interrupted save never leaves a corrupt cache behind.
+        """
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "w") as file:
+            file.write(json.dumps({"version": CACHE_VERSION, "entries": self.entries}))
+        os.replace(tmp_file, self.cache_file)
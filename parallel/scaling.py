@@ -0,0 +1,140 @@
+import numpy as np
+
+
+def node_seconds(table):
+    """
+    Cost of each record, i.e. the node-seconds it takes per electronic step.
+    """
+    return table.timing * table.nodes
+
+
+def pareto_frontier(table):
+    """
+    Mask of the records on the Pareto frontier of the wall time against the cost
+    per electronic step, i.e. the records for which no other record is both
+    faster and cheaper.
+    """
+    cost = node_seconds(table)
+    order = np.lexsort((cost, table.timing))
+
+    # Walking from fast to slow, a record is only on the frontier if it is
+    # cheaper than all faster ones.
+    cheapest = np.minimum.accumulate(cost[order])
+    on_frontier = np.ones(len(order), dtype=bool)
+    on_frontier[1:] = cost[order][1:] < cheapest[:-1]
+
+    mask = np.zeros(len(table), dtype=bool)
+    mask[order[on_frontier]] = True
+
+    return mask
+
+
+def scaling_data(table):
+    """
+    Nodes, time per electronic step, speedup and parallel efficiency of the best
+    setting for each number of nodes, relative to the smallest number of nodes.
+    """
+    best = table.best("nodes")
+    nodes, timing = best.nodes.astype(float), best.timing
+
+    ratio = nodes / nodes[0]
+    speedup = timing[0] / timing
+
+    return nodes, timing, speedup, speedup / ratio
+
+
+def max_efficient_nodes(table, efficiency=0.75):
+    """
+    Largest tested number of nodes whose parallel efficiency is at least
+    efficiency, or None in case there is none.
+    """
+    nodes, _, _, parallel_efficiency = scaling_data(table)
+    efficient = nodes[parallel_efficiency >= efficiency]
+
+    return int(efficient.max()) if len(efficient) else None
+
+
+class AmdahlFit:
+    """
+    Amdahl's law for the best time per electronic step, T(r) = T0 (s + (1 - s) / r)
+    with r the number of nodes relative to the smallest number of nodes n0 and s
+    the serial fraction, fitted by linear least squares in 1 / r.
+    """
+
+    name = "Amdahl"
+
+    def __init__(self, nodes, timing):
+        self.n0 = nodes[0]
+        self.max_nodes = nodes[-1]
+        x = np.column_stack([np.ones(len(nodes)), self.n0 / np.asarray(nodes)])
+        (a, b), *_ = np.linalg.lstsq(x, timing, rcond=None)
+
+        self.t0 = a + b
+        self.serial_fraction = float(np.clip(a / self.t0, 0, 1))
+
+    def speedup(self, nodes):
+        ratio = np.asarray(nodes, dtype=float) / self.n0
+        return 1 / (self.serial_fraction + (1 - self.serial_fraction) / ratio)
+
+    def timing(self, nodes):
+        return self.t0 / self.speedup(nodes)
+
+
+class GustafsonFit:
+    """
+    Gustafson's law for the speedup, S(r) = r - s (r - 1), with r the number of
+    nodes relative to the smallest number of nodes n0 and s the serial fraction,
+    fitted by least squares on the measured speedups.
+    """
+
+    name = "Gustafson"
+
+    def __init__(self, nodes, timing):
+        self.n0 = nodes[0]
+        self.max_nodes = nodes[-1]
+        self.t0 = timing[0]
+        ratio = np.asarray(nodes, dtype=float) / self.n0
+        speedup = self.t0 / np.asarray(timing)
+
+        denominator = np.sum((ratio - 1) ** 2)
+        s = -np.sum((speedup - ratio) * (ratio - 1)) / denominator if denominator else 0
+        self.serial_fraction = float(np.clip(s, 0, 1))
+
+    def speedup(self, nodes):
+        ratio = np.asarray(nodes, dtype=float) / self.n0
+        return ratio - self.serial_fraction * (ratio - 1)
+
+    def timing(self, nodes):
+        return self.t0 / self.speedup(nodes)
+
+
+def recommend_nodes(fit, n_steps, budget=None, deadline=None, max_nodes=None):
+    """
+    Number of nodes for a calculation of n_steps electronic steps according to a
+    scaling fit, considering 1 up to max_nodes nodes (by default twice the
+    largest tested number of nodes). With a budget in node-hours, the fastest number of nodes
+    within the budget is returned. With a deadline in hours, the cheapest number
+    of nodes that finishes in time. With both, the fastest number of nodes that
+    satisfies both. Returns the number of nodes, the wall time and the
+    node-hours, or None in case no number of nodes satisfies the constraints.
+    """
+    if max_nodes is None:
+        max_nodes = 2 * int(fit.max_nodes)
+    nodes = np.arange(1, max_nodes + 1)
+
+    hours = fit.timing(nodes) * n_steps / 3600
+    node_hours = hours * nodes
+
+    allowed = np.ones(len(nodes), dtype=bool)
+    if budget:
+        allowed &= node_hours <= budget
+    if deadline:
+        allowed &= hours <= deadline
+
+    if not allowed.any():
+        return None
+
+    objective = node_hours if deadline and not budget else hours
+    choice = np.flatnonzero(allowed)[np.argmin(objective[allowed])]
+
+    return int(nodes[choice]), float(hours[choice]), float(node_hours[choice])
@@ -0,0 +1,185 @@
+import os, json, hashlib
+from collections import OrderedDict
+
+import numpy as np
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+from vscworkflows.setup.sets import BulkStaticSet
+
+from profiling import Timer
+
+SYMPREC = 1e-5
+
+
+def structure_hash(structure, decimals=5):
+    """
+    Hash of a structure that does not depend on the order of the sites or on
+    fractional coordinates being wrapped into the unit cell. The lattice and
+    coordinates are rounded to decimals.
+    """
+    lattice = np.round(structure.lattice.matrix, decimals) + 0.0
+    coords = np.round(np.mod(structure.frac_coords, 1), decimals) % 1 + 0.0
+    sites = sorted(
+        (str(site.species), tuple(c)) for site, c in zip(structure, coords.tolist())
+    )
+    return hashlib.sha1(json.dumps([lattice.tolist(), sites]).encode()).hexdigest()
+
+
+def settings_hash(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SystemCache:
+    """
+    Cache of the properties of a structure that are needed to set up its
+    parallelization tests, i.e. NELECT, ISPIN and the k-point mesh of the static
+    set, the spacegroup and the number of irreducible k-points of each k-point
+    mesh. The entries are keyed on the structure_hash, so the expensive symmetry
+    analysis is only done once per structure and mesh.
+
+    The entries are kept in a least recently used cache of max_size entries. If a
+    cache_file is provided, the entries are also stored in that json file by
+    save(), and looked up there on a miss.
+    """
+
+    def __init__(self, max_size=512, cache_file=None):
+        self.max_size = max_size
+        self.cache_file = cache_file
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._analyzers = OrderedDict()
+        self._unsaved = False
+
+        self._stored = {}
+        if cache_file is not None:
+            try:
+                with open(cache_file, "r") as file:
+                    self._stored = json.loads(file.read())
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        if key in self._stored:
+            self.hits += 1
+            self._put(key, self._stored[key])
+            return self._stored[key]
+        self.misses += 1
+        return None
+
+    def _put(self, key, value):
+        if key not in self._stored:
+            self._unsaved = True
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _analyzer(self, structure, key):
+        """
+        SpacegroupAnalyzer of the structure, of which only the most recent ones
+        are kept, as they are not stored on disk.
+        """
+        if key not in self._analyzers:
+            with Timer("SpacegroupAnalyzer"):
+                self._analyzers[key] = SpacegroupAnalyzer(structure, symprec=SYMPREC)
+            while len(self._analyzers) > 8:
+                self._analyzers.popitem(last=False)
+        self._analyzers.move_to_end(key)
+        return self._analyzers[key]
+
+    def spacegroup(self, structure):
+        """
+        Spacegroup symbol and number of the structure.
+        """
+        key = structure_hash(structure)
+        spacegroup = self._get("spacegroup:" + key)
+
+        if spacegroup is None:
+            analyzer = self._analyzer(structure, key)
+            spacegroup = [analyzer.get_space_group_symbol(),
+                          analyzer.get_space_group_number()]
+            self._put("spacegroup:" + key, spacegroup)
+
+        return spacegroup
+
+    def static_set(self, structure, user_incar_settings, kpt_density):
+        """
+        NELECT, ISPIN and k-point mesh of the static set of the structure.
+        """
+        key = "static:" + structure_hash(structure) + ":" \
+              + settings_hash(user_incar_settings) + ":" + str(kpt_density)
+        static = self._get(key)
+
+        if static is None:
+            with Timer("BulkStaticSet"):
+                static_set = BulkStaticSet(
+                    structure, user_incar_settings=user_incar_settings,
+                    user_kpoints_settings={"reciprocal_density": kpt_density}
+                )
+                static = {"nelect": static_set.nelect,
+                          "ispin": int(static_set.incar.get("ISPIN", 1)),
+                          "mesh": [int(m) for m in static_set.kpoints.kpts[0]]}
+            self._put(key, static)
+
+        return static
+
+    def n_kpoints(self, structure, mesh):
+        """
+        Number of irreducible k-points of the k-point mesh of the structure. Static
+        sets with the same mesh, e.g. for different INCAR settings or densities,
+        only need a single symmetry analysis.
+        """
+        key = structure_hash(structure)
+        mesh_key = "kpoints:" + key + ":" + "x".join(str(m) for m in mesh)
+        n_kpoints = self._get(mesh_key)
+
+        if n_kpoints is None:
+            analyzer = self._analyzer(structure, key)
+            with Timer("get_ir_reciprocal_mesh"):
+                n_kpoints = len(analyzer.get_ir_reciprocal_mesh(tuple(int(m) for m in mesh)))
+            self._put(mesh_key, n_kpoints)
+
+        return n_kpoints
+
+    def entries(self, structure):
+        """
+        Entries of a structure, e.g. to pass them from a worker process to the
+        cache of the parent process.
+        """
+        key = structure_hash(structure)
+        return {k: v for k, v in self._entries.items() if k.split(":")[1] == key}
+
+    def update(self, entries):
+        for key, value in entries.items():
+            self._put(key, value)
+
+    def clear(self):
+        self._entries.clear()
+        self._analyzers.clear()
+
+    def save(self):
+        """
+        Write the entries to the cache_file, along with those already stored
+        there, in case there are new ones. The file is replaced atomically.
+        """
+        if self.cache_file is None or not self._unsaved:
+            return
+
+        self._stored.update(self._entries)
+        self._unsaved = False
+        tmp_file = self.cache_file + ".tmp"
+        with open(tmp_file, "w") as file:
+            file.write(json.dumps(self._stored))
+        os.replace(tmp_file, self.cache_file)
+
+
+SYSTEM_CACHE = SystemCache(
+    cache_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".system_cache.json")
+)
@@ -0,0 +1,116 @@
+import numpy as np
+
+from profiling import timed
+
+TRIM_PROPORTION = 0.1
+
+
+def nanmean(steps):
+    return np.nanmean(steps, axis=-1)
+
+
+def nanmedian(steps):
+    return np.nanmedian(steps, axis=-1)
+
+
+def trimmed_nanmean(steps, proportion=TRIM_PROPORTION):
+    """
+    Mean along the last axis of an array padded with NaN, leaving out the
+    proportion of the smallest and largest values of each row.
+    """
+    counts = np.sum(~np.isnan(steps), axis=-1, keepdims=True)
+    trim = np.floor(proportion * counts).astype(int)
+
+    # NaN's are sorted to the end, so the values of each row come first
+    ordered = np.sort(steps, axis=-1)
+    position = np.arange(steps.shape[-1])
+    kept = (position >= trim) & (position < counts - trim)
+
+    return np.sum(np.where(kept, ordered, 0), axis=-1) / np.sum(kept, axis=-1)
+
+
+STATISTICS = {
+    "mean": nanmean,
+    "median": nanmedian,
+    "trimmed mean": trimmed_nanmean
+}
+
+
+def estimate(table, statistic="mean"):
+    """
+    Estimate of the time per electronic step of each record, computed from the
+    electronic steps with one of the STATISTICS. For a table without steps, the
+    average timing is returned.
+    """
+    if not table.has_steps or len(table) == 0:
+        return table.timing
+
+    return STATISTICS[statistic](table.padded_steps())
+
+
+@timed()
+def robust_table(table, statistic="mean"):
+    """
+    Table with the timing of each record replaced by the statistic.
+    """
+    if statistic == "mean" or not table.has_steps:
+        return table
+    return table.with_timing(estimate(table, statistic))
+
+
+@timed()
+def bootstrap_ci(table, statistic="mean", n_resamples=1000, confidence=0.95, seed=0,
+                 chunk_size=32):
+    """
+    Percentile bootstrap confidence interval of the statistic of each record.
+
+    The resamples of all records are drawn at once, as an array of shape
+    (records, n_resamples, steps) padded with NaN beyond the number of steps of
+    each record, and processed in chunks of chunk_size records to limit the
+    memory use. Records of a table without steps get an interval of zero width
+    around their timing.
+
+    Returns the lower and upper bounds.
+    """
+    if not table.has_steps or len(table) == 0:
+        return table.timing.copy(), table.timing.copy()
+
+    rng = np.random.default_rng(seed)
+    steps = table.padded_steps()
+    counts = table.step_counts()
+    function = STATISTICS[statistic]
+    alpha = (1 - confidence) / 2
+
+    lower = np.empty(len(table))
+    upper = np.empty(len(table))
+
+    for start in range(0, len(table), chunk_size):
+        rows = slice(start, start + chunk_size)
+        chunk, n = steps[rows], counts[rows, None, None]
+
+        draws = (rng.random((len(chunk), n_resamples, chunk.shape[1])) * n).astype(int)
+        resamples = np.take_along_axis(chunk[:, None, :], draws, axis=-1)
+        resamples = np.where(np.arange(chunk.shape[1]) < n, resamples, np.nan)
+
+        statistics = function(resamples)
+        lower[rows], upper[rows] = np.quantile(statistics, [alpha, 1 - alpha], axis=1)
+
+    return lower, upper
+
+
+def indistinguishable(table, lower, upper, by="nodes"):
+    """
+    Mask of the records whose confidence interval overlaps with that of the
+    fastest record with the same value of the by setting, i.e. the settings that
+    can not be told apart from the best one. The fastest record is determined by
+    the timing column of the table, and is included in the mask.
+    """
+    column = table.column(by)
+    mask = np.zeros(len(table), dtype=bool)
+
+    for value in np.unique(column):
+        group = np.flatnonzero(column == value)
+        best = group[np.argmin(table.timing[group])]
+        mask[group] = lower[group] <= upper[best]
+
+    return mask
@@ -0,0 +1,252 @@
+import os, sys, json, zlib, struct, hashlib, tempfile
+import numpy as np
+
+from monty.json import MontyEncoder
+from pymatgen import Structure
+
+from timing_table import TimingTable
+
+MAGIC = b"PTIMING1"
+EXTENSION = ".tbin"
+ALIGNMENT = 64
+
+COLUMNS = (
+    ("nodes", "<i8"),
+    ("kpar", "<i8"),
+    ("ncore", "<i8"),
+    ("npar", "<i8"),
+    ("timing", "<f8")
+)
+
+STEP_COLUMNS = (
+    ("step_values", "<f4"),
+    ("step_offsets", "<i8")
+)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_binary(data, filename):
+    """
+    Write the data of a parallelization test to the binary format, which consists
+    of:
+
+    - the MAGIC bytes, followed by the length of the header as a little-endian
+      unsigned 64-bit integer;
+    - a json header with the metadata, i.e. the number of records, NBANDS, NKPTS,
+      any other keys of data and the offsets of the sections below;
+    - one contiguous array per column of the timing_list, aligned to ALIGNMENT
+      bytes so they can be memory mapped. In case the entries have the timings of
+      the electronic steps, these are stored as a ragged float32 array, see
+      TimingTable;
+    - the zlib-compressed json of the structure.
+
+    The offsets in the header are relative to the end of the header, padded to
+    ALIGNMENT bytes.
+    """
+    timing_list = data["timing_list"]
+    structure = data["structure"]
+    if isinstance(structure, Structure):
+        structure = structure.as_dict()
+
+    sections = []
+    header = {
+        "n_records": len(timing_list),
+        "nbands": data["nbands"],
+        "n_kpoints": data["n_kpoints"],
+        "extra": {k: v for k, v in data.items()
+                  if k not in ("structure", "nbands", "n_kpoints", "timing_list")},
+        "columns": {}
+    }
+
+    columns = {name: np.array([t[name] for t in timing_list], dtype=dtype)
+               for name, dtype in COLUMNS}
+
+    table = TimingTable.from_timing_list(timing_list)
+    if table.has_steps:
+        columns["step_values"] = table.step_values.astype(STEP_COLUMNS[0][1])
+        columns["step_offsets"] = table.step_offsets.astype(STEP_COLUMNS[1][1])
+
+    offset = 0
+    for name, column in columns.items():
+        header["columns"][name] = {"dtype": column.dtype.str, "offset": offset,
+                                   "length": len(column)}
+        sections.append((offset, column.tobytes()))
+        offset = _align(offset + column.nbytes)
+
+    structure_bytes = zlib.compress(json.dumps(structure, cls=MontyEncoder).encode())
+    header["structure"] = {"offset": offset, "length": len(structure_bytes)}
+    sections.append((offset, structure_bytes))
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    with open(filename, "wb") as file:
+        file.write(MAGIC + struct.pack("<Q", len(header_bytes)) + header_bytes)
+        for offset, section in sections:
+            file.seek(data_start + offset)
+            file.write(section)
+
+
+class TimingDataset:
+    """
+    Parallelization test data stored in the binary format written by write_binary.
+
+    Opening the dataset only reads the header. The timing columns are memory
+    mapped on first access and the structure is only decompressed and decoded
+    when it is requested.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(filename + " is not a binary timing file.")
+            header_length = struct.unpack("<Q", file.read(8))[0]
+            self.header = json.loads(file.read(header_length).decode())
+
+        self._data_start = _align(len(MAGIC) + 8 + header_length)
+        self._columns = {}
+        self._table = None
+        self._structure = None
+
+        self.n_records = self.header["n_records"]
+        self.nbands = self.header["nbands"]
+        self.n_kpoints = self.header["n_kpoints"]
+
+    def __len__(self):
+        return self.n_records
+
+    @property
+    def fingerprint(self):
+        """
+        Hash of the file name, size and modification time, which identifies the
+        dataset without reading it.
+        """
+        stat = os.stat(self.filename)
+        return hashlib.sha1(
+            (os.path.abspath(self.filename) + str(stat.st_size)
+             + str(stat.st_mtime_ns)).encode()
+        ).hexdigest()
+
+    def column(self, name):
+        """
+        Read-only memory mapped array of a column of the timing_list.
+        """
+        if name not in self._columns:
+            info = self.header["columns"][name]
+            length = info.get("length", self.n_records)
+            if length == 0:
+                self._columns[name] = np.empty(0, dtype=info["dtype"])
+            else:
+                self._columns[name] = np.memmap(
+                    self.filename, dtype=info["dtype"], mode="r",
+                    offset=self._data_start + info["offset"], shape=(length,)
+                )
+        return self._columns[name]
+
+    @property
+    def has_steps(self):
+        return "step_values" in self.header["columns"]
+
+    @property
+    def table(self):
+        if self._table is None:
+            steps = {}
+            if self.has_steps:
+                steps = {name: self.column(name) for name, _ in STEP_COLUMNS}
+            self._table = TimingTable(
+                *[self.column(name) for name in ("nodes", "kpar", "npar", "ncore", "timing")],
+                n_kpoints=self.n_kpoints, nbands=self.nbands, **steps
+            )
+        return self._table
+
+    def structure_dict(self):
+        """
+        Dictionary representation of the structure, as stored in the json files.
+        """
+        info = self.header["structure"]
+        with open(self.filename, "rb") as file:
+            file.seek(self._data_start + info["offset"])
+            return json.loads(zlib.decompress(file.read(info["length"])).decode())
+
+    @property
+    def structure(self):
+        if self._structure is None:
+            self._structure = Structure.from_dict(self.structure_dict())
+        return self._structure
+
+    def to_dict(self):
+        """
+        The data in the format of the json files, with the structure as a
+        dictionary.
+        """
+        data = {
+            "structure": self.structure_dict(),
+            "nbands": self.nbands,
+            "n_kpoints": self.n_kpoints,
+            "timing_list": self.table.to_timing_list()
+        }
+        data.update(self.header["extra"])
+        return data
+
+
+def json_to_binary(json_file, binary_file=None):
+    """
+    Convert a json data file to the binary format. By default, the binary file is
+    written next to the json file, with the EXTENSION instead of .json.
+    """
+    if binary_file is None:
+        binary_file = os.path.splitext(json_file)[0] + EXTENSION
+
+    with open(json_file, "r") as file:
+        write_binary(json.loads(file.read()), binary_file)
+
+    return binary_file
+
+
+def binary_to_json(binary_file, json_file=None):
+    """
+    Convert a binary data file back to the json format.
+    """
+    if json_file is None:
+        json_file = os.path.splitext(binary_file)[0] + ".json"
+
+    with open(json_file, "w") as file:
+        file.write(json.dumps(TimingDataset(binary_file).to_dict(), cls=MontyEncoder))
+
+    return json_file
+
+
+def round_trip_differences(json_file):
+    """
+    Keys of the json data file that are not restored exactly when converting it
+    to the binary format and back.
+    """
+    with open(json_file, "r") as file:
+        original = json.loads(file.read())
+
+    with tempfile.TemporaryDirectory() as directory:
+        binary_file = json_to_binary(json_file, os.path.join(directory, "data" + EXTENSION))
+        with open(binary_to_json(binary_file), "r") as file:
+            restored = json.loads(file.read())
+
+    return sorted(key for key in set(original) | set(restored)
+                  if original.get(key) != restored.get(key))
+
+
+if __name__ == "__main__":
+
+    failed = False
+    for json_file in sys.argv[1:]:
+        different = round_trip_differences(json_file)
+        if different:
+            failed = True
+            print("%s: %s not restored exactly" % (json_file, ", ".join(different)))
+        else:
+            print("%s: restored exactly" % json_file)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,260 @@
+import numpy as np
+
+from profiling import timed
+
+SETTINGS = ("nodes", "kpar", "npar", "ncore")
+
+
+def _lookup(values, axis):
+    """
+    Indices of values in axis, along with a mask of the values that are found.
+    The axis does not need to be sorted.
+    """
+    axis = np.asarray(axis)
+    if len(axis) == 0:
+        return np.zeros(len(values), dtype=int), np.zeros(len(values), dtype=bool)
+
+    order = np.argsort(axis, kind="stable")
+    sorted_axis = axis[order]
+
+    position = np.clip(np.searchsorted(sorted_axis, values), 0, len(axis) - 1)
+
+    return order[position], sorted_axis[position] == values
+
+
+def _take_ragged(values, offsets, index):
+    """
+    Values and offsets of the rows index of a ragged array, stored as the
+    concatenated values and the offsets of the rows in them.
+    """
+    lengths = np.diff(offsets)[index]
+    new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+
+    positions = np.repeat(offsets[:-1][index] - new_offsets[:-1], lengths) \
+        + np.arange(new_offsets[-1])
+
+    return values[positions], new_offsets
+
+
+class TimingTable:
+    """
+    Columnar representation of a timing_list, with the nodes, kpar, npar and ncore
+    settings stored as integer arrays and the average time per electronic step as
+    a float array. The sorted unique values of each setting are computed once, on
+    construction.
+
+    The number of k-points and bands of the calculation are kept as attributes,
+    as they are needed for the VaspParallelizationTask recommendations.
+
+    Optionally, the table also holds the time of every electronic step each
+    average is based on, as a float32 ragged array: step_values contains the
+    steps of all records one after the other and the steps of record i are
+    step_values[step_offsets[i]:step_offsets[i + 1]].
+    """
+
+    def __init__(self, nodes, kpar, npar, ncore, timing, n_kpoints=None, nbands=None,
+                 step_values=None, step_offsets=None):
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+        self.kpar = np.asarray(kpar, dtype=np.int64)
+        self.npar = np.asarray(npar, dtype=np.int64)
+        self.ncore = np.asarray(ncore, dtype=np.int64)
+        self.timing = np.asarray(timing, dtype=np.float64)
+        self.n_kpoints = n_kpoints
+        self.nbands = nbands
+
+        if step_values is None:
+            self.step_values = self.step_offsets = None
+        else:
+            self.step_values = np.asarray(step_values, dtype=np.float32)
+            self.step_offsets = np.asarray(step_offsets, dtype=np.int64)
+
+        self.axes = {s: np.unique(getattr(self, s)) for s in SETTINGS}
+
+    @classmethod
+    def from_timing_list(cls, timing_list, n_kpoints=None, nbands=None):
+        """
+        Table from a timing_list. The electronic steps are only kept in case every
+        entry has a "steps" list.
+        """
+        step_values = step_offsets = None
+
+        if timing_list and all("steps" in t for t in timing_list):
+            step_offsets = np.zeros(len(timing_list) + 1, dtype=np.int64)
+            np.cumsum([len(t["steps"]) for t in timing_list], out=step_offsets[1:])
+            step_values = np.array([s for t in timing_list for s in t["steps"]],
+                                   dtype=np.float32)
+
+        return cls(
+            nodes=[t["nodes"] for t in timing_list],
+            kpar=[t["kpar"] for t in timing_list],
+            npar=[t["npar"] for t in timing_list],
+            ncore=[t["ncore"] for t in timing_list],
+            timing=[t["timing"] for t in timing_list],
+            n_kpoints=n_kpoints, nbands=nbands,
+            step_values=step_values, step_offsets=step_offsets
+        )
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Table from the dictionary stored in the parallel/data files.
+        """
+        return cls.from_timing_list(data["timing_list"], n_kpoints=data["n_kpoints"],
+                                    nbands=data["nbands"])
+
+    def to_timing_list(self):
+        timing_list = [{"nodes": int(n), "kpar": int(k), "ncore": int(c), "npar": int(p),
+                        "timing": float(t)}
+                       for n, k, c, p, t in zip(self.nodes, self.kpar, self.ncore,
+                                                self.npar, self.timing)]
+
+        if self.has_steps:
+            for i, record in enumerate(timing_list):
+                record["steps"] = self.steps(i).tolist()
+
+        return timing_list
+
+    def __len__(self):
+        return len(self.timing)
+
+    @property
+    def has_steps(self):
+        return self.step_values is not None
+
+    def steps(self, i):
+        """
+        Time of each electronic step of record i.
+        """
+        return self.step_values[self.step_offsets[i]:self.step_offsets[i + 1]]
+
+    def step_counts(self):
+        return np.diff(self.step_offsets)
+
+    def padded_steps(self):
+        """
+        Electronic steps as a 2D array with one row per record, padded with NaN up
+        to the largest number of steps.
+        """
+        counts = self.step_counts()
+        padded = np.full((len(self), counts.max(initial=0)), np.nan)
+
+        rows = np.repeat(np.arange(len(self)), counts)
+        columns = np.arange(len(self.step_values)) - np.repeat(self.step_offsets[:-1], counts)
+        padded[rows, columns] = self.step_values
+
+        return padded
+
+    @property
+    def cores(self):
+        """
+        Total number of cores of each setting.
+        """
+        return self.kpar * self.npar * self.ncore
+
+    def column(self, name):
+        """
+        Array of a column of the table, e.g. "nodes" or "timing".
+        """
+        return getattr(self, name)
+
+    def unique(self, setting):
+        """
+        Sorted unique values of a setting, i.e. "nodes", "kpar", "npar" or "ncore".
+        """
+        return self.axes[setting]
+
+    def take(self, mask):
+        """
+        Table with the rows selected by a boolean mask or index array.
+        """
+        step_values = step_offsets = None
+        if self.has_steps:
+            index = np.arange(len(self))[mask]
+            step_values, step_offsets = _take_ragged(self.step_values, self.step_offsets,
+                                                     index)
+
+        return TimingTable(self.nodes[mask], self.kpar[mask], self.npar[mask],
+                           self.ncore[mask], self.timing[mask],
+                           n_kpoints=self.n_kpoints, nbands=self.nbands,
+                           step_values=step_values, step_offsets=step_offsets)
+
+    def with_timing(self, timing):
+        """
+        Copy of the table with a different timing column, e.g. a robust estimate
+        of the time per electronic step.
+        """
+        return TimingTable(self.nodes, self.kpar, self.npar, self.ncore, timing,
+                           n_kpoints=self.n_kpoints, nbands=self.nbands,
+                           step_values=self.step_values, step_offsets=self.step_offsets)
+
+    @timed("TimingTable.mask")
+    def mask(self, **conditions):
+        """
+        Boolean mask of the rows that match all conditions. Each condition maps a
+        column to a single value, a sequence of accepted values or a function that
+        returns a boolean array for the column, e.g.
+        mask(nodes=4, kpar=[1, 2], timing=lambda t: t < 10).
+        """
+        mask = np.ones(len(self), dtype=bool)
+
+        for setting, value in conditions.items():
+            column = self.column(setting)
+            if callable(value):
+                mask &= value(column)
+            elif np.ndim(value) == 0:
+                mask &= column == value
+            else:
+                mask &= np.isin(column, value)
+
+        return mask
+
+    def select(self, **conditions):
+        """
+        Table with the rows that match all conditions, see mask.
+        """
+        return self.take(self.mask(**conditions))
+
+    @timed("TimingTable.pivot")
+    def pivot(self, x="ncore", y="kpar", x_values=None, y_values=None, value="timing",
+              **conditions):
+        """
+        Grid of the timings of the rows that match the conditions, with the values
+        of the x setting along the columns and the y setting along the rows.
+        Instead of the timings, the grid can hold another column or an array with
+        a value for each row of the table, see value.
+
+        By default the axes are the sorted unique x and y values of the selected
+        rows. Alternatively, the values and their order can be specified with
+        x_values and y_values, in which case rows with other values are left out.
+        Missing combinations are NaN.
+
+        Returns the grid, the y values and the x values.
+        """
+        selection = self.mask(**conditions)
+        x_column, y_column = self.column(x)[selection], self.column(y)[selection]
+        timing = (self.column(value) if isinstance(value, str) else np.asarray(value))[selection]
+
+        x_values = np.unique(x_column) if x_values is None else np.asarray(x_values)
+        y_values = np.unique(y_column) if y_values is None else np.asarray(y_values)
+
+        x_index, x_found = _lookup(x_column, x_values)
+        y_index, y_found = _lookup(y_column, y_values)
+        found = x_found & y_found
+
+        grid = np.full((len(y_values), len(x_values)), np.nan)
+        grid[y_index[found], x_index[found]] = timing[found]
+
+        return grid, y_values, x_values
+
+    def best(self, by="nodes"):
+        """
+        Table with the fastest setting for each unique value of the by setting,
+        sorted by that value.
+        """
+        column = self.column(by)
+        order = np.lexsort((self.timing, column))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = column[order][1:] != column[order][:-1]
+
+        return self.take(order[first])